@@ -266,6 +266,7 @@ if st.session_state.grading_step == 4:
     st.header("Step 4: Grade Submission")
     
     uploaded_file = st.file_uploader("Upload Student Submission", type=["xlsx", "xlsm", "docx", "txt"])
+    template_file = st.file_uploader("Upload Blank Template (optional: grade only what the student changed)", type=["xlsx", "xlsm"])
     
     if st.button("Grade Submission", type="primary"):
         if not uploaded_file:
@@ -276,12 +277,19 @@ if st.session_state.grading_step == 4:
                 with tempfile.NamedTemporaryFile(delete=False, suffix=f".{uploaded_file.name.split('.')[-1]}") as tmp_file:
                     tmp_file.write(uploaded_file.getvalue())
                     tmp_path = tmp_file.name
+
+                template_path = None
+                if template_file:
+                    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{template_file.name.split('.')[-1]}") as tmp_template:
+                        tmp_template.write(template_file.getvalue())
+                        template_path = tmp_template.name
                 
                 try:
                     # Execute grade using the generated rubric
                     full_results = grade_submission(
                         tmp_path, 
-                        rubric_data=st.session_state.generated_rubric
+                        rubric_data=st.session_state.generated_rubric,
+                        template_path=template_path
                     )
                     
                     results = full_results.get("report", {})
@@ -326,6 +334,8 @@ if st.session_state.grading_step == 4:
                 finally:
                     if os.path.exists(tmp_path):
                         os.remove(tmp_path)
+                    if template_path and os.path.exists(template_path):
+                        os.remove(template_path)
 
     if st.button("← Back to Criteria"):
         st.session_state.grading_step = 3
@@ -0,0 +1,59 @@
+"""
+Memory benchmark: per-cell dicts vs SheetCells for a synthetic 100k-cell sheet.
+Usage: python bench_cell_store.py [rows]
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from utils.xml_helper import iter_sheet_rows, parse_sheet_full
+
+HEAD = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>
+"""
+
+def write_sheet(path, rows):
+    with open(path, 'w') as f:
+        f.write(HEAD)
+        for r in range(1, rows + 1):
+            f.write(f'<row r="{r}">'
+                    f'<c r="A{r}" t="s" s="1"><v>{r % 50}</v></c>'
+                    f'<c r="B{r}" s="2"><v>{r * 1.5}</v></c>'
+                    f'<c r="C{r}" s="2"><v>{r % 7}</v></c>'
+                    f'<c r="D{r}" s="3"><f>B{r}*C{r}</f><v>{r * 1.5 * (r % 7)}</v></c>'
+                    f'<c r="E{r}" t="s"><v>{r % 3}</v></c>'
+                    f'</row>\n')
+        f.write("</sheetData></worksheet>\n")
+
+def measure(label, build):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    cells = build()
+    elapsed = time.perf_counter() - t0
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<12} {len(cells):>8} cells  retained {current / 2**20:7.1f} MB  peak {peak / 2**20:7.1f} MB  {elapsed:5.2f}s")
+    return current
+
+def dict_cells(path, shared_strings):
+    cells = {}
+    for _, row_cells in iter_sheet_rows(path, shared_strings):
+        cells.update(row_cells)
+    return cells
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    shared_strings = [f"Category {i}" for i in range(50)]
+    fd, path = tempfile.mkstemp(suffix=".xml")
+    os.close(fd)
+    try:
+        write_sheet(path, rows)
+        before = measure("dict", lambda: dict_cells(path, shared_strings))
+        after = measure("SheetCells", lambda: parse_sheet_full(path, shared_strings)[0])
+        print(f"retained memory: {before / after:.1f}x smaller")
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+End-to-end grading throughput against the simulated model backend (no API calls).
+Usage: python bench_grading_throughput.py [copies] [max_in_flight] [latency_seconds]
+"""
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault("GRADER_LLM_RPM", "0")  # Measure the pipeline, not the client-side quota
+os.environ["GRADER_LLM_CACHE"] = "0"
+
+from grader import grade_many
+from utils.context_cache import get_context_cache
+from utils.llm_backend import SimulatedBackend, set_backend
+from utils.request_governor import get_governor
+
+WORKBOOKS = ["grossjordan_34944_1593395_Data Visualization - Jordan Gross.xlsm", "JB - Data Visualization.xlsm",
+             "Data Visualization (2) copy.xlsm", "DataManagement.xlsm"]
+
+def main(copies=5, max_in_flight=8, latency=0.8):
+    backend = SimulatedBackend(latency=latency, seed=0)
+    set_backend(backend)
+    paths = WORKBOOKS * copies
+    started = time.perf_counter()
+    results = asyncio.run(grade_many(paths, max_in_flight=max_in_flight, local_checks=False))
+    elapsed = time.perf_counter() - started
+
+    stats = backend.stats()
+    failed = sum(1 for r in results if "error" in r or "error" in r.get("report", {}))
+    print(f"{len(paths)} submissions in {elapsed:.2f}s ({len(paths) / elapsed:.2f}/s), {failed} failed")
+    print(f"model calls {stats['calls']}, peak in flight {stats['peak_in_flight']}, "
+          f"tokens in/out {stats['input_tokens']}/{stats['output_tokens']}")
+    print(f"governor {get_governor().stats()}")
+    print(f"context cache {get_context_cache().stats()}")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 5, int(args[1]) if len(args) > 1 else 8, float(args[2]) if len(args) > 2 else 0.8)
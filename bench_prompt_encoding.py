@@ -0,0 +1,23 @@
+"""
+Prompt size benchmark: indented JSON vs the compact prompt encoding, per workbook.
+Usage: python bench_prompt_encoding.py [workbook ...]
+"""
+import glob
+import sys
+from utils.prompt_encoding import token_report
+from utils.xml_helper import parse_workbook_to_json
+
+def main(paths):
+    total_before = total_after = 0
+    for path in paths:
+        report = token_report(parse_workbook_to_json(path))
+        total_before += report["json_tokens"]
+        total_after += report["encoded_tokens"]
+        print(f"{path[:60]:<60} {report['json_tokens']:>9} -> {report['encoded_tokens']:>8} tokens"
+              f"  ({report['saved_percent']:.1f}% saved)")
+    if len(paths) > 1 and total_before:
+        print(f"{'total':<60} {total_before:>9} -> {total_after:>8} tokens"
+              f"  ({100.0 * (total_before - total_after) / total_before:.1f}% saved)")
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or sorted(glob.glob("*.xlsm")))
@@ -0,0 +1,51 @@
+"""
+Startup benchmark: import cost (python -X importtime) and wall time of a fresh interpreter
+for the parse-only, local-grading and CLI paths, next to the same paths with google.genai
+imported up front as it used to be.
+Usage: python bench_startup.py [runs]
+"""
+import os
+import subprocess
+import sys
+import time
+
+SCENARIOS = {
+    "parse only": "import grader; from utils.xml_helper import parse_workbook_to_json; "
+                  "parse_workbook_to_json('DataManagement.xlsm')",
+    "local grade": "from grader import grade_submission; grade_submission('DataManagement.xlsm', rubric_path='rubric_sample.json')",
+    "CLI import": "import grader",
+}
+EAGER = "import google.genai; "
+CHECK = "; import sys; assert 'google.genai' not in sys.modules, 'google.genai was imported'"
+
+def import_ms(code):
+    """Total import time in ms reported by -X importtime (top-level modules only)."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True,
+                            env=dict(os.environ, GRADER_PARSE_CACHE="0"), check=True)
+    total = 0
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) == 3 and parts[1].strip().isdigit() and not parts[2].startswith("  "):
+            total += int(parts[1])
+    return total / 1000.0
+
+def wall_ms(code, runs):
+    best = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", code], check=True, env=dict(os.environ, GRADER_PARSE_CACHE="0"))
+        elapsed = (time.perf_counter() - started) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(runs=3):
+    print(f"{'path':<14} {'imports (ms)':>22} {'wall, best of ' + str(runs) + ' (ms)':>28}")
+    print(f"{'':<14} {'lazy':>10} {'eager':>11} {'lazy':>14} {'eager':>13}")
+    for name, code in SCENARIOS.items():
+        lazy_imports, eager_imports = import_ms(code + CHECK), import_ms(EAGER + code)
+        lazy_wall, eager_wall = wall_ms(code + CHECK, runs), wall_ms(EAGER + code, runs)
+        print(f"{name:<14} {lazy_imports:>10.1f} {eager_imports:>11.1f} {lazy_wall:>14.1f} {eager_wall:>13.1f}"
+              f"   ({100.0 * lazy_wall / eager_wall:.0f}% of eager)")
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 3)
@@ -0,0 +1,16 @@
+import os
+import shutil
+import tempfile
+
+# The test run never touches ~/.cache/excel-grader: the parse cache is off (tests count
+# parses), and the response cache, parse cache and local batch jobs live in a temporary
+# directory removed at the end. Set before any test module creates the caches.
+_CACHE_DIR = tempfile.mkdtemp(prefix="excel-grader-tests-")
+os.environ["GRADER_PARSE_CACHE"] = "0"
+os.environ["GRADER_PARSE_CACHE_DIR"] = os.path.join(_CACHE_DIR, "parse")
+os.environ["GRADER_LLM_CACHE_PATH"] = os.path.join(_CACHE_DIR, "llm.sqlite3")
+os.environ["GRADER_BATCH_DIR"] = os.path.join(_CACHE_DIR, "batches")
+
+
+def pytest_unconfigure(config):
+    shutil.rmtree(_CACHE_DIR, ignore_errors=True)
@@ -1,16 +1,11 @@
-from utils.xml_helper import get_sheet_map, get_shared_strings, parse_sheet_data
-import zipfile
-import tempfile
-import shutil
-import os
+from utils.xml_helper import get_sheet_map, get_shared_strings, parse_sheet_full
+from utils.package import open_package
 
 f = "DataManagement.xlsm"
-t = tempfile.mkdtemp()
-with zipfile.ZipFile(f, 'r') as z:
-    z.extractall(t)
+package = open_package(f)
 
-s_map = get_sheet_map(t)
-ss = get_shared_strings(t)
+s_map = get_sheet_map(package)
+ss = get_shared_strings(package)
 
 # Find sheet with "score" or "rubric" in name
 target_sheet = None
@@ -22,7 +17,7 @@ for k in s_map.keys():
 if target_sheet:
     print(f"Found Rubric Sheet: {target_sheet}")
     xml = s_map[target_sheet]
-    data = parse_sheet_data(xml, ss)
+    data, _ = parse_sheet_full(xml, ss, package)
     # Dump first 50 items to see structure
     # Sort keys to make it readable row-by-row
     sorted_items = sorted(data.items(), key=lambda x: (int(''.join(filter(str.isdigit, x[0])) or 0), x[0]))
@@ -31,4 +26,4 @@ if target_sheet:
 else:
     print("No rubric sheet found.")
 
-shutil.rmtree(t)
+package.close()
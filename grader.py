@@ -1,56 +1,77 @@
 import argparse
+import asyncio
+import functools
+import io
 import json
 import os
-import zipfile
 import tempfile
-import shutil
-from utils.xml_helper import get_sheet_map, get_shared_strings, parse_sheet_full
+import time
+from concurrent.futures import ProcessPoolExecutor
+from utils.package import open_package
+from utils.xml_helper import Workbook, get_sheet_map, get_shared_strings, parse_sheet_full
+from utils.delta import compute_workbook_delta
+from utils.diff_engine import diff_workbooks
 from utils.evaluator import evaluate_task
-from utils.rubric_extractor import extract_rubric_from_sheet
+from utils.prompt_encoding import encode_for_prompt
+from utils.rubric_extractor import extract_rubric_from_sheet, find_referenced_sheets
+from utils.scheduler import merge_local_results, schedule_rubric
 
-def grade_submission(submission_path, rubric_data=None, rubric_path=None, answer_key_path=None):
+def grade_submission(submission_path, rubric_data=None, rubric_path=None, answer_key_path=None, parse_workers=None,
+                     lazy_sheets=True, template_path=None, local_checks=True, per_task=False):
     """
     Grades a submission. 
     If answer_key_path is provided, uses AI Comparison Grading.
     Otherwise uses Rubric (dict/path/embedded).
+    parse_workers > 1 parses the sheets of each workbook in a process pool.
+    lazy_sheets: only parse (and send) the workbook sheets the rubric references;
+    the others are reduced to a one-line summary.
+    template_path: the blank assignment workbook. When given, only the delta between it and
+    the submission (and answer key) is sent to the model instead of the whole workbook.
+    local_checks: grade the mechanically checkable rubric criteria (cell values, formulas,
+    chart settings, sparklines, validations) locally and send only the rest to the model.
+    per_task: grade each rubric task in its own prompt with only its sheets, concurrently
+    (see utils.task_grading), instead of one prompt for the whole rubric.
+    """
+    from utils.llm_helper import grade_student_work
+    from utils.task_grading import grade_by_task
+
+    job = prepare_submission(submission_path, rubric_data=rubric_data, rubric_path=rubric_path,
+                             answer_key_path=answer_key_path, parse_workers=parse_workers,
+                             lazy_sheets=lazy_sheets, template_path=template_path, local_checks=local_checks)
+    request = model_request(job)
+    grade = grade_by_task if per_task else grade_student_work
+    return finish_submission(job, grade(**request) if request else None)
+
+def prepare_submission(submission_path, rubric_data=None, rubric_path=None, answer_key_path=None, parse_workers=None,
+                       lazy_sheets=True, template_path=None, local_checks=True):
+    """
+    Everything grade_submission does before the model call: loads the rubric, parses the
+    workbooks and grades what can be checked locally. Returns a picklable job for
+    model_request / finish_submission ({"response": ...} when grading stops early).
     """
     
-    # Prepare vars
-    temp_dir = tempfile.mkdtemp()
-    temp_dir_key = None
+    # Prepare vars (workbooks are read straight from the archive, nothing is extracted)
+    student_package = None
+    key_package = None
     
     try:
         # Prepare Data for AI
         from utils.xml_helper import parse_workbook_to_json
         from utils.text_extractor import extract_text_from_file
-        from utils.llm_helper import grade_student_work
         
-        # 1. Parse Student Data
+        # 1. Open Student Data
+        # Excel sheets are parsed once the rubric is known (step 3), so unreferenced sheets can be skipped.
+        # One parse-once Workbook serves both the JSON dump and the embedded rubric scan.
         student_data = None
         if submission_path.endswith(('.xlsx', '.xlsm')):
-            # Zip processing for Excel
-            # (temp_dir is already created above)
-            with zipfile.ZipFile(submission_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
-            student_data = parse_workbook_to_json(temp_dir)
+            student_package = Workbook(submission_path)
         elif submission_path.lower().endswith(('.docx', '.txt')):
             student_data = extract_text_from_file(submission_path)
             
-        if not student_data:
-            return {"error": "Unsupported submission format or empty file."}
-        
-        # 2. Parse Answer Key (Optional)
-        answer_key_data = None
-        if answer_key_path:
-            if answer_key_path.endswith(('.xlsx', '.xlsm')):
-                temp_dir_key = tempfile.mkdtemp()
-                with zipfile.ZipFile(answer_key_path, 'r') as z_key:
-                    z_key.extractall(temp_dir_key)
-                answer_key_data = parse_workbook_to_json(temp_dir_key)
-            elif answer_key_path.lower().endswith(('.docx', '.txt')):
-                answer_key_data = extract_text_from_file(answer_key_path)
+        if student_package is None and not student_data:
+            return {"response": {"error": "Unsupported submission format or empty file."}}
 
-        # 3. Load Rubric (Optional)
+        # 2. Load Rubric (Optional)
         rubric = None
         rubric_source = "none"
         
@@ -67,64 +88,230 @@ def grade_submission(submission_path, rubric_data=None, rubric_path=None, answer
                     pass
             elif rubric_path.lower().endswith(('.xlsx', '.xlsm')):
                 # Extract rubric from the provided Excel file
-                temp_rubric_dir = tempfile.mkdtemp()
                 try:
-                    with zipfile.ZipFile(rubric_path, 'r') as z_rubric:
-                        z_rubric.extractall(temp_rubric_dir)
-                    extracted_rubric = extract_rubric_from_sheet(temp_rubric_dir)
-                    if extracted_rubric:
-                        rubric = extracted_rubric
-                        rubric_source = "provided_excel"
-                    else:
-                        # Fallback: Parse entire workbook as raw data
-                        rubric = parse_workbook_to_json(temp_rubric_dir)
-                        rubric_source = "provided_excel_raw"
+                    with Workbook(rubric_path) as rubric_package:
+                        extracted_rubric = extract_rubric_from_sheet(rubric_package)
+                        if extracted_rubric:
+                            rubric = extracted_rubric
+                            rubric_source = "provided_excel"
+                        else:
+                            # Fallback: Parse entire workbook as raw data
+                            rubric = parse_workbook_to_json(rubric_package)
+                            rubric_source = "provided_excel_raw"
                 except Exception as e:
                      print(f"Excel Rubric Error: {e}")
-                finally:
-                    if os.path.exists(temp_rubric_dir):
-                        shutil.rmtree(temp_rubric_dir)
             elif rubric_path.lower().endswith(('.docx', '.txt')):
                  # Text Rubric
                  rubric = extract_text_from_file(rubric_path)
                  rubric_source = "provided_text"
 
         # If no explicit rubric and using Excel, check for embedded
-        if not rubric and isinstance(student_data, dict):
-            # Only check embedded if it's an Excel submission (which we have unzip dir for)
-            if os.path.exists(temp_dir):
-                 extracted = extract_rubric_from_sheet(temp_dir)
-                 if extracted:
-                     rubric = extracted
-                     rubric_source = "embedded"
-
-        # 4. Execute AI Grading
+        # Only check embedded if it's an Excel submission (which we have a package for)
+        if not rubric and student_package is not None:
+             extracted = extract_rubric_from_sheet(student_package)
+             if extracted:
+                 rubric = extracted
+                 rubric_source = "embedded"
+
+        # 3. Parse Student Workbook (only the sheets the rubric touches in lazy mode)
+        only_sheets = None
+        if student_package is not None:
+            if lazy_sheets:
+                only_sheets = find_referenced_sheets(rubric, list(student_package.sheet_map()))
+            student_data = parse_workbook_to_json(student_package, workers=parse_workers, sheets=only_sheets)
+
+        # 3b. Check what the workbook itself can answer; only the remainder goes to the model
+        plan = None
+        if local_checks and student_package is not None and rubric:
+            plan = schedule_rubric(rubric, student_data)
+
+        # 4. Parse Answer Key (Optional)
+        answer_key_data = None
+        if answer_key_path:
+            if answer_key_path.endswith(('.xlsx', '.xlsm')):
+                key_package = open_package(answer_key_path)
+                answer_key_data = parse_workbook_to_json(key_package, workers=parse_workers, sheets=only_sheets)
+            elif answer_key_path.lower().endswith(('.docx', '.txt')):
+                answer_key_data = extract_text_from_file(answer_key_path)
+
+        # 4b. Reduce workbooks to their delta against the blank template (Optional)
+        # The template is parsed once and then served from the parse cache for the whole class.
+        data_mode = "full"
+        key_diff = None
+        if template_path and student_package is not None:
+            template_data = parse_workbook_to_json(template_path, workers=parse_workers, sheets=only_sheets)
+            if isinstance(answer_key_data, dict):
+                # The answer key comparison needs the full workbooks
+                key_diff = diff_workbooks(student_data, answer_key_data)
+                answer_key_data = compute_workbook_delta(template_data, answer_key_data)
+            student_data = compute_workbook_delta(template_data, student_data)
+            data_mode = "template_delta"
+
         # If we have NEITHER rubric nor key, we can't grade.
         if not rubric and not answer_key_data:
-             if os.path.exists(temp_dir): shutil.rmtree(temp_dir)
-             return {
-                 "report": {"error": "Cannot grade: No Rubric provided/found AND no Answer Key provided."},
-                 "prompt": "No prompt generated (missing context)."
-             }
-             
-        ai_response = grade_student_work(student_data, rubric_data=rubric, answer_key_data=answer_key_data)
-        
-        # Ensure ai_response is properly structured
-        if "report" not in ai_response:
-             # Fallback if somehow return was raw (e.g. from an old version)
-             ai_response = {"report": ai_response, "prompt": "Prompt not captured."}
-
-        # Inject metadata into the REPORT so UI sees it
-        ai_response['report']['rubric_source'] = rubric_source
-        ai_response['report']['mode'] = "ai_unified"
-        
-        return ai_response
+            return {"response": {
+                "report": {"error": "Cannot grade: No Rubric provided/found AND no Answer Key provided."},
+                "prompt": "No prompt generated (missing context)."
+            }}
+
+        return {
+            "student_data": student_data,
+            "answer_key_data": answer_key_data,
+            "rubric": rubric,
+            "rubric_source": rubric_source,
+            "plan": plan,
+            "key_diff": key_diff,
+            "data_mode": data_mode
+        }
 
     finally:
-        if os.path.exists(temp_dir):
-            shutil.rmtree(temp_dir)
-        if temp_dir_key and os.path.exists(temp_dir_key):
-            shutil.rmtree(temp_dir_key)
+        if student_package is not None:
+            student_package.close()
+        if key_package is not None:
+            key_package.close()
+
+def model_request(job):
+    """The grade_student_work arguments for a prepared job, or None when no model call is needed."""
+    if "response" in job:
+        return None
+    plan = job["plan"]
+    if plan is not None and plan["rubric"] is None:
+        # Every criterion was checked locally
+        return None
+    return {
+        "student_data": job["student_data"],
+        "rubric_data": plan["rubric"] if plan else job["rubric"],
+        "answer_key_data": job["answer_key_data"],
+        "key_diff": job["key_diff"]
+    }
+
+def finish_submission(job, ai_response=None):
+    """Step 5 of grade_submission: folds the model's answer (None if it wasn't asked) and the local results into the result."""
+    from utils.llm_helper import is_workbook_data
+
+    if "response" in job:
+        return job["response"]
+    plan = job["plan"]
+    key_diff = job["key_diff"]
+
+    mode = "ai_unified"
+    if ai_response is None:
+        # Every criterion was checked locally: no model call at all
+        report = merge_local_results({}, plan)
+        student_data, answer_key_data = job["student_data"], job["answer_key_data"]
+        if key_diff is None and is_workbook_data(student_data) and is_workbook_data(answer_key_data):
+            key_diff = diff_workbooks(student_data, answer_key_data)
+        if key_diff is not None:
+            report['incorrect_cells'] = key_diff['incorrect_cells']
+        ai_response = {"report": report, "prompt": "No prompt: every criterion was checked locally."}
+        mode = "local"
+
+    # Ensure ai_response is properly structured
+    if "report" not in ai_response:
+        # Fallback if somehow return was raw (e.g. from an old version)
+        ai_response = {"report": ai_response, "prompt": "Prompt not captured."}
+
+    if plan is not None and plan["results"] and mode != "local" and "error" not in ai_response['report']:
+        merge_local_results(ai_response['report'], plan)
+        mode = "hybrid"
+
+    # Inject metadata into the REPORT so UI sees it
+    ai_response['report']['rubric_source'] = job["rubric_source"]
+    ai_response['report']['mode'] = mode
+    ai_response['report']['data_mode'] = job["data_mode"]
+
+    return ai_response
+
+async def grade_many(submission_paths, max_in_flight=8, parse_processes=None, **options):
+    """
+    Grades many submissions concurrently: workbooks are parsed (and locally checked) in a
+    process pool of parse_processes workers while up to max_in_flight model requests run
+    concurrently (see utils.llm_backend). options are grade_submission's keyword arguments.
+    Returns one grade_submission result per path, in order; a submission that fails
+    gets {"error": ..., "submission": path} and doesn't affect the others.
+    """
+    from utils.llm_helper import grade_student_work_async
+    from utils.task_grading import grade_by_task_async
+
+    options.pop("parse_workers", None)  # the pool already parallelises across submissions
+    grade = grade_by_task_async if options.pop("per_task", False) else grade_student_work_async
+    loop = asyncio.get_running_loop()
+    in_flight = asyncio.Semaphore(max_in_flight)
+
+    with ProcessPoolExecutor(parse_processes) as pool:
+        async def grade_one(path):
+            try:
+                job = await loop.run_in_executor(pool, functools.partial(prepare_submission, path, **options))
+                request = model_request(job)
+                ai_response = None
+                if request is not None:
+                    async with in_flight:
+                        ai_response = await grade(**request)
+                return finish_submission(job, ai_response)
+            except Exception as e:
+                return {"error": f"{type(e).__name__}: {e}", "submission": path}
+
+        return await asyncio.gather(*(grade_one(path) for path in submission_paths))
+
+def grade_batch(submission_paths, job_path, poll_interval=30.0, timeout=None, parse_processes=None, sleep=time.sleep,
+                **options):
+    """
+    Grades a whole class as one batch job, for throughput rather than latency: the
+    submissions are parsed in a process pool, every grade_student_work request goes into
+    the JSONL job file at job_path (one line per submission, keyed by its index; the
+    file is kept), the job is submitted through the backend's batches (see
+    utils.batch_jobs) and polled every poll_interval seconds until it finishes, and each
+    answer is mapped back to its submission like grade_student_work's. Answers already
+    in the response cache aren't queued. Returns what grade_many does.
+    """
+    from utils.batch_jobs import batch_request, wait_for_batch, write_job
+    from utils.llm_backend import get_backend
+    from utils.llm_helper import GRADING_MODEL, student_work_batch_request
+
+    options.pop("parse_workers", None)
+    if options.pop("per_task", False):
+        raise ValueError("per_task grading isn't available in batch mode")
+    batches = get_backend().batches
+    if batches is None:
+        raise ValueError("the model backend can't run batch jobs")
+
+    results = [None] * len(submission_paths)
+    queued = {}   # key -> (index, job, finish)
+    with ProcessPoolExecutor(parse_processes) as pool:
+        futures = [pool.submit(prepare_submission, path, **options) for path in submission_paths]
+        for i, (path, future) in enumerate(zip(submission_paths, futures)):
+            try:
+                job = future.result()
+                request = model_request(job)
+                if request is None:
+                    results[i] = finish_submission(job)
+                    continue
+                batch = student_work_batch_request(**request)
+                if batch["answer"] is not None:
+                    results[i] = finish_submission(job, batch["finish"](batch["answer"]))
+                else:
+                    queued[str(i)] = (i, job, batch)
+            except Exception as e:
+                results[i] = {"error": f"{type(e).__name__}: {e}", "submission": path}
+
+    if queued:
+        try:
+            write_job(job_path, (batch_request(key, batch["prompt"], batch["config"])
+                                 for key, (_, _, batch) in queued.items()))
+            name = batches.submit(GRADING_MODEL, job_path, display_name=os.path.basename(job_path))
+            wait_for_batch(batches, name, poll_interval=poll_interval, timeout=timeout, sleep=sleep)
+            answers = dict(batches.results(name))
+        except Exception as e:
+            for i, _, _ in queued.values():
+                results[i] = {"error": f"{type(e).__name__}: {e}", "submission": submission_paths[i]}
+            return results
+        for key, (i, job, batch) in queued.items():
+            try:
+                answer = answers.get(key, KeyError(f"the batch job has no answer for {key}"))
+                results[i] = finish_submission(job, batch["finish"](answer))
+            except Exception as e:
+                results[i] = {"error": f"{type(e).__name__}: {e}", "submission": submission_paths[i]}
+    return results
 
 def prepare_grading_context(uploaded_files):
     """
@@ -136,23 +323,24 @@ def prepare_grading_context(uploaded_files):
     contexts = []
     
     for f in uploaded_files:
-        # Create a temp file path to read from
+        content = f.getvalue() if hasattr(f, 'getvalue') else open(f, 'rb').read()
         suffix = f".{f.name.split('.')[-1]}"
+
+        # Excel workbooks are parsed from memory
+        if suffix.lower() in ('.xlsx', '.xlsm'):
+            with open_package(io.BytesIO(content)) as package:
+                data = parse_workbook_to_json(package)
+            contexts.append(f"FILE: {f.name}\nCONTENT (WORKBOOK):\n{encode_for_prompt(data)}")
+            continue
+
+        # Create a temp file path to read from
         with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp:
-            tmp.write(f.getvalue() if hasattr(f, 'getvalue') else open(f, 'rb').read())
+            tmp.write(content)
             tmp_path = tmp.name
             
         try:
-            if tmp_path.endswith(('.xlsx', '.xlsm')):
-                td = tempfile.mkdtemp()
-                with zipfile.ZipFile(tmp_path, 'r') as z:
-                    z.extractall(td)
-                data = parse_workbook_to_json(td)
-                contexts.append(f"FILE: {f.name}\nCONTENT (JSON):\n{json.dumps(data, indent=2)}")
-                shutil.rmtree(td)
-            else:
-                text = extract_text_from_file(tmp_path)
-                contexts.append(f"FILE: {f.name}\nCONTENT:\n{text}")
+            text = extract_text_from_file(tmp_path)
+            contexts.append(f"FILE: {f.name}\nCONTENT:\n{text}")
         finally:
             if os.path.exists(tmp_path):
                 os.remove(tmp_path)
@@ -161,13 +349,43 @@ def prepare_grading_context(uploaded_files):
 
 def main():
     parser = argparse.ArgumentParser(description="Excel XML Grader")
-    parser.add_argument("--submission", required=True, help="Path to .xlsx file")
+    parser.add_argument("--submission", required=True, nargs="+", help="Path to .xlsx file (several are graded concurrently)")
     parser.add_argument("--rubric", help="Path to rubric.json (Optional if embedded in file)")
     parser.add_argument("--context", help="Path to assignment context (optional)")
+    parser.add_argument("--workers", type=int, default=None, help="Parse sheets in N worker processes (optional)")
+    parser.add_argument("--all-sheets", action="store_true", help="Parse every sheet, not only those the rubric references")
+    parser.add_argument("--template", help="Blank assignment workbook; only the submission's changes are graded (optional)")
+    parser.add_argument("--llm-only", action="store_true", help="Send every rubric criterion to the model, skipping local checks")
+    parser.add_argument("--per-task", action="store_true", help="Grade each rubric task in its own prompt, concurrently")
+    parser.add_argument("--no-llm-cache", action="store_true", help="Always call the model, ignoring cached responses")
+    parser.add_argument("--no-context-cache", action="store_true", help="Send the whole grading prompt with every request")
+    parser.add_argument("--simulate-llm", action="store_true", help="Answer model requests locally with canned responses (GRADER_SIM_* settings)")
+    parser.add_argument("--max-in-flight", type=int, default=8, help="Concurrent model requests when grading several files")
+    parser.add_argument("--batch", metavar="JOBFILE", help="Grade every submission in one batch job written to JOBFILE (.jsonl)")
+    parser.add_argument("--poll-interval", type=float, default=30.0, help="Seconds between checks on a batch job")
     
     args = parser.parse_args()
+    if args.batch and args.per_task:
+        parser.error("--per-task can't be combined with --batch")
+    if args.simulate_llm:
+        os.environ["GRADER_LLM_BACKEND"] = "simulated"
+    if args.no_llm_cache:
+        from utils.response_cache import get_response_cache
+        get_response_cache().enabled = False
+    if args.no_context_cache:
+        from utils.context_cache import get_context_cache
+        get_context_cache().enabled = False
     
-    results = grade_submission(args.submission, rubric_path=args.rubric)
+    options = dict(rubric_path=args.rubric, lazy_sheets=not args.all_sheets, template_path=args.template,
+                   local_checks=not args.llm_only, per_task=args.per_task)
+    if args.batch:
+        results = grade_batch(args.submission, args.batch, poll_interval=args.poll_interval,
+                              parse_processes=args.workers, **options)
+    elif len(args.submission) == 1:
+        results = grade_submission(args.submission[0], parse_workers=args.workers, **options)
+    else:
+        results = asyncio.run(grade_many(args.submission, max_in_flight=args.max_in_flight,
+                                         parse_processes=args.workers, **options))
     print(json.dumps(results, indent=2))
 
 if __name__ == "__main__":
@@ -0,0 +1,76 @@
+import json
+import os
+import tempfile
+
+import utils.response_cache as response_cache
+from grader import grade_batch, grade_submission
+from utils.batch_jobs import LocalBatchBackend
+from utils.llm_backend import SimulatedBackend, SimulatedError, set_backend
+
+WORKBOOKS = ["grossjordan_34944_1593395_Data Visualization - Jordan Gross.xlsm", "JB - Data Visualization.xlsm",
+             "Data Visualization (2) copy.xlsm"]
+
+def with_backend(backend, cache, fn):
+    saved = response_cache._default_cache
+    previous = set_backend(backend)
+    response_cache._default_cache = cache
+    try:
+        return fn()
+    finally:
+        set_backend(previous)
+        response_cache._default_cache = saved
+
+def test_batch_grading():
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SimulatedBackend(latency=0, tokens_per_second=0)
+        backend.batches = LocalBatchBackend(backend.generate, os.path.join(tmp, "jobs"), requests_per_poll=2)
+        cache = response_cache.ResponseCache(path=os.path.join(tmp, "llm.sqlite3"))
+        job_path = os.path.join(tmp, "class.jsonl")
+        sleeps = []
+
+        def run():
+            paths = WORKBOOKS + ["missing.xlsx", "DataManagement.xlsm"]
+            batch = grade_batch(paths, job_path, poll_interval=5, parse_processes=2, sleep=sleeps.append)
+            interactive = grade_submission(WORKBOOKS[1])
+            again = grade_batch(WORKBOOKS, os.path.join(tmp, "again.jsonl"), parse_processes=1)
+            return paths, batch, interactive, again
+        paths, batch, interactive, again = with_backend(backend, cache, run)
+
+        with open(job_path) as f:
+            lines = [json.loads(line) for line in f]
+        # One request per submission the model has to see, keyed by its index
+        assert [line["key"] for line in lines] == ["0", "1", "2", "4"]
+        assert lines[0]["request"]["generation_config"]["response_schema"]["type"] == "OBJECT"
+        # Four requests, two per poll: waited once between polls
+        assert sleeps == [5]
+        for result in batch[:3] + batch[4:]:
+            report = result["report"]
+            assert report["criteria"] and "error" not in report
+        assert batch[3]["submission"] == "missing.xlsx" and "error" in batch[3]
+        # Same answer as the interactive path, which the batch answers were cached for
+        assert interactive == batch[1]
+        assert again == batch[:3] and not os.path.exists(os.path.join(tmp, "again.jsonl"))
+        assert len(os.listdir(os.path.join(tmp, "jobs"))) == 1 and backend.stats()["calls"] == 4
+
+def test_failed_requests_stay_with_their_submission():
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SimulatedBackend(latency=0, tokens_per_second=0)
+
+        calls = []
+
+        def flaky(model, contents, config=None):
+            calls.append(contents)
+            if len(calls) == 2:
+                raise SimulatedError(503, "UNAVAILABLE (simulated)")
+            return backend.generate(model, contents, config)
+        backend.batches = LocalBatchBackend(flaky, tmp)
+        results = with_backend(backend, response_cache.ResponseCache(enabled=False),
+                               lambda: grade_batch(WORKBOOKS, os.path.join(tmp, "job.jsonl"), parse_processes=1))
+        assert "503" in results[1]["report"]["error"] and results[1]["report"]["mode"] == "ai_unified"
+        assert [r["report"]["mode"] for r in (results[0], results[2])] == ["hybrid", "ai_unified"]
+    assert "error" not in results[0]["report"] and "error" not in results[2]["report"]
+
+if __name__ == "__main__":
+    test_batch_grading()
+    test_failed_requests_stay_with_their_submission()
+    print("OK")
@@ -0,0 +1,37 @@
+import json
+import pickle
+from utils.cell_store import SheetCells, json_default
+
+def build():
+    cells = SheetCells(["Label", "Other"])
+    cells.add("A1", sst_idx=0, style_idx=3)
+    cells.add("B1", "42", formula=("A1*2", None, None))
+    cells.add((2, 1), "", style_idx=5)
+    cells.add("A2", "", sst_idx=1)  # replaces the previous A2
+    cells.add("C1", "x")            # out of order: lands in row-major place
+    return cells
+
+def test_mapping_view():
+    cells = build()
+    assert list(cells) == ["A1", "B1", "C1", "A2"]
+    assert cells["A1"] == {"value": "Label", "formula": None, "formula_type": "normal", "formula_ref": "", "style_idx": "3"}
+    assert cells[(1, 2)]["formula"] == "A1*2" and cells["B1"]["value"] == "42"
+    assert cells["A2"]["value"] == "Other" and cells["A2"]["style_idx"] is None
+    assert "D9" not in cells and cells.get("D9") is None
+    assert dict(cells) == cells.to_dict()
+
+def test_compact_and_serialize():
+    styles = {"3": {"font": {"bold": True}}}
+    compact = build().compact(styles)
+    assert list(compact) == ["A1", "B1", "C1", "A2"]
+    assert compact["A1"]["style"] is styles["3"] and "style_idx" not in compact["A1"]
+    assert "style" not in compact["B1"]
+    assert json.loads(json.dumps({"cells": compact}, default=json_default))["cells"]["A2"]["value"] == "Other"
+
+    clone = pickle.loads(pickle.dumps(compact))
+    assert clone == compact
+
+if __name__ == "__main__":
+    test_mapping_view()
+    test_compact_and_serialize()
+    print("OK")
@@ -0,0 +1,105 @@
+from google.genai import errors
+import utils.context_cache as context_cache
+import utils.llm_helper as llm_helper
+import utils.response_cache as response_cache
+from utils.context_cache import ContextCacheManager, LocalCacheBackend
+from utils.llm_backend import GenaiBackend, SimulatedBackend, set_backend
+from utils.rubric_extractor import extract_rubric_from_sheet
+from utils.xml_helper import parse_workbook_to_json
+
+PREFIX = "Grade strictly.\n" * 200
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_lifecycle():
+    clock = FakeClock()
+    backend = LocalCacheBackend(clock)
+    manager = ContextCacheManager(backend, ttl=100, min_tokens=50, clock=clock)
+    name = manager.lookup("m", PREFIX)
+    assert backend.resolve(name) == PREFIX
+    # Indentation doesn't make a different prefix
+    assert manager.lookup("m", "  " + PREFIX.replace("\n", "\n  ")) == name and backend.created == 1
+    assert manager.lookup("m", "short") is None
+
+    clock.now = 80  # Within the last quarter of the TTL: extended, not recreated
+    assert manager.lookup("m", PREFIX) == name and backend.caches[name]["expires"] == 180
+    clock.now = 200
+    renewed = manager.lookup("m", PREFIX)
+    assert renewed != name and backend.created == 2
+    assert manager.stats()["expired"] == 1 and manager.stats()["refreshed"] == 1
+
+    manager.clear()
+    assert renewed not in backend.caches and manager.stats()["live"] == 0
+
+def test_unsupported_model_falls_back():
+    class Refusing(LocalCacheBackend):
+        def create(self, model, contents, ttl, display_name=None):
+            raise errors.ClientError(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}})
+    manager = ContextCacheManager(Refusing(), min_tokens=50)
+    assert manager.lookup("m", PREFIX) is None and "m" in manager.unsupported
+
+class FakeModels:
+    """generate_content that expands cached_content the way the API does."""
+    def __init__(self, backend):
+        self.backend = backend
+        self.requests = []
+        self.sent = []
+
+    def generate_content(self, model, contents, config=None):
+        self.sent.append(contents)
+        config = dict(config or {})
+        name = config.pop("cached_content", None)
+        if name:
+            try:
+                contents = self.backend.resolve(name) + contents
+            except KeyError:
+                self.requests.append((name, None))
+                raise errors.ClientError(404, {"error": {"code": 404, "status": "NOT_FOUND"}})
+        self.requests.append((name, contents))
+        text = SimulatedBackend(latency=0).respond(contents)
+        return type("Response", (), {"text": text, "usage_metadata": None})()
+
+def test_grading_sends_the_preamble_once():
+    rubric = extract_rubric_from_sheet("DataManagement.xlsm")
+    students = [parse_workbook_to_json("DataManagement.xlsm"), parse_workbook_to_json("DataManagement.xlsm")]
+    students[1]["sheets"]["T 1 - VLOOKUP()"]["cells"] = {"C5": {"value": "42", "formula": "VLOOKUP(B5,A1:B9,2)"}}
+
+    backend = LocalCacheBackend()
+    models = FakeModels(backend)
+    saved = context_cache._default_manager, response_cache._default_cache
+    previous = set_backend(GenaiBackend(client=type("Client", (), {"models": models})()))
+    context_cache._default_manager = ContextCacheManager(backend, min_tokens=500)
+    response_cache._default_cache = response_cache.ResponseCache(enabled=False)
+    try:
+        results = [llm_helper.grade_student_work(student, rubric) for student in students]
+        backend.caches.clear()  # Expired on the server: resent whole, then cached again
+        results.append(llm_helper.grade_student_work(students[0], rubric))
+        results.append(llm_helper.grade_student_work(students[1], rubric))
+        stats = context_cache._default_manager.stats()
+    finally:
+        set_backend(previous)
+        context_cache._default_manager, response_cache._default_cache = saved
+
+    names = [name for name, _ in models.requests]
+    assert names[0] == names[1] and names[0] is not None
+    assert names[2] == names[0] and names[3] is None and names[4] not in (None, names[0])
+    assert stats["created"] == 2 and stats["fallbacks"] == 1
+    # The model saw exactly the prompt each report records
+    seen = [contents for _, contents in models.requests if contents is not None]
+    assert seen == [result["prompt"] for result in results]
+    # With the cache only the submission goes over the wire
+    assert "GRADING CRITERIA" not in models.sent[1] and "GRADING CRITERIA" in models.sent[3]
+    prefix, suffix, _, _ = llm_helper._student_work_prompt(students[0], rubric, None, None)
+    assert "STUDENT SUBMISSION DATA" in suffix and "STUDENT SUBMISSION DATA" not in prefix
+    assert "GRADING CRITERIA" in prefix
+
+if __name__ == "__main__":
+    test_lifecycle()
+    test_unsupported_model_falls_back()
+    test_grading_sends_the_preamble_once()
+    print("OK")
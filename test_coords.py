@@ -0,0 +1,21 @@
+from utils.coords import column_index, column_letters, parse_coord, to_coord, coord_sort_key
+from utils.cell_store import row_major_items
+
+def test_codec_round_trip():
+    for col in (1, 26, 27, 52, 702, 703, 16384):
+        assert column_index(column_letters(col)) == col
+    assert column_letters(16384) == "XFD"
+    assert parse_coord("B12") == (12, 2)
+    assert parse_coord("$AA$3") == (3, 27)
+    assert parse_coord("A1:B2") is None and parse_coord("Total") is None
+    assert to_coord(12, 2) == "B12"
+
+def test_row_major_order():
+    cells = {"B2": 1, "AA1": 2, "C1": 3, "A2": 4, "B1": 5}
+    assert [c for c, _ in row_major_items(cells)] == ["B1", "C1", "AA1", "A2", "B2"]
+    assert sorted(["A10", "A9", "B1"], key=coord_sort_key) == ["B1", "A9", "A10"]
+
+if __name__ == "__main__":
+    test_codec_round_trip()
+    test_row_major_order()
+    print("OK")
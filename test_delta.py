@@ -0,0 +1,51 @@
+from utils.delta import compute_workbook_delta
+from utils.xml_helper import parse_workbook_to_json
+
+WORKBOOK = "Data Visualization (2) copy.xlsm"
+
+def cell(value, formula=None, style=None):
+    c = {"value": value, "formula": formula, "formula_type": "normal", "formula_ref": ""}
+    if style:
+        c["style"] = style
+    return c
+
+def chart(title):
+    return {"type": "chart", "rId": "rId1", "details": {"title": title, "axes": {"1": {"max": "120"}}}}
+
+TEMPLATE = {"sheets": {
+    "T 1": {"cells": {"A1": cell("Region"), "B1": cell("Total"), "A2": cell("North"), "B2": cell(""), "C9": cell("old")},
+            "metadata": {"drawings": [chart("")], "validations": []}},
+    "Intro": {"cells": {"A1": cell("Read me")}, "metadata": {}},
+}, "workbook_metadata": {"definedNames": {}}}
+
+STUDENT = {"sheets": {
+    "T 1": {"cells": {"A1": cell("Region"), "B1": cell("Total"), "A2": cell("North"), "B2": cell("42", "SUM(C2:F2)"),
+                      "B3": cell("7", style={"font": {"bold": True}})},
+            "metadata": {"drawings": [chart("Sales")], "validations": []}},
+    "Intro": {"cells": {"A1": cell("Read me")}, "metadata": {}},
+    "Notes": {"cells": {"A1": cell("extra")}, "metadata": {}},
+}, "workbook_metadata": {"definedNames": {}}}
+
+def test_cell_and_chart_delta():
+    delta = compute_workbook_delta(TEMPLATE, STUDENT)
+    sheet = delta["sheets"]["T 1"]
+    assert sheet["changed"]["B2"] == {"value": "42", "formula": "SUM(C2:F2)", "template": {"value": "", "formula": None}}
+    assert sheet["added"] == {"B3": {"value": "7", "style": {"font": {"bold": True}}}}
+    assert sheet["removed"] == {"C9": {"value": "old"}}
+    # Row and column labels anchor the changed cells
+    assert sheet["context"] == {"A2": "North", "B1": "Total"}
+    assert sheet["metadata"]["drawings"]["changed"] == [
+        {"type": "chart", "rId": "rId1", "changes": {"details.title": {"template": "", "submission": "Sales"}}}]
+    assert delta["unchanged_sheets"] == ["Intro"]
+    assert list(delta["added_sheets"]) == ["Notes"]
+
+def test_identical_workbook_has_empty_delta():
+    data = parse_workbook_to_json(WORKBOOK)
+    delta = compute_workbook_delta(data, data)
+    assert not delta["sheets"] and not delta["added_sheets"] and not delta["removed_sheets"]
+    assert delta["unchanged_sheets"] == list(data["sheets"])
+
+if __name__ == "__main__":
+    test_cell_and_chart_delta()
+    test_identical_workbook_has_empty_delta()
+    print("OK")
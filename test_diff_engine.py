@@ -0,0 +1,59 @@
+import time
+from utils.diff_engine import diff_workbooks, normalize_formula, values_match
+from utils.xml_helper import parse_workbook_to_json
+
+STUDENT = "JB - Data Visualization.xlsm"
+KEY = "grossjordan_34944_1593395_Data Visualization - Jordan Gross.xlsm"
+
+def cell(value, formula=None, style=None):
+    c = {"value": value, "formula": formula, "formula_type": "normal", "formula_ref": ""}
+    if style:
+        c["style"] = style
+    return c
+
+def chart(axis_max, *ranges):
+    return {"type": "chart", "rId": "rId1", "details": {
+        "types": ["Bar"], "title": "", "title_formula": "", "legend_pos": "r",
+        "axes": {"1": {"min": "auto", "max": axis_max, "major_unit": "auto", "orientation": "minMax"}},
+        "series": [{"name": r.replace("$", ""), "values": r, "categories": "", "type": "Bar"} for r in ranges]}}
+
+def test_normalization_and_tolerance():
+    assert normalize_formula("=sum( $A$1:A3 )") == normalize_formula("SUM(A1:A3)")
+    assert normalize_formula('IF(A1="yes",1,0)') != normalize_formula('IF(A1="YES",1,0)')
+    assert normalize_formula("_xlfn.STDEV.S(A1:A9)") == "STDEV.S(A1:A9)"
+    assert values_match("0.30000000000000004", "0.3") and not values_match("0.31", "0.3")
+    assert values_match(" Total ", "total")
+
+def test_synthetic_diff():
+    key = {"sheets": {"T1": {"cells": {
+        "B2": cell("10", "SUM(A1:A4)"), "B3": cell("4", "A1*2"), "B4": cell("5", "A2+A3"),
+        "B5": cell("x", style={"font": {"bold": True}})},
+        "metadata": {"drawings": [chart("100", "T1!A1:A4", "T1!B1:B4")],
+                     "validations": [{"type": "list", "sqref": "C1", "formula1": "$A$1:$A$3", "formula2": ""}]}}}}
+    student = {"sheets": {"T1": {"cells": {
+        "B2": cell("10.0000000001", "sum(a1:a4)"), "B3": cell("4"), "B4": cell("5", "SUM(A2:A3)"),
+        "B5": cell("x")},
+        "metadata": {"drawings": [chart("120", "T1!$B$1:$B$4", "T1!$A$1:$A$4")], "validations": []}}},
+        "workbook_metadata": {}}
+    result = diff_workbooks(student, key)
+    found = {(i["cell"], i["kind"]) for i in result["incorrect_cells"]}
+    assert found == {("B3", "formula"), ("B5", "style"), ("Chart 1", "chart"), ("C1", "validations")}
+    chart_issue = next(i for i in result["incorrect_cells"] if i["kind"] == "chart")
+    # Series matched by range regardless of order; only the axis max differs
+    assert chart_issue["explanation"].endswith("axes[1].max.")
+    assert [i["cell"] for i in result["review"]] == ["B4"]
+    assert not result["passed"]
+
+def test_real_workbooks_diff_quickly():
+    student, key = parse_workbook_to_json(STUDENT), parse_workbook_to_json(KEY)
+    start = time.perf_counter()
+    result = diff_workbooks(student, key)
+    assert time.perf_counter() - start < 1.0
+    assert any(i["cell"] == "B16" and i["expected"] == "Southern" for i in result["incorrect_cells"])
+    assert diff_workbooks(key, key)["passed"]
+
+if __name__ == "__main__":
+    test_normalization_and_tolerance()
+    test_synthetic_diff()
+    test_real_workbooks_diff_quickly()
+    print("OK")
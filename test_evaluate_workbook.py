@@ -0,0 +1,61 @@
+import threading
+
+import utils.evaluator as evaluator
+from utils.evaluator import evaluate_workbook, plan_manual_batches
+from utils.rubric_extractor import extract_rubric_from_sheet
+from utils.xml_helper import parse_workbook_to_json
+
+WORKBOOK = "grossjordan_34944_1593395_Data Visualization - Jordan Gross.xlsm"
+
+def fake_batches(calls):
+    """Stands in for the model: passes every criterion whose _id ends in 1."""
+    lock = threading.Lock()
+    def grade(content, criteria, key='description'):
+        with lock:
+            calls.append((content, [c[key] for c in criteria]))
+        return {c[key]: {"passed": c[key].endswith("1"), "feedback": f"seen {c['sheet']}"} for c in criteria}
+    return grade
+
+def run(max_batch_tokens):
+    rubric = extract_rubric_from_sheet(WORKBOOK)
+    data = parse_workbook_to_json(WORKBOOK)
+    calls = []
+    original = evaluator.grade_manual_review_batch
+    evaluator.grade_manual_review_batch = fake_batches(calls)
+    try:
+        return rubric, evaluate_workbook(rubric, data, max_batch_tokens=max_batch_tokens), calls
+    finally:
+        evaluator.grade_manual_review_batch = original
+
+def test_plan_batches():
+    groups = [("A", "x" * 400, []), ("B", "x" * 400, []), ("C", "x" * 4000, [])]
+    batches = plan_manual_batches(groups, max_tokens=300)
+    assert [[g[0] for g in b] for b in batches] == [["C"], ["A", "B"]]
+
+def test_single_batch_for_all_tasks():
+    rubric, result, calls = run(max_batch_tokens=10 ** 6)
+    assert len(calls) == 1 and result["batches"] == 1
+    # Every sheet is rendered once, even with several tasks on it
+    content = calls[0][0]
+    assert content.count("=== SHEET: T 7 - Sparklines ===") == 1
+
+    all_ids = [c for _, ids in calls for c in ids]
+    assert len(all_ids) == len(set(all_ids)) == sum(len(t["criteria"]) for t in rubric["tasks"])
+    assert [len(t["criteria_results"]) for t in result["tasks"]] == [len(t["criteria"]) for t in rubric["tasks"]]
+    # Verdicts land on the right task (T1_crit_1 passes, T1_crit_2 doesn't)
+    first = result["tasks"][0]["criteria_results"]
+    assert first[0]["status"] == "Passed" and first[1]["status"] == "Failed"
+    assert first[0]["feedback"] == "seen T 1 - Series & Scale"
+
+def test_budgeted_batches_cover_everything():
+    rubric, single, _ = run(max_batch_tokens=10 ** 6)
+    _, result, calls = run(max_batch_tokens=2000)
+    assert len(calls) > 1 and result["batches"] == len(calls)
+    assert result["points_earned"] == single["points_earned"]
+    assert result["max_points"] == sum(t["points"] for t in rubric["tasks"])
+
+if __name__ == "__main__":
+    test_plan_batches()
+    test_single_batch_for_all_tasks()
+    test_budgeted_batches_cover_everything()
+    print("OK")
@@ -0,0 +1,122 @@
+from utils.diff_engine import diff_workbooks
+from utils.formula_engine import (ExcelError, FormulaEngine, UnsupportedFormula, formulas_equivalent,
+                                  parse_formula, recompute_and_compare)
+from utils.xml_helper import parse_workbook_to_json
+
+WORKBOOK = "DataManagement.xlsm"
+
+def cell(value, formula=None, formula_type="normal", formula_ref=""):
+    return {"value": value, "formula": formula, "formula_type": formula_type, "formula_ref": formula_ref}
+
+def sample():
+    cells = {
+        "A1": cell("Region"), "B1": cell("Sales"), "C1": cell("Units"),
+        "A2": cell("North"), "B2": cell("100"), "C2": cell("4"),
+        "A3": cell("South"), "B3": cell("250"), "C3": cell("5"),
+        "A4": cell("East"), "B4": cell("75"), "C4": cell("3"),
+        # Shared formula: D2 is the master, D3:D4 are stored without text
+        "D2": cell("25", "B2/C2", "shared", "D2:D4"), "D3": cell("50", None, "shared"), "D4": cell("25", None, "shared"),
+        "B6": cell("425", "SUM(B2:B4)"),
+        "B7": cell("141.67", "ROUND(AVERAGE(B2:B4),2)"),
+        "B8": cell("250", 'VLOOKUP("south",A2:C4,2,FALSE)'),
+        "B9": cell("3", 'INDEX(C2:C4,MATCH("East",A2:A4,0))'),
+        "B10": cell("2", 'COUNTIF(B2:B4,">=100")'),
+        "B11": cell("High", 'IF(B6>400,"High","Low")'),
+        "B12": cell("#N/A", 'VLOOKUP("West",A2:C4,2,FALSE)'),
+        "B13": cell("none", 'IFERROR(B12,"none")'),
+        "B14": cell("850", "B6*2"),
+        "B15": cell("325", 'SUMIF(A2:A4,"<>South",B2:B4)+Other!A1'),
+    }
+    return {"sheets": {"Data": {"cells": cells, "metadata": {}},
+                       "Other": {"cells": {"A1": cell("150")}, "metadata": {}}},
+            "workbook_metadata": {}}
+
+def test_parser():
+    assert parse_formula("=1+2*3") == ("op", "+", ("num", 1.0), ("op", "*", ("num", 2.0), ("num", 3.0)))
+    assert parse_formula("SUM($A$1:B2)")[2][0] == ("range", None, (1, 1, True, True), (2, 2, False, False))
+    assert parse_formula("'My Sheet'!A1")[1] == "My Sheet"
+    assert parse_formula("_xlfn.STDEV.S(A:A)")[1] == "STDEV.S"
+    assert parse_formula("LOG10(100)")[0] == "fn"
+    # Cached: the same text gives the same AST object
+    assert parse_formula("SUM(A1:A3)") is parse_formula("SUM(A1:A3)")
+
+def test_evaluate_sample():
+    engine = FormulaEngine(sample())
+    assert engine.value("Data", "D3") == 50.0  # shared child inferred from D2
+    assert engine.value("Data", "B7") == 141.67
+    assert engine.value("Data", "B9") == 3.0
+    assert engine.value("Data", "B12") == ExcelError("#N/A")
+    assert engine.evaluate("-2^2", "Data") == 4.0 and engine.evaluate("2^3^2", "Data") == 64.0
+    assert engine.evaluate('"a"&B2&TRUE', "Data") == "a100TRUE"
+    assert engine.evaluate("1/0", "Data") == ExcelError("#DIV/0!")
+    try:
+        engine.evaluate("NOW()", "Data")
+        assert False, "NOW is volatile and unsupported"
+    except UnsupportedFormula:
+        pass
+    report = recompute_and_compare(sample())
+    assert report["mismatches"] == [], report["mismatches"]
+    assert report["checked"] == 13
+
+def test_incremental_invalidation():
+    engine = FormulaEngine(sample())
+    assert engine.value("Data", "B14") == 850.0
+    assert ("Data", "B14") in engine.dependents("Data", "B2", transitive=True)
+    assert ("Data", "B14") not in engine.dependents("Data", "C2", transitive=True)
+
+    engine.value("Data", "D4")
+    engine.set_cell("Data", "B2", "200")
+    assert engine.value("Data", "B6") == 525.0 and engine.value("Data", "B14") == 1050.0
+    assert engine.value("Data", "B11") == "High"
+    # D4 doesn't read B2, so its memoized value survives the edit
+    assert ("Data", 4, 4) in engine._values
+    engine.set_cell("Data", "B6", formula="B2")
+    assert engine.value("Data", "B14") == 400.0
+    assert engine.precedents("Data", "B6") == [("Data", "B2")]
+
+def test_formulas_equivalent():
+    engine = FormulaEngine(sample())
+    assert formulas_equivalent(engine, "Data", "B2+B3+B4", "SUM(B2:B4)")
+    # Same result on this data, but only by coincidence
+    assert formulas_equivalent(engine, "Data", "B3+B4*2+25", "SUM(B2:B4)") is False
+    assert formulas_equivalent(engine, "Data", "B6", "425") is False
+    assert formulas_equivalent(engine, "Data", "NOW()", "SUM(B2:B4)") is None
+
+def test_diff_settles_review():
+    key = sample()
+    student = sample()
+    student["sheets"]["Data"]["cells"]["B6"] = cell("425", "B2+B3+B4")
+    student["sheets"]["Data"]["cells"]["B14"] = cell("850", "B6+425")
+    result = diff_workbooks(student, key)
+    assert [i["cell"] for i in result["equivalent"]] == ["B6"]
+    assert [(i["cell"], i["kind"]) for i in result["incorrect_cells"]] == [("B14", "formula")]
+    assert result["review"] == []
+
+def test_student_helper_sheet_stays_to_review():
+    key = {"sheets": {"S": {"cells": {"A1": cell("2"), "A2": cell("3"), "B1": cell("5", "A1+A2")}, "metadata": {}}},
+           "workbook_metadata": {}}
+    student = {"sheets": {"S": {"cells": {"A1": cell("2"), "A2": cell("3"), "B1": cell("5", "Helper!A1")}, "metadata": {}},
+                          "Helper": {"cells": {"A1": cell("5", "S!A1+S!A2")}, "metadata": {}}},
+               "workbook_metadata": {}}
+    result = diff_workbooks(student, key)
+    # The key has no Helper sheet to recompute the student's formula on
+    assert result["passed"] and result["incorrect_cells"] == []
+    assert [i["cell"] for i in result["review"]] == ["B1"]
+    engine = FormulaEngine(sample())
+    assert engine.reads_missing("Helper!A1", "Data") and engine.reads_missing("B2+Z99", "Data")
+    assert engine.reads_missing("SUM(X1:Y3)", "Data") and not engine.reads_missing("SUM(B2:B9)+Other!A1", "Data")
+
+def test_real_workbook_recomputes():
+    report = recompute_and_compare(parse_workbook_to_json(WORKBOOK))
+    assert report["checked"] > 50
+    assert report["mismatches"] == []
+
+if __name__ == "__main__":
+    test_parser()
+    test_evaluate_sample()
+    test_incremental_invalidation()
+    test_formulas_equivalent()
+    test_diff_settles_review()
+    test_student_helper_sheet_stays_to_review()
+    test_real_workbook_recomputes()
+    print("OK")
@@ -0,0 +1,47 @@
+import asyncio
+
+import utils.llm_helper as llm_helper
+from grader import grade_many, grade_submission
+
+WORKBOOKS = ["grossjordan_34944_1593395_Data Visualization - Jordan Gross.xlsm", "JB - Data Visualization.xlsm",
+             "Data Visualization (2) copy.xlsm"]
+
+def fake_grader(state):
+    """Stands in for the model: awards nothing, records how many requests overlap."""
+    async def grade(student_data, rubric_data=None, answer_key_data=None, key_diff=None):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.05)
+        state["active"] -= 1
+        state["calls"] += 1
+        return {"report": {"summary": "Checked.", "result": []}, "prompt": "fake"}
+    return grade
+
+def test_grade_many():
+    state = {"active": 0, "peak": 0, "calls": 0}
+    original = llm_helper.grade_student_work_async
+    llm_helper.grade_student_work_async = fake_grader(state)
+    try:
+        paths = WORKBOOKS + ["missing.xlsx", "notes.pdf"]
+        results = asyncio.run(grade_many(paths, max_in_flight=2, parse_processes=2))
+    finally:
+        llm_helper.grade_student_work_async = original
+
+    assert len(results) == len(paths)
+    assert state["calls"] == len(WORKBOOKS) and state["peak"] <= 2
+    # The third workbook has nothing the local checks can settle
+    assert [r["report"]["mode"] for r in results[:len(WORKBOOKS)]] == ["hybrid", "hybrid", "ai_unified"]
+    assert all(r["report"]["rubric_source"] == "embedded" for r in results[:len(WORKBOOKS)])
+    # Failures stay with their own submission
+    assert results[3]["submission"] == "missing.xlsx" and "error" in results[3]
+    assert results[4] == {"error": "Unsupported submission format or empty file."}
+
+def test_prepared_job_matches_sync_path():
+    result = grade_submission("DataManagement.xlsm", rubric_path="rubric_sample.json")
+    batch = asyncio.run(grade_many(["DataManagement.xlsm"], rubric_path="rubric_sample.json", parse_processes=1))
+    assert batch == [result] and result["report"]["mode"] == "local"
+
+if __name__ == "__main__":
+    test_grade_many()
+    test_prepared_job_matches_sync_path()
+    print("OK")
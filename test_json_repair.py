@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import utils.llm_helper as llm_helper
+import utils.response_cache as response_cache
+from utils.json_repair import salvage_json
+from utils.llm_backend import Completion, LLMBackend, SimulatedBackend, set_backend
+from utils.rubric_extractor import extract_rubric_from_sheet
+from utils.xml_helper import parse_workbook_to_json
+
+class Scripted(LLMBackend):
+    """Answers with the given texts in turn (or callables of the prompt); records what it was asked."""
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.prompts, self.configs = [], []
+
+    def generate(self, model, contents, config=None):
+        self.prompts.append(contents)
+        self.configs.append(config)
+        answer = self.answers.pop(0)
+        return Completion(answer(contents) if callable(answer) else answer)
+
+def run(backend, fn):
+    saved = response_cache._default_cache
+    previous = set_backend(backend)
+    response_cache._default_cache = response_cache.ResponseCache(enabled=False)
+    try:
+        return fn()
+    finally:
+        set_backend(previous)
+        response_cache._default_cache = saved
+
+def test_salvage():
+    assert salvage_json('```json\n{"a": 1,}\n```') == ({"a": 1}, True)
+    assert salvage_json("Here you go: {a: 'x', \"b\": True \"c\": [1, 2,] // note\n}") == \
+        ({"a": "x", "b": True, "c": [1, 2]}, True)
+    # Cut off: the unfinished element and member are dropped, open containers closed
+    assert salvage_json('{"summary": "ok", "result": [{"_id": "1", "obtainedPoints": 2}, {"_id": "2", "obt') == \
+        ({"summary": "ok", "result": [{"_id": "1", "obtainedPoints": 2}]}, False)
+    assert salvage_json('[{"id": "a", "passed": true}, {"id": "b", "passed": tr') == ([{"id": "a", "passed": True}], False)
+    assert salvage_json('{"n": 12') == ({}, False)
+    assert salvage_json("no json here") == (None, False)
+
+def test_cut_off_report_asks_only_for_missing_criteria():
+    rubric = extract_rubric_from_sheet("DataManagement.xlsm")
+    student = parse_workbook_to_json("DataManagement.xlsm")
+    ids = [c["_id"] for t in rubric["tasks"] for c in t["criteria"]]
+    simulated = SimulatedBackend(latency=0)
+
+    def cut_off(prompt):
+        full = json.loads(simulated.respond(prompt))
+        text = json.dumps(full)
+        return text[:text.index(json.dumps(full["result"][3]))] + '{"_id": "' + ids[3]
+    backend = Scripted([cut_off, simulated.respond])
+    report = run(backend, lambda: llm_helper.grade_student_work(student, rubric))["report"]
+
+    assert len(backend.prompts) == 2
+    follow_up = backend.prompts[1].split("FOLLOW-UP:")[1]
+    assert json.dumps(ids[3:], separators=(",", ":")) in follow_up and ids[2] not in follow_up
+    assert [r["_id"] for r in report["result"]] == ids
+    assert report["score"]["earned"] == sum(c["points"] for t in rubric["tasks"] for c in t["criteria"])
+    assert backend.configs[0]["response_schema"] is llm_helper.GRADING_CONFIG["response_schema"]
+    assert "result" in backend.configs[1]["response_schema"]["properties"]
+
+def test_async_rescore_recomputes_letter():
+    rubric = extract_rubric_from_sheet("DataManagement.xlsm")
+    student = parse_workbook_to_json("DataManagement.xlsm")
+    prefix, suffix, _, _ = llm_helper._student_work_prompt(student, rubric, None, None)
+    full = json.loads(SimulatedBackend(latency=0).respond(prefix + suffix))
+    # The model claimed an A, but its answer stops after the first criterion and the follow-up fails
+    text = json.dumps(dict(full, result=full["result"][:1]))
+    def unavailable(prompt):
+        raise RuntimeError("400 INVALID_ARGUMENT")
+    backend = Scripted([text, unavailable])
+    report = run(backend, lambda: asyncio.run(llm_helper.grade_student_work_async(student, rubric)))["report"]
+    assert len(backend.prompts) == 2 and "FOLLOW-UP:" in backend.prompts[1]
+    assert report["score"]["earned"] == full["result"][0]["obtainedPoints"] and report["score"]["letter"] == "F"
+
+def test_manual_review_reasks_missing_only():
+    criteria = [{"_id": "c1", "description": "Total"}, {"_id": "c2", "description": "Chart"}]
+    backend = Scripted(['```json\n[{"id": "c1", "passed": true, "feedback": "ok"}, {"id": "c2", "pass',
+                        '{"c2": {"passed": false, "feedback": "No chart"}}'])
+    verdicts = run(backend, lambda: llm_helper.grade_manual_review_batch("A1:1", criteria, key="_id"))
+    assert verdicts == {"c1": {"passed": True, "feedback": "ok"}, "c2": {"passed": False, "feedback": "No chart"}}
+    assert '"_id":"c1"' not in backend.prompts[1] and '"_id":"c2"' in backend.prompts[1]
+
+def test_rubric_retried_only_when_cut_off():
+    rubric = [{"_id": "A", "name": "All", "points": 10, "sub_criteria": []}]
+    backend = Scripted([json.dumps(rubric)[:-5], "Sure! " + json.dumps(rubric) + ","])
+    assert run(backend, lambda: llm_helper.generate_structured_rubric("Task", 10)) == rubric
+    assert len(backend.prompts) == 2
+
+def test_async_helpers_share_the_loops():
+    rubric = [{"_id": "A", "name": "All", "points": 10, "sub_criteria": []}]
+    backend = Scripted([json.dumps(rubric)[:-5], json.dumps(rubric)])
+    assert run(backend, lambda: asyncio.run(llm_helper.refine_structured_rubric_async(rubric, "Keep", "Task", 10))) == rubric
+    assert [c["temperature"] for c in backend.configs] == [0.1, 0.2]
+    def unavailable(prompt):
+        raise RuntimeError("400 INVALID_ARGUMENT")
+    assert run(Scripted([unavailable]), lambda: asyncio.run(llm_helper.generate_structured_rubric_async("Task", 10))) == \
+        [{"error": "Failed to generate rubric: 400 INVALID_ARGUMENT"}]
+    criteria = [{"_id": "c1", "description": "Total"}, {"_id": "c2", "description": "Chart"}]
+    backend = Scripted(['[{"id": "c1", "passed": true, "feedback": "ok"}]', '[{"id": "c2", "passed": false, "feedback": "No"}]'])
+    verdicts = run(backend, lambda: asyncio.run(llm_helper.grade_manual_review_batch_async("A1:1", criteria, key="_id")))
+    assert set(verdicts) == {"c1", "c2"} and len(backend.prompts) == 2
+
+if __name__ == "__main__":
+    test_salvage()
+    test_cut_off_report_asks_only_for_missing_criteria()
+    test_async_rescore_recomputes_letter()
+    test_manual_review_reasks_missing_only()
+    test_rubric_retried_only_when_cut_off()
+    test_async_helpers_share_the_loops()
+    print("OK")
@@ -0,0 +1,59 @@
+import json
+from utils.cell_store import json_default
+from utils.xml_helper import Workbook, parse_workbook_to_json, referenced_sheet_names
+from utils.rubric_extractor import extract_rubric_from_sheet, find_referenced_sheets
+import utils.parse_cache as parse_cache
+from utils.parse_cache import ParseCache
+
+SUBMISSION = "Data Visualization (2) copy.xlsm"
+RUBRIC = "DataVisualizationRUBRIC.xlsx"
+
+def test_rubric_tasks_map_to_task_sheets():
+    with Workbook(SUBMISSION) as wb:
+        names = list(wb.sheet_map())
+    refs = find_referenced_sheets(extract_rubric_from_sheet(RUBRIC), names)
+    assert "T 1 - Series & Scale" in refs and "T 10 - No Pie for You" in refs
+    assert "Honor Code" not in refs and "Scoring Worksheet" not in refs
+
+def test_unmatched_rubric_keeps_every_sheet():
+    assert find_referenced_sheets([{"name": "Overall neatness", "points": 5}], ["Sheet1", "Sheet2"]) is None
+    assert find_referenced_sheets(None, ["Sheet1"]) is None
+
+def test_task_without_a_sheet_keeps_every_sheet():
+    names = ["T 1 - Series & Scale", "T 2 - Axis Titles", "Data"]
+    rubric = {"tasks": [{"name": "Task 1", "criteria": [{"description": "Series plotted", "points": 2}]},
+                        {"name": "Overall presentation", "criteria": [{"description": "Neat and consistent", "points": 1}]}]}
+    assert find_referenced_sheets(rubric, names) is None
+    assert find_referenced_sheets(rubric["tasks"][:1], names) == {"T 1 - Series & Scale"}
+    assert find_referenced_sheets([{"name": "Task 2 titles"}, {"name": "Neatness"}], names) is None
+    assert find_referenced_sheets("Task 1: fix the series. Task 2: add axis titles.", names) is None
+
+def test_lazy_parse_skips_unreferenced_sheets():
+    with Workbook(SUBMISSION) as wb:
+        lazy = parse_workbook_to_json(wb, sheets=["T 6 - XY Chart"])
+        # Only the head of the skipped sheets was read
+        assert wb.parse_counts[wb.sheet_map()["Honor Code"]] == 1
+    full = parse_workbook_to_json(SUBMISSION)
+
+    assert list(lazy["sheets"]) == ["T 6 - XY Chart"]
+    assert lazy["sheets"]["T 6 - XY Chart"] == full["sheets"]["T 6 - XY Chart"]
+    skipped = lazy["workbook_metadata"]["skipped_sheets"]
+    assert "Honor Code" in skipped and "A2:C13" in skipped["Honor Code"]
+    assert len(json.dumps(lazy, default=json_default)) < len(json.dumps(full, default=json_default)) / 5
+
+def test_cross_sheet_references_are_followed():
+    entry = {
+        "cells": {"B2": {"value": "3", "formula": "VLOOKUP(A2,'Lookup Tables'!$B$2:$E$72,2,FALSE)"}},
+        "metadata": {"drawings": [{"type": "chart", "details": {"series": [{"values": "Data!$B$2:$B$9"}]}}]}
+    }
+    assert referenced_sheet_names(entry) == {"lookup tables", "data"}
+
+if __name__ == "__main__":
+    # Measure the parser itself, not the on-disk parse cache (conftest.py does this under pytest)
+    parse_cache._default_cache = ParseCache(enabled=False)
+    test_rubric_tasks_map_to_task_sheets()
+    test_unmatched_rubric_keeps_every_sheet()
+    test_task_without_a_sheet_keeps_every_sheet()
+    test_lazy_parse_skips_unreferenced_sheets()
+    test_cross_sheet_references_are_followed()
+    print("OK")
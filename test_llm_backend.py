@@ -0,0 +1,87 @@
+import asyncio
+import time
+
+import utils.context_cache as context_cache
+import utils.llm_helper as llm_helper
+import utils.response_cache as response_cache
+from utils.context_cache import ContextCacheManager
+from utils.llm_backend import Completion, LLMBackend, SimulatedBackend, SimulatedError, set_backend
+from utils.request_governor import classify_error
+from utils.rubric_extractor import extract_rubric_from_sheet
+from utils.xml_helper import parse_workbook_to_json
+
+def with_backend(backend, fn):
+    saved = context_cache._default_manager, response_cache._default_cache
+    previous = set_backend(backend)
+    context_cache._default_manager = ContextCacheManager(min_tokens=500)
+    response_cache._default_cache = response_cache.ResponseCache(enabled=False)
+    try:
+        return fn()
+    finally:
+        set_backend(previous)
+        context_cache._default_manager, response_cache._default_cache = saved
+
+def test_helpers_get_schema_valid_answers():
+    backend = SimulatedBackend(latency=0, tokens_per_second=0)
+    rubric = extract_rubric_from_sheet("DataManagement.xlsm")
+    student = parse_workbook_to_json("DataManagement.xlsm")
+    criteria = [{"_id": "c1", "description": "Total is 10"}, {"_id": "c2", "description": "Chart added"}]
+
+    def run():
+        return (llm_helper.grade_student_work(student, rubric),
+                llm_helper.grade_student_work(student, rubric),
+                llm_helper.grade_manual_review_batch("A1:10", criteria, key="_id"),
+                llm_helper.grade_workbook_comparison("A1: 10", "A1: 10"),
+                llm_helper.generate_structured_rubric("Task 1: add a chart", 20, strategy="atomic"),
+                llm_helper.refine_structured_rubric([{"_id": "a", "points": 20}], "Split it", "Task 1", 20))
+    graded, regraded, review, comparison, rubric_items, refined = with_backend(backend, run)
+
+    report = graded["report"]
+    total = sum(t["points"] for t in rubric["tasks"])
+    assert [r["_id"] for r in report["result"]] == [c["_id"] for t in rubric["tasks"] for c in t["criteria"]]
+    assert report["score"]["earned"] == total and len(report["criteria"]) == len(report["result"])
+    assert regraded["report"] == report
+    assert set(review) == {"c1", "c2"} and review["c1"]["passed"]
+    assert comparison["passed"] and comparison["incorrect_cells"] == []
+    assert sum(c["points"] for c in rubric_items) == 20 and sum(c["points"] for c in refined) == 20
+    # The grading preamble went through the simulated context cache
+    assert backend.caches.created == 1 and backend.stats()["calls"] == 6
+
+def test_failures_and_concurrency():
+    failing = SimulatedBackend(latency=0, error_rate=1.0, seed=1)
+    try:
+        failing.generate("m", "hello")
+        assert False, "expected a simulated outage"
+    except SimulatedError as e:
+        assert classify_error(e) == "server"
+    assert failing.stats()["errors"] == 1
+    assert classify_error(SimulatedBackend(latency=0, rate_limit_rate=1.0)._start("m", "x", None)[1]) == "rate_limit"
+
+    backend = SimulatedBackend(latency=0.05, jitter=0.0, tokens_per_second=0)
+    async def burst():
+        return await asyncio.gather(*(backend.generate_async("m", f"prompt {i}") for i in range(20)))
+    started = time.perf_counter()
+    completions = asyncio.run(burst())
+    assert time.perf_counter() - started < 0.5
+    assert backend.stats()["peak_in_flight"] == 20 and all(c.text == "{}" and c.tokens for c in completions)
+
+def test_backends_must_generate():
+    class Silent(LLMBackend):
+        pass
+    try:
+        Silent()
+        assert False, "a backend without generate() can't be created"
+    except TypeError:
+        pass
+
+    class Echo(LLMBackend):
+        def generate(self, model, contents, config=None):
+            return Completion(contents)
+    # generate_async falls back to generate in a worker thread
+    assert asyncio.run(Echo().generate_async("m", "hello")).text == "hello"
+
+if __name__ == "__main__":
+    test_helpers_get_schema_valid_answers()
+    test_failures_and_concurrency()
+    test_backends_must_generate()
+    print("OK")
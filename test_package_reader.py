@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import zipfile
+from utils.package import BasePackage, ZipPackage, open_package, resolve_target
+from utils.xml_helper import get_sheet_map, parse_workbook_to_json
+
+WORKBOOK = "Data Visualization (2) copy.xlsm"
+
+def test_resolve_target():
+    assert resolve_target('xl/worksheets/sheet1.xml', '../drawings/drawing1.xml') == 'xl/drawings/drawing1.xml'
+    assert resolve_target('xl/workbook.xml', 'worksheets/sheet2.xml') == 'xl/worksheets/sheet2.xml'
+    assert resolve_target('xl/workbook.xml', '/xl/styles.xml') == 'xl/styles.xml'
+
+def test_incomplete_package_fails_when_created():
+    class NoOpen(BasePackage):
+        def exists(self, part):
+            return False
+    try:
+        NoOpen()
+        assert False, "a package without open() can't be created"
+    except TypeError:
+        pass
+
+def test_zip_package_matches_extracted_directory():
+    td = tempfile.mkdtemp()
+    try:
+        with zipfile.ZipFile(WORKBOOK, 'r') as z:
+            z.extractall(td)
+        from_dir = parse_workbook_to_json(td)
+    finally:
+        shutil.rmtree(td)
+
+    with open_package(WORKBOOK) as package:
+        assert isinstance(package, ZipPackage)
+        assert all(p.startswith('xl/worksheets/') for p in get_sheet_map(package).values())
+        from_zip = parse_workbook_to_json(package)
+
+    assert from_zip == from_dir
+    charts = [d for s in from_zip["sheets"].values() for d in s["metadata"]["drawings"]
+              if isinstance(d, dict) and d.get("type") == "chart"]
+    assert charts and any(c["details"].get("types") for c in charts)
+
+def test_workbook_file_path_and_bytes_are_accepted():
+    with open(WORKBOOK, 'rb') as f:
+        content = f.read()
+    assert parse_workbook_to_json(WORKBOOK) == parse_workbook_to_json(open_package(content))
+
+if __name__ == "__main__":
+    test_resolve_target()
+    test_incomplete_package_fails_when_created()
+    test_zip_package_matches_extracted_directory()
+    test_workbook_file_path_and_bytes_are_accepted()
+    print("OK")
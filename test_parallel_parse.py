@@ -0,0 +1,20 @@
+from utils.xml_helper import parse_workbook_to_json
+
+WORKBOOK = "DataManagement.xlsm"
+
+def test_parallel_parse_matches_serial():
+    serial = parse_workbook_to_json(WORKBOOK)
+    parallel = parse_workbook_to_json(WORKBOOK, workers=2)
+    assert parallel == serial
+    # Merged deterministically in sheet order
+    assert list(parallel["sheets"]) == list(serial["sheets"])
+
+def test_parallel_parse_from_memory():
+    with open(WORKBOOK, 'rb') as f:
+        content = f.read()
+    assert parse_workbook_to_json(content, workers=2) == parse_workbook_to_json(WORKBOOK)
+
+if __name__ == "__main__":
+    test_parallel_parse_matches_serial()
+    test_parallel_parse_from_memory()
+    print("OK")
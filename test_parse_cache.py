@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+from utils.parse_cache import ParseCache, source_digest
+from utils.xml_helper import PARSER_VERSION, Workbook, parse_workbook_to_json
+
+WORKBOOK = "DataManagement.xlsm"
+
+def test_hit_skips_parsing():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(directory)
+        calls = []
+        def parse():
+            calls.append(1)
+            return parse_workbook_to_json(Workbook(WORKBOOK))
+
+        first = cache.fetch('workbook', WORKBOOK, PARSER_VERSION, parse)
+        with open(WORKBOOK, 'rb') as f:
+            second = cache.fetch('workbook', f.read(), PARSER_VERSION, parse)
+        assert len(calls) == 1 and (cache.hits, cache.misses) == (1, 1)
+        assert second == first
+
+        # A new parser version or different parameters miss
+        cache.fetch('workbook', WORKBOOK, PARSER_VERSION + 1, parse)
+        cache.fetch('workbook', WORKBOOK, PARSER_VERSION, parse, ['data'])
+        assert len(calls) == 3
+    finally:
+        shutil.rmtree(directory)
+
+def test_lru_eviction():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(directory, max_bytes=20000)
+        blob = os.urandom(8000)
+        for i in range(4):
+            cache.fetch('blob', str(i).encode(), 1, lambda: blob)
+            # Keep entry 0 hot
+            assert cache.fetch('blob', b"0", 1, lambda: None) == blob
+        assert cache.size() <= 20000
+        assert cache.fetch('blob', b"0", 1, lambda: None) == blob
+        assert cache.fetch('blob', b"1", 1, lambda: None) is None
+    finally:
+        shutil.rmtree(directory)
+
+def test_writes_dont_list_the_directory():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(directory, max_bytes=20000)
+        listings = []
+        entries = cache._entries
+        cache._entries = lambda: listings.append(1) or entries()
+        for i in range(3):
+            cache.put(cache.key('blob', str(i), 1), os.urandom(4000))
+        cache.put(cache.key('blob', "0", 1), os.urandom(4000))
+        # Listed once to learn the starting size; replacing an entry doesn't grow the total
+        assert len(listings) == 1 and cache._total == sum(size for _, size, _ in entries())
+        for i in range(3, 6):
+            cache.put(cache.key('blob', str(i), 1), os.urandom(4000))
+        # Listed again only by the two writes that took the total past 20000 bytes
+        assert len(listings) == 3 and cache._total == sum(size for _, size, _ in entries()) <= 20000
+    finally:
+        shutil.rmtree(directory)
+
+def test_directories_are_not_cached():
+    assert source_digest(os.getcwd()) is None
+    assert source_digest(WORKBOOK) == source_digest(Workbook(WORKBOOK))
+
+if __name__ == "__main__":
+    test_hit_skips_parsing()
+    test_lru_eviction()
+    test_writes_dont_list_the_directory()
+    test_directories_are_not_cached()
+    print("OK")
@@ -0,0 +1,61 @@
+from utils.part_cache import PartCache
+from utils.xml_helper import Workbook, parse_workbook_to_json, _read_shared_strings_chunked, SST_CHUNK
+import utils.parse_cache as parse_cache
+from utils.parse_cache import ParseCache
+
+WORKBOOK = "Data Visualization (2) copy.xlsm"
+
+def sst(count):
+    items = "".join(f"<si><t>String {i}</t></si>" for i in range(count))
+    return (f'<?xml version="1.0"?><sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            f'count="{count}" uniqueCount="{count}">{items}</sst>').encode()
+
+def test_identical_parts_parse_once():
+    cache = PartCache()
+    with Workbook(WORKBOOK, part_cache=cache) as wb:
+        first = parse_workbook_to_json(wb)
+    misses = sum(cache.misses.values())
+    assert misses and not sum(cache.hits.values())
+
+    with Workbook(WORKBOOK, part_cache=cache) as wb:
+        second = parse_workbook_to_json(wb)
+    assert second == first
+    assert sum(cache.misses.values()) == misses
+    assert cache.stats()["styles"] == {"hits": 1, "misses": 1}
+    assert cache.stats()["chart"]["hits"] > 0
+
+def test_shared_parts_are_not_shared_objects():
+    reference = parse_workbook_to_json(WORKBOOK)
+    cache = PartCache()
+    with Workbook(WORKBOOK, part_cache=cache) as wb:
+        first = parse_workbook_to_json(wb)
+        # Edit this workbook's chart and style metadata in place
+        for style in wb.styles().values():
+            style["font"]["bold"] = True
+        for entry in first["sheets"].values():
+            for drawing in entry["metadata"].get("drawings", []):
+                if drawing.get("type") == "chart":
+                    drawing["details"].clear()
+    with Workbook(WORKBOOK, part_cache=cache) as wb:
+        second = parse_workbook_to_json(wb)
+    assert cache.stats()["chart"]["hits"] > 0 and cache.stats()["styles"]["hits"] == 1
+    assert second == reference
+
+def test_shared_strings_reuse_unchanged_chunks():
+    cache = PartCache()
+    template = _read_shared_strings_chunked(sst(2 * SST_CHUNK + 10), cache)
+    assert template == [f"String {i}" for i in range(2 * SST_CHUNK + 10)]
+    assert cache.misses["shared_strings"] == 3
+
+    # A submission that added a few strings only re-parses the last chunk
+    submission = _read_shared_strings_chunked(sst(2 * SST_CHUNK + 15), cache)
+    assert submission[-1] == f"String {2 * SST_CHUNK + 14}"
+    assert cache.hits["shared_strings"] == 2 and cache.misses["shared_strings"] == 4
+
+if __name__ == "__main__":
+    # Measure the parser itself, not the on-disk parse cache (conftest.py does this under pytest)
+    parse_cache._default_cache = ParseCache(enabled=False)
+    test_identical_parts_parse_once()
+    test_shared_parts_are_not_shared_objects()
+    test_shared_strings_reuse_unchanged_chunks()
+    print("OK")
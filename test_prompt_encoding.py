@@ -0,0 +1,54 @@
+from utils.delta import compute_workbook_delta
+from utils.prompt_encoding import StyleLegend, encode_cell, encode_cells, encode_for_prompt, token_report
+from utils.xml_helper import parse_workbook_to_json
+
+def test_cells():
+    styles = StyleLegend()
+    bold = {"font": {"bold": True}}
+    assert encode_cell({"value": "8.1593750000000007", "formula": "F8/160", "formula_type": "shared",
+                        "formula_ref": "E8:E39"}) == "=F8/160 → 8.159375 {shared E8:E39}"
+    assert encode_cell({"value": "5.96875", "formula": None, "formula_type": "shared", "formula_ref": None}) == "~5.96875"
+    assert encode_cell({"value": "007", "formula": None}) == '"007"'
+    assert encode_cell({"value": "", "formula": None}) is None
+
+    cells = {"B2": {"value": "Total", "style": bold}, "C2": {"value": "40"},
+             "D2": {"value": "", "style": bold}, "E2": {"value": "", "style": bold}, "F2": {"value": "", "style": bold},
+             "B3": {"value": "", "formula": None}, "C3": {"value": "5", "formula": "C2/8", "formula_type": "normal"}}
+    assert encode_cells(cells, styles) == ['B2:"Total" [s1] | C2:40 | D2..F2:"" [s1]', "C3:=C2/8 → 5"]
+    assert styles.render() == 'STYLES: s1={"font":{"bold":true}}'
+    # Without a legend styles are left out, and so are the empty cells
+    assert encode_cells(cells) == ['B2:"Total" | C2:40', "C3:=C2/8 → 5"]
+
+def test_workbook_encoding():
+    data = parse_workbook_to_json("DataManagement.xlsm")
+    text = encode_for_prompt(data)
+    for name, entry in data["sheets"].items():
+        assert f"=== SHEET: {name} ===" in text
+        for coord, cell in entry["cells"].items():
+            if cell.get("formula"):
+                assert f"{coord}:={cell['formula']} →" in text
+    report = token_report(data)
+    assert report["encoded_tokens"] * 5 < report["json_tokens"]
+    # Anything that isn't a workbook is compact JSON
+    assert encode_for_prompt({"tasks": [{"name": "T1", "points": 5}]}) == '{"tasks":[{"name":"T1","points":5}]}'
+
+def test_delta_encoding():
+    sheets = ["T 1 - Series & Scale", "T 7 - Sparklines"]
+    template = parse_workbook_to_json("Data Visualization (2) copy.xlsm", sheets=sheets)
+    student = parse_workbook_to_json("grossjordan_34944_1593395_Data Visualization - Jordan Gross.xlsm", sheets=sheets)
+    student["sheets"]["T 7 - Sparklines"]["cells"] = dict(student["sheets"]["T 7 - Sparklines"]["cells"])
+    cells = student["sheets"]["T 7 - Sparklines"]["cells"]
+    cells["C9"] = dict(cells["C9"], value="12", formula="SUM(C3:C4)")
+    cells["H30"] = {"value": "Done", "formula": None}
+    text = encode_for_prompt(compute_workbook_delta(template, student))
+    assert "DELTA against the blank assignment template" in text
+    assert "=== SHEET: T 1 - Series & Scale ===" in text and "METADATA CHANGES:" in text
+    assert 'CHANGED:\nC9:=SUM(C3:C4) → 12 (template: "")' in text
+    assert 'ADDED:\nH30:"Done"' in text
+    assert "SKIPPED SHEETS" in text
+
+if __name__ == "__main__":
+    test_cells()
+    test_workbook_encoding()
+    test_delta_encoding()
+    print("OK")
@@ -0,0 +1,122 @@
+import asyncio
+from types import SimpleNamespace
+from google.genai import errors
+from utils.llm_backend import GenaiBackend, SimulatedBackend
+from utils.request_governor import RequestGovernor, TokenBucket, classify_error, estimate_tokens, retry_after
+
+class FakeClock:
+    """Time only moves when someone sleeps."""
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    async def async_sleep(self, seconds):
+        self.sleep(seconds)
+
+def rate_limited(delay="3s"):
+    return errors.ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "quota",
+                                              "details": [{"retryDelay": delay}]}})
+
+def flaky(failures):
+    """Raises the given errors in turn, then answers."""
+    failures = list(failures)
+    def fn():
+        if failures:
+            raise failures.pop(0)
+        return "ok"
+    return fn
+
+def test_error_classes():
+    assert classify_error(rate_limited()) == "rate_limit" and retry_after(rate_limited("1.5s")) == 1.5
+    assert classify_error(errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE"}})) == "server"
+    assert classify_error(errors.ClientError(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}})) == "client"
+    assert classify_error(ConnectionResetError()) == "network"
+    assert classify_error(ValueError("bad json")) == "other"
+
+def test_buckets_pace_requests_and_tokens():
+    clock = FakeClock()
+    governor = RequestGovernor(rpm=6, tpm=600, clock=clock, sleep=clock.sleep)
+    for _ in range(8):
+        governor.call(lambda: "ok")
+    # 6 requests of burst, then one every 10 seconds
+    assert clock.sleeps == [10.0, 10.0]
+
+    clock = FakeClock()
+    bucket = TokenBucket(600, clock=clock)
+    assert bucket.reserve(600) == 0.0 and bucket.reserve(300) == 30.0
+    bucket.charge(-300)  # the call used less than reserved
+    assert bucket.reserve(1) == 0.1
+
+def test_only_prompt_tokens_are_charged():
+    response = SimpleNamespace(text="{}", usage_metadata=SimpleNamespace(
+        prompt_token_count=40, candidates_token_count=500, total_token_count=540))
+    client = SimpleNamespace(models=SimpleNamespace(generate_content=lambda **kwargs: response))
+    clock = FakeClock()
+    governor = RequestGovernor(rpm=0, tpm=600, clock=clock, sleep=clock.sleep)
+    completion = governor.call(lambda: GenaiBackend(client=client).generate("m", "x" * 400),
+                               tokens=101, usage=lambda c: c.tokens)
+    # Reserved 101, settled at the 40 prompt tokens; the 500 output tokens aren't charged
+    assert completion.tokens == 40 and governor.tokens.level == 560
+
+    prompt = "CRITERIA TO EVALUATE: " + "x" * 400
+    completion = SimulatedBackend(latency=0, tokens_per_second=0).generate("m", prompt)
+    assert completion.tokens == estimate_tokens(prompt)
+
+def test_retries_follow_policy():
+    clock = FakeClock()
+    governor = RequestGovernor(rpm=60, tpm=0, clock=clock, sleep=clock.sleep)
+    assert governor.call(flaky([rate_limited("3s"), ConnectionResetError()])) == "ok"
+    assert clock.sleeps[0] >= 3.0 and governor.stats()["retries"] == 2
+
+    # A 429 holds back every caller, not only the one that got it
+    assert governor.requests.reserve(1) > 0
+
+    bad_request = errors.ClientError(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}})
+    try:
+        governor.call(flaky([bad_request]))
+        assert False, "client errors are not retried"
+    except errors.ClientError:
+        pass
+    governor.policies["server"] = {"retries": 1, "base_delay": 1.0, "max_delay": 1.0}
+    outage = errors.ServerError(503, {"error": {"code": 503, "status": "UNAVAILABLE"}})
+    try:
+        governor.call(flaky([outage, outage]))
+        assert False, "gives up after the policy's retries"
+    except errors.ServerError:
+        pass
+    assert governor.stats()["failures"] == 2
+
+    # Requests that never reached the server don't use up the quota
+    clock = FakeClock()
+    governor = RequestGovernor(rpm=2, tpm=0, clock=clock, sleep=clock.sleep)
+    for _ in range(3):
+        try:
+            governor.call(flaky([ConnectionRefusedError()] * 3))
+        except ConnectionRefusedError:
+            pass
+    assert governor.requests.reserve(1) == 0.0
+
+def test_async_calls():
+    clock = FakeClock()
+    governor = RequestGovernor(rpm=60, tpm=0, clock=clock, sleep=clock.sleep, async_sleep=clock.async_sleep)
+    failures = [rate_limited("2s")]
+    async def fn():
+        if failures:
+            raise failures.pop()
+        return "ok"
+    assert asyncio.run(governor.call_async(fn)) == "ok" and clock.sleeps[0] >= 2.0
+
+if __name__ == "__main__":
+    test_error_classes()
+    test_buckets_pace_requests_and_tokens()
+    test_only_prompt_tokens_are_charged()
+    test_retries_follow_policy()
+    test_async_calls()
+    print("OK")
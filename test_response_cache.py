@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import utils.llm_helper as llm_helper
+import utils.response_cache as response_cache
+from utils.llm_backend import GenaiBackend, set_backend
+from utils.response_cache import ResponseCache
+
+class FakeModels:
+    """Stands in for client.models: answers every criterion with a pass."""
+    def __init__(self):
+        self.calls = []
+
+    def generate_content(self, model, contents, config=None):
+        self.calls.append(model)
+        return type("Response", (), {"text": '```json\n{"Total is 10": {"passed": true, "feedback": "ok"}}\n```'})()
+
+def test_hits_and_bypass():
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ResponseCache(os.path.join(directory, "llm.sqlite3"))
+        calls = []
+        def generate():
+            calls.append(1)
+            return '{"ok": true}'
+
+        first = cache.fetch("m", "  Grade this\n    A1 = 5 ", {"temperature": 0}, generate)
+        # Indentation differences don't matter; model and config do
+        second = cache.fetch("m", "Grade this\nA1 = 5", {"temperature": 0}, generate)
+        assert first == second and len(calls) == 1
+        cache.fetch("m2", "Grade this\nA1 = 5", {"temperature": 0}, generate)
+        cache.fetch("m", "Grade this\nA1 = 5", {"temperature": 0.2}, generate)
+        assert len(calls) == 3
+        assert cache.stats()["hits"] == 1 and cache.stats()["hit_rate"] == 0.25 and cache.stats()["entries"] == 3
+
+        cache.fetch("m", "Grade this\nA1 = 5", {"temperature": 0}, generate, use_cache=False)
+        cache.enabled = False
+        cache.fetch("m", "Grade this\nA1 = 5", {"temperature": 0}, generate)
+        assert len(calls) == 5
+
+        # Answers that fail validation are not kept
+        cache.enabled = True
+        cache.fetch("m", "broken", None, lambda: "not json", validate=llm_helper._check_json)
+        assert cache.fetch("m", "broken", None, generate, validate=llm_helper._check_json) == '{"ok": true}'
+    finally:
+        shutil.rmtree(directory)
+
+def test_ttl_and_size_bound():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "llm.sqlite3")
+        expired = ResponseCache(path, ttl=-1)
+        expired.put("k", "m", "old")
+        assert expired.get("k") is None and expired.stats()["entries"] == 0
+
+        cache = ResponseCache(path, max_bytes=3000)
+        blob = os.urandom(1200).hex()  # incompressible enough
+        for i in range(4):
+            cache.put(str(i), "m", blob)
+            assert cache.get("0") == blob  # keep entry 0 hot
+        assert cache.stats()["bytes"] <= 3000
+        assert cache.get("0") == blob and cache.get("1") is None
+    finally:
+        shutil.rmtree(directory)
+
+def test_unwritable_directory_falls_back_to_the_model():
+    directory = tempfile.mkdtemp()
+    try:
+        blocker = os.path.join(directory, "not-a-directory")
+        open(blocker, "w").close()
+        cache = ResponseCache(os.path.join(blocker, "cache", "llm.sqlite3"))
+        calls = []
+        def generate():
+            calls.append(1)
+            return '{"ok": true}'
+        assert cache.fetch("m", "Grade this", None, generate) == '{"ok": true}'
+        assert cache.fetch("m", "Grade this", None, generate) == '{"ok": true}' and len(calls) == 2
+        assert cache.stats()["entries"] == 0
+        cache.clear()
+    finally:
+        shutil.rmtree(directory)
+
+def test_regrade_served_from_cache():
+    directory = tempfile.mkdtemp()
+    original_cache = response_cache._default_cache
+    fake = FakeModels()
+    previous = set_backend(GenaiBackend(client=type("Client", (), {"models": fake})()))
+    response_cache._default_cache = ResponseCache(os.path.join(directory, "llm.sqlite3"))
+    try:
+        criteria = [{"description": "Total is 10", "type": "manual_review"}]
+        first = llm_helper.grade_manual_review_batch("A1: 10", criteria)
+        second = llm_helper.grade_manual_review_batch("A1: 10", criteria)
+        assert first == second and first["Total is 10"]["passed"]
+        assert fake.calls == [llm_helper.REVIEW_MODEL]
+        assert response_cache._default_cache.hits == 1
+    finally:
+        set_backend(previous)
+        response_cache._default_cache = original_cache
+        shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    test_hits_and_bypass()
+    test_ttl_and_size_bound()
+    test_unwritable_directory_falls_back_to_the_model()
+    test_regrade_served_from_cache()
+    print("OK")
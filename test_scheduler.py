@@ -0,0 +1,86 @@
+import json
+
+from grader import grade_submission
+from utils.evaluator import check_data_validation, check_sparkline, evaluate_criteria
+from utils.rubric_extractor import extract_rubric_from_sheet
+from utils.scheduler import classify_criterion, infer_checks, merge_local_results, schedule_rubric
+from utils.xml_helper import parse_workbook_to_json
+
+CHART_WORKBOOK = "grossjordan_34944_1593395_Data Visualization - Jordan Gross.xlsm"
+
+def test_classification():
+    assert classify_criterion({"type": "value_match", "cell": "B2"}) == "local"
+    assert classify_criterion({"type": "chart_axis", "field": "max", "expected": 60}) == "local"
+    assert classify_criterion({"type": "manual_review", "description": "- Y axis Major Unit is $20 and maximum value is $60."}) == "inferred"
+    # Only part of the wording is understood: the model decides
+    assert classify_criterion({"type": "manual_review", "description": "Legend moved to top; plot area expanded to right."}) == "llm"
+    assert classify_criterion({"_id": "x", "name": "Thesis Clarity", "points": 5}) == "llm"
+    assert infer_checks("The maximum revenue projection index is 10%.") is None
+    assert infer_checks("Y axis minimum is 0, max is 2,000") == [
+        {"type": "chart_axis", "axis": "y", "field": "min", "expected": 0.0, "tolerance": 1e-9},
+        {"type": "chart_axis", "axis": "y", "field": "max", "expected": 2000.0, "tolerance": 1e-9}]
+
+def test_metadata_checks():
+    data = parse_workbook_to_json(CHART_WORKBOOK)
+    sparklines = data["sheets"]["T 7 - Sparklines"]["metadata"]
+    assert check_sparkline(sparklines, "win/loss", "E9")
+    assert not check_sparkline(sparklines, "line", "E9")
+    meta = {"validations": [{"type": "list", "sqref": "C1 D2:D9", "formula1": "$A$1:$A$3", "formula2": ""}]}
+    assert check_data_validation(meta, "D5", "list", "A1:A3")
+    assert not check_data_validation(meta, "E5", "list")
+    chart_sheet = data["sheets"]["T 6 - XY Chart"]
+    assert evaluate_criteria(chart_sheet["cells"], {"type": "chart_type", "expected": "scatter", "points": 2},
+                             chart_sheet["metadata"]) == (2, [])
+    assert evaluate_criteria(chart_sheet["cells"], {"type": "chart_axis", "axis": "y", "field": "min", "expected": 40,
+                                                    "points": 1}, chart_sheet["metadata"]) == (1, [])
+
+def test_embedded_rubric_split():
+    rubric = extract_rubric_from_sheet(CHART_WORKBOOK)
+    plan = schedule_rubric(rubric, parse_workbook_to_json(CHART_WORKBOOK))
+    # T6_crit_1 ("Chart changed correctly to the XY type") is on a sheet with four charts: the model decides
+    assert [r["_id"] for r in plan["results"]] == ["T1_crit_3"]
+    assert all(r["obtainedPoints"] > 0 for r in plan["results"])
+    remaining = [c["_id"] for t in plan["rubric"]["tasks"] for c in t["criteria"]]
+    assert "T1_crit_3" not in remaining and "T6_crit_1" in remaining and len(remaining) == plan["stats"]["llm"]
+
+    # The model's answer for the rest is merged back in rubric order
+    model_report = {"summary": "Good work.", "score": {"earned": 1, "max": 1, "letter": "A"},
+                    "result": [{"_id": "T1_crit_1", "obtainedPoints": 1, "explanation": "ok", "evidence": "chart"}]}
+    report = merge_local_results(model_report, plan)
+    assert [r["_id"] for r in report["result"]] == ["T1_crit_1", "T1_crit_3"]
+    assert report["score"]["earned"] == 1 + plan["results"][0]["obtainedPoints"] and report["score"]["max"] == sum(
+        c["points"] for t in rubric["tasks"] for c in t["criteria"])
+    assert len(report["criteria"]) == 2
+
+def _chart(minimum="auto", maximum="auto"):
+    axes = {"1": {"tag": "c:catAx"}, "2": {"tag": "c:valAx", "min": minimum, "max": maximum, "major_unit": "auto"}}
+    return {"type": "chart", "details": {"types": ["bar"], "axes": axes, "legend_pos": "r"}}
+
+def test_inferred_checks_hold_on_one_chart():
+    rubric = [{"_id": "c", "description": "Y axis minimum is 0, max is 2,000", "points": 5}]
+    def plan_for(*charts):
+        data = {"sheets": {"S": {"cells": {}, "metadata": {"drawings": list(charts)}}}}
+        return schedule_rubric(rubric, data)
+    # min on one chart, max on another: not a pass, and which chart is meant isn't known
+    assert plan_for(_chart(minimum=0.0), _chart(maximum=2000.0))["stats"] == {"local": 0, "llm": 1, "deferred": 0}
+    assert plan_for(_chart(minimum=0.0))["stats"]["deferred"] == 1
+    plan = plan_for(_chart(minimum=0.0, maximum=2000.0))
+    assert plan["rubric"] is None and plan["results"][0]["obtainedPoints"] == 5
+
+def test_typed_rubric_needs_no_model():
+    with open("rubric_sample.json") as f:
+        rubric = json.load(f)
+    result = grade_submission("DataManagement.xlsm", rubric_data=rubric)
+    report = result["report"]
+    assert report["mode"] == "local"
+    assert report["schedule"] == {"local": 4, "llm": 0, "deferred": 0}
+    assert report["score"]["max"] == 100
+    assert [c["earned"] for c in report["criteria"]] == [10, 10, 0, 40]
+
+if __name__ == "__main__":
+    test_classification()
+    test_metadata_checks()
+    test_embedded_rubric_split()
+    test_inferred_checks_hold_on_one_chart()
+    test_typed_rubric_needs_no_model()
+    print("OK")
@@ -0,0 +1,61 @@
+import os
+import tempfile
+from utils.xml_helper import iter_sheet_rows, parse_sheet_full
+
+SHEET_HEAD = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+ xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+ xmlns:x14="http://schemas.microsoft.com/office/spreadsheetml/2009/9/main"
+ xmlns:xm="http://schemas.microsoft.com/office/excel/2006/main">
+<sheetViews><sheetView tabSelected="1" zoomScale="90" workbookViewId="0"/></sheetViews>
+<sheetData>
+"""
+
+SHEET_TAIL = """</sheetData>
+<mergeCells count="1"><mergeCell ref="A1:B1"/></mergeCells>
+<conditionalFormatting sqref="B1:B10"><cfRule type="colorScale" priority="1"/></conditionalFormatting>
+<dataValidations count="1"><dataValidation type="list" sqref="C1"><formula1>$A$1:$A$3</formula1></dataValidation></dataValidations>
+<extLst><ext uri="{05C60535-1F16-4fd2-B633-F4F36F0B64E0}"><x14:sparklineGroups>
+<x14:sparklineGroup type="column"><x14:sparklines><x14:sparkline><xm:f>Sheet1!A1:A5</xm:f><xm:sqref>D1</xm:sqref></x14:sparkline></x14:sparklines></x14:sparklineGroup>
+</x14:sparklineGroups></ext></extLst>
+</worksheet>
+"""
+
+def write_sheet(rows):
+    fd, path = tempfile.mkstemp(suffix=".xml")
+    with os.fdopen(fd, 'w') as f:
+        f.write(SHEET_HEAD)
+        for r in range(1, rows + 1):
+            f.write(f'<row r="{r}"><c r="A{r}" t="s"><v>0</v></c><c r="B{r}" s="1"><f>A{r}*2</f><v>{r * 2}</v></c></row>\n')
+        f.write(SHEET_TAIL)
+    return path
+
+def test_iter_sheet_rows_yields_rows_in_order():
+    path = write_sheet(50)
+    try:
+        rows = list(iter_sheet_rows(path, ["Label"]))
+        assert [r for r, _ in rows] == list(range(1, 51))
+        coord, cell = rows[9][1][1]
+        assert coord == "B10"
+        assert cell["formula"] == "A10*2" and cell["value"] == "20" and cell["style_idx"] == "1"
+        assert rows[0][1][0][1]["value"] == "Label"
+    finally:
+        os.remove(path)
+
+def test_parse_sheet_full_collects_trailing_sections():
+    path = write_sheet(1000)
+    try:
+        cells, metadata = parse_sheet_full(path, ["Label"])
+        assert len(cells) == 2000
+        assert metadata["merge_cells"] == ["A1:B1"]
+        assert metadata["validations"][0]["formula1"] == "$A$1:$A$3"
+        assert metadata["conditional_formatting"][0]["type"] == "colorScale"
+        assert metadata["sparklines"][0]["sparklines"] == [{"data_range": "Sheet1!A1:A5", "location": "D1"}]
+        assert metadata["view_settings"]["tabSelected"] is True
+    finally:
+        os.remove(path)
+
+if __name__ == "__main__":
+    test_iter_sheet_rows_yields_rows_in_order()
+    test_parse_sheet_full_collects_trailing_sections()
+    print("OK")
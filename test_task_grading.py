@@ -0,0 +1,74 @@
+import asyncio
+
+import utils.task_grading as task_grading
+from utils.rubric_extractor import extract_rubric_from_sheet
+from utils.task_grading import grade_by_task, linked_sheets, split_by_task
+from utils.xml_helper import parse_workbook_to_json
+
+WORKBOOK = "DataManagement.xlsm"
+
+def fake_grader(calls, state):
+    """Stands in for the model: full marks on every criterion it is shown."""
+    async def grade(student_data, rubric_data=None, answer_key_data=None, key_diff=None):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        await asyncio.sleep(0.01)
+        state["active"] -= 1
+        task = rubric_data["tasks"][0]
+        calls.append((task["name"], sorted(student_data["sheets"])))
+        results = [{"_id": c["_id"], "obtainedPoints": c["points"], "explanation": "ok", "evidence": "seen"}
+                   for c in task["criteria"]]
+        return {"report": {"summary": "Fine.", "score": {}, "result": results[::-1], "incorrect_cells": []},
+                "prompt": task["name"]}
+    return grade
+
+def run(max_tokens_in_flight):
+    rubric = extract_rubric_from_sheet(WORKBOOK)
+    data = parse_workbook_to_json(WORKBOOK)
+    calls, state = [], {"active": 0, "peak": 0}
+    original = task_grading.grade_student_work_async
+    task_grading.grade_student_work_async = fake_grader(calls, state)
+    try:
+        return rubric, grade_by_task(data, rubric, max_tokens_in_flight=max_tokens_in_flight), calls, state
+    finally:
+        task_grading.grade_student_work_async = original
+
+def test_one_prompt_per_task():
+    rubric, response, calls, state = run(max_tokens_in_flight=10 ** 6)
+    assert len(calls) == len(rubric["tasks"]) and state["peak"] > 1
+    # Each prompt only carries its own sheet
+    assert dict(calls)["T 6 - Data Validation"] == ["T 6 - Data Validation"]
+
+    report = response["report"]
+    ids = [c["_id"] for t in rubric["tasks"] for c in t["criteria"]]
+    assert [r["_id"] for r in report["result"]] == ids
+    assert report["score"]["earned"] == report["score"]["max"] == sum(t["points"] for t in rubric["tasks"])
+    assert report["score"]["letter"] == "A" and len(report["criteria"]) == len(ids)
+    assert report["summary"].startswith("T 1 - VLOOKUP: Fine.")
+
+def test_budget_serializes_large_prompts():
+    _, response, calls, state = run(max_tokens_in_flight=1)
+    assert state["peak"] == 1 and response["report"]["tasks_graded"] == len(calls)
+
+def test_split_keeps_linked_sheets():
+    data = parse_workbook_to_json(WORKBOOK)
+    names = list(data["sheets"])
+    entry = {"cells": {"C5": {"value": "x", "formula": "VLOOKUP(B5,'Lookup Tables'!A1:B9,2,FALSE)"}},
+             "metadata": {"validations": [{"formula1": "'T 3 - Text to Columns'!$A$1:$A$3"}]}}
+    assert linked_sheets(entry, names) == {"Lookup Tables", "T 3 - Text to Columns"}
+    # Sparkline sources count too, and references needn't match the sheet name's case
+    sparklines = {"cells": {"A1": {"value": "1", "formula": "'lookup TABLES'!B2"}},
+                  "metadata": {"sparklines": [{"sparklines": [{"location": "E9", "data_range": "'T 3 - TEXT TO COLUMNS'!B9:D9"}]}]}}
+    assert linked_sheets(sparklines, names) == {"Lookup Tables", "T 3 - Text to Columns"}
+
+    data["sheets"]["T 1 - VLOOKUP()"] = dict(data["sheets"]["T 1 - VLOOKUP()"], cells=entry["cells"])
+    jobs = split_by_task(data, extract_rubric_from_sheet(WORKBOOK))
+    first = jobs[0]["request"]["student_data"]
+    assert sorted(first["sheets"]) == ["Lookup Tables", "T 1 - VLOOKUP()"]
+    assert "Scoring Guide" in first["workbook_metadata"]["skipped_sheets"]
+
+if __name__ == "__main__":
+    test_one_prompt_per_task()
+    test_budget_serializes_large_prompts()
+    test_split_keeps_linked_sheets()
+    print("OK")
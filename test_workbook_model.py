@@ -0,0 +1,50 @@
+from utils.xml_helper import Workbook, parse_workbook_to_json, get_sheet_map, get_shared_strings, parse_styles_xml
+from utils.rubric_extractor import extract_rubric_from_sheet
+import utils.parse_cache as parse_cache
+from utils.parse_cache import ParseCache
+
+WORKBOOK = "Data Visualization (2) copy.xlsm"
+
+def test_each_part_is_parsed_once():
+    with Workbook(WORKBOOK) as wb:
+        data = parse_workbook_to_json(wb)
+        assert data["sheets"]
+        assert wb.parse_counts['xl/workbook.xml'] == 1
+        assert wb.parse_counts['xl/_rels/workbook.xml.rels'] == 1
+        assert any(p.startswith('xl/charts/') for p in wb.parse_counts)
+        assert max(wb.parse_counts.values()) == 1
+
+        # Helpers called with the same Workbook are served from the memo
+        before = wb.parse_count
+        get_sheet_map(wb)
+        get_shared_strings(wb)
+        parse_styles_xml(wb)
+        assert wb.parse_count == before
+
+def test_embedded_rubric_reuses_workbook():
+    with Workbook(WORKBOOK) as wb:
+        parse_workbook_to_json(wb)
+        before = wb.parse_count
+        rubric = extract_rubric_from_sheet(wb)
+        assert rubric and rubric["tasks"]
+        # Only the scoring sheet itself is read again
+        assert wb.parse_count == before + 1
+
+def test_cells_share_compact_styles():
+    with Workbook(WORKBOOK) as wb:
+        compact = parse_styles_xml(wb, compact=True)
+        assert compact and all(compact.values())
+        data = parse_workbook_to_json(wb)
+        styled = [c["style"] for sheet in data["sheets"].values() for c in sheet["cells"].values() if "style" in c]
+        assert styled
+        # One dict per distinct style index, however many cells use it
+        assert len({id(s) for s in styled}) <= len(compact)
+        assert all(any(s is v for v in compact.values()) for s in styled)
+
+if __name__ == "__main__":
+    # Measure the parser itself, not the on-disk parse cache (conftest.py does this under pytest)
+    parse_cache._default_cache = ParseCache(enabled=False)
+    test_each_part_is_parsed_once()
+    test_embedded_rubric_reuses_workbook()
+    test_cells_share_compact_styles()
+    print("OK")
@@ -0,0 +1,168 @@
+import json
+import os
+import shutil
+import time
+import uuid
+
+# Batch jobs: many generate_content requests submitted together as one JSONL file and
+# answered asynchronously, at a lower price than interactive calls and without the
+# per-minute limits, in exchange for latency (minutes to hours).
+#
+# The job file has one request per line in the Gemini batch format:
+#   {"key": "...", "request": {"contents": [...], "generation_config": {...}}}
+# and the results file one line per request with the same key and either a "response"
+# (a GenerateContentResponse) or an "error".
+#
+# A batch backend (the batches of an LLMBackend, see utils.llm_backend) offers
+#   submit(model, job_path, display_name=None) -> job name
+#   poll(name) -> PENDING | RUNNING | SUCCEEDED | FAILED | CANCELLED | EXPIRED
+#   results(name) -> iterator of (key, answer text or the exception the request failed with)
+# GenaiBatchBackend runs the job on the Gemini API; LocalBatchBackend works through it
+# in a directory, a few requests per poll, with any generate(model, contents, config).
+#
+# Settings (environment):
+#   GRADER_BATCH_DIR=path   where LocalBatchBackend keeps its jobs (default ~/.cache/excel-grader/batches)
+
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "excel-grader", "batches")
+FINISHED = ("SUCCEEDED", "FAILED", "CANCELLED", "EXPIRED")
+
+
+class BatchError(Exception):
+    """A batch job, or one request in it, that failed."""
+
+
+def batch_request(key, contents, config=None):
+    """One line of a job file: the request for a text prompt."""
+    request = {"contents": [{"role": "user", "parts": [{"text": contents}]}]}
+    if config:
+        request["generation_config"] = config
+    return {"key": key, "request": request}
+
+def write_job(path, lines):
+    """Writes the job file (one batch_request per line); returns the number of requests."""
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for line in lines:
+            f.write(json.dumps(line, separators=(",", ":")) + "\n")
+            count += 1
+    return count
+
+def _prompt_text(request):
+    return "".join(part.get("text", "") for content in request.get("contents", []) for part in content.get("parts", []))
+
+def _answer(line):
+    """(key, text or BatchError) for a line of a results file."""
+    key = line.get("key")
+    error = line.get("error") or line.get("status")
+    if error:
+        return key, BatchError(f"request {key} failed: {error.get('message', error) if isinstance(error, dict) else error}")
+    try:
+        parts = line["response"]["candidates"][0]["content"]["parts"]
+        return key, "".join(part.get("text", "") for part in parts)
+    except (KeyError, IndexError, TypeError):
+        return key, BatchError(f"request {key} has no answer")
+
+def _job_state(state):
+    """JOB_STATE_SUCCEEDED (or a JobState) -> SUCCEEDED."""
+    name = getattr(state, "name", None) or str(state)
+    return name.rsplit("_STATE_", 1)[-1]
+
+def wait_for_batch(batches, name, poll_interval=30.0, timeout=None, sleep=time.sleep, clock=time.monotonic):
+    """Polls the job until it finishes; raises BatchError unless it succeeded (or on timeout)."""
+    started = clock()
+    while True:
+        state = batches.poll(name)
+        if state in FINISHED:
+            if state != "SUCCEEDED":
+                raise BatchError(f"batch job {name} ended {state}")
+            return state
+        if timeout is not None and clock() - started > timeout:
+            raise BatchError(f"batch job {name} still {state} after {timeout:.0f} s")
+        sleep(poll_interval)
+
+
+class GenaiBatchBackend:
+    """Batch jobs on the Gemini API (client.files and client.batches of a genai.Client)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, model, job_path, display_name=None):
+        uploaded = self.client.files.upload(file=job_path, config={"mime_type": "jsonl", "display_name": display_name})
+        return self.client.batches.create(model=model, src=uploaded.name, config={"display_name": display_name}).name
+
+    def poll(self, name):
+        return _job_state(self.client.batches.get(name=name).state)
+
+    def results(self, name):
+        dest = self.client.batches.get(name=name).dest
+        content = self.client.files.download(file=dest.file_name)
+        for raw in content.decode("utf-8").splitlines():
+            if raw.strip():
+                yield _answer(json.loads(raw))
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for batch jobs (tests, offline runs): a job is a directory with
+    the submitted input.jsonl, output.jsonl and state.json. Each poll answers up to
+    requests_per_poll more requests (all of them when None) through generate; a request
+    that raises gets an error line, like on the API. Jobs survive the process.
+    """
+
+    def __init__(self, generate, directory=None, requests_per_poll=None):
+        self.generate = generate
+        self.directory = directory
+        self.requests_per_poll = requests_per_poll
+
+    def _path(self, name, filename):
+        directory = self.directory or os.environ.get('GRADER_BATCH_DIR') or DEFAULT_DIR
+        return os.path.join(directory, name, filename)
+
+    def _state(self, name):
+        with open(self._path(name, "state.json"), encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save_state(self, name, state):
+        path = self._path(name, "state.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(path + ".tmp", path)
+
+    def submit(self, model, job_path, display_name=None):
+        name = f"local-{uuid.uuid4().hex[:12]}"
+        os.makedirs(os.path.dirname(self._path(name, "input.jsonl")), exist_ok=True)
+        shutil.copyfile(job_path, self._path(name, "input.jsonl"))
+        open(self._path(name, "output.jsonl"), "w").close()
+        self._save_state(name, {"model": model, "display_name": display_name, "state": "PENDING", "done": 0})
+        return name
+
+    def poll(self, name):
+        state = self._state(name)
+        if state["state"] in FINISHED:
+            return state["state"]
+        with open(self._path(name, "input.jsonl"), encoding="utf-8") as f:
+            lines = [json.loads(raw) for raw in f if raw.strip()]
+        end = len(lines) if self.requests_per_poll is None else min(len(lines), state["done"] + self.requests_per_poll)
+        with open(self._path(name, "output.jsonl"), "a", encoding="utf-8") as out:
+            for line in lines[state["done"]:end]:
+                request = line.get("request", {})
+                try:
+                    completion = self.generate(state["model"], _prompt_text(request), request.get("generation_config"))
+                    result = {"key": line.get("key"), "response": {
+                        "candidates": [{"content": {"role": "model", "parts": [{"text": completion.text}]}}]}}
+                except Exception as e:
+                    result = {"key": line.get("key"), "error": {"message": f"{type(e).__name__}: {e}"}}
+                out.write(json.dumps(result, separators=(",", ":")) + "\n")
+        state["done"] = end
+        state["state"] = "SUCCEEDED" if end >= len(lines) else "RUNNING"
+        self._save_state(name, state)
+        return state["state"]
+
+    def results(self, name):
+        if self._state(name)["state"] != "SUCCEEDED":
+            raise BatchError(f"batch job {name} hasn't succeeded")
+        with open(self._path(name, "output.jsonl"), encoding="utf-8") as f:
+            for raw in f:
+                if raw.strip():
+                    yield _answer(json.loads(raw))
@@ -0,0 +1,194 @@
+import sys
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+from utils.coords import coord_sort_key, parse_coord, to_coord
+
+# Cells are keyed by row << COL_BITS | col (Excel has at most 16384 columns)
+COL_BITS = 15
+COL_MASK = (1 << COL_BITS) - 1
+
+NO_FORMULA = (None, "normal", "")
+
+
+def _key_for(coord):
+    if isinstance(coord, tuple):
+        row, col = coord
+        return row << COL_BITS | col
+    pos = parse_coord(coord) if isinstance(coord, str) else None
+    if pos is None:
+        return None
+    return pos[0] << COL_BITS | pos[1]
+
+def _coord_for(key):
+    return to_coord(key >> COL_BITS, key & COL_MASK)
+
+
+class SheetCells(Mapping):
+    """
+    Compact, read-only cell table for one sheet.
+
+    Cells are kept in parallel arrays sorted row-major by integer (row, col) key:
+    shared-string cells store the index into the workbook's shared strings instead of a
+    copy, style indices are plain ints, and formulas live in a sparse side table.
+    cells["B3"] (or cells[(3, 2)]) still returns the familiar cell dict, built on demand:
+        {"value", "formula", "formula_type", "formula_ref", "style_idx"}
+    With a style table (see parse_styles_xml(compact=True)), cells carry the resolved
+    "style" dict instead of "style_idx" -- the shape parse_workbook_to_json has always dumped.
+    """
+
+    def __init__(self, shared_strings=(), styles=None):
+        self._keys = array('q')
+        self._sst = array('l')       # shared string index, -1 for inline values
+        self._style = array('l')     # style index, -1 for none
+        self._values = []            # inline value (None for shared-string cells)
+        self._formulas = {}          # key -> (formula, formula_type, formula_ref)
+        self._shared_strings = shared_strings
+        self._styles = styles
+
+    def add(self, coord, value="", sst_idx=-1, style_idx=-1, formula=NO_FORMULA):
+        """
+        Stores a cell. coord is "A1" or (row, col). Cells normally arrive in row-major
+        order; anything out of order is inserted in place.
+        Returns the (row, col) of the cell.
+        """
+        key = _key_for(coord)
+        if key is None:
+            raise ValueError(f"Invalid cell reference: {coord!r}")
+
+        if sst_idx < 0:
+            value = sys.intern(value)
+        else:
+            value = None
+
+        keys = self._keys
+        if not keys or key > keys[-1]:
+            keys.append(key)
+            self._sst.append(sst_idx)
+            self._style.append(style_idx)
+            self._values.append(value)
+        else:
+            pos = bisect_left(keys, key)
+            if pos < len(keys) and keys[pos] == key:
+                # Duplicate reference: last one wins, as with a dict
+                self._sst[pos] = sst_idx
+                self._style[pos] = style_idx
+                self._values[pos] = value
+            else:
+                keys.insert(pos, key)
+                self._sst.insert(pos, sst_idx)
+                self._style.insert(pos, style_idx)
+                self._values.insert(pos, value)
+
+        if formula != NO_FORMULA:
+            self._formulas[key] = formula
+        else:
+            self._formulas.pop(key, None)
+        return key >> COL_BITS, key & COL_MASK
+
+    def _pos(self, coord):
+        key = _key_for(coord)
+        if key is None:
+            return -1
+        pos = bisect_left(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return pos
+        return -1
+
+    def _cell(self, pos):
+        key = self._keys[pos]
+        sst = self._sst[pos]
+        value = self._shared_strings[sst] if sst >= 0 else self._values[pos]
+        formula, formula_type, formula_ref = self._formulas.get(key, NO_FORMULA)
+        cell = {
+            "value": value,
+            "formula": formula,
+            "formula_type": formula_type,
+            "formula_ref": formula_ref,
+        }
+        style = self._style[pos]
+        if self._styles is None:
+            cell["style_idx"] = str(style) if style >= 0 else None
+        elif style >= 0 and str(style) in self._styles:
+            cell["style"] = self._styles[str(style)]
+        return cell
+
+    def __getitem__(self, coord):
+        pos = self._pos(coord)
+        if pos < 0:
+            raise KeyError(coord)
+        return self._cell(pos)
+
+    def __contains__(self, coord):
+        return self._pos(coord) >= 0
+
+    def __iter__(self):
+        return map(_coord_for, self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def items(self):
+        # Row-major; avoids a second bisect per cell
+        return [(_coord_for(key), self._cell(pos)) for pos, key in enumerate(self._keys)]
+
+    def values(self):
+        return [self._cell(pos) for pos in range(len(self._keys))]
+
+    def positions(self):
+        """Yields (row, col) for every cell, row-major."""
+        for key in self._keys:
+            yield key >> COL_BITS, key & COL_MASK
+
+    def compact(self, styles):
+        """
+        Returns a new SheetCells keeping only cells with content or a style in the
+        compact style table, which the returned cells expose as "style".
+        """
+        out = SheetCells(self._shared_strings, styles)
+        for pos, key in enumerate(self._keys):
+            sst = self._sst[pos]
+            style = self._style[pos]
+            has_style = style >= 0 and str(style) in styles
+            value = self._shared_strings[sst] if sst >= 0 else self._values[pos]
+            if not (has_style or value or self._formulas.get(key, NO_FORMULA)[0]):
+                continue
+            out._keys.append(key)
+            out._sst.append(sst)
+            out._style.append(style if has_style else -1)
+            out._values.append(self._values[pos])
+            if key in self._formulas:
+                out._formulas[key] = self._formulas[key]
+        return out
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return f"SheetCells({len(self)} cells)"
+
+    def __getstate__(self):
+        # Ship only the shared strings this sheet uses, not the whole workbook table
+        state = self.__dict__.copy()
+        used = set(self._sst)
+        used.discard(-1)
+        state['_shared_strings'] = {i: self._shared_strings[i] for i in used}
+        return state
+
+
+def row_major_items(cells):
+    """
+    (coord, cell) pairs in row-major order. Parsed sheets (SheetCells) are already
+    stored that way; plain dicts are sorted by their decoded coordinates.
+    """
+    if isinstance(cells, SheetCells):
+        return cells.items()
+    return sorted(cells.items(), key=lambda item: coord_sort_key(item[0]))
+
+def json_default(obj):
+    """
+    json.dumps(..., default=json_default) support for parsed workbooks.
+    """
+    if isinstance(obj, SheetCells):
+        return obj.to_dict()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
@@ -0,0 +1,198 @@
+import hashlib
+import os
+import threading
+import time
+from utils.request_governor import classify_error, estimate_tokens
+from utils.response_cache import normalize_prompt
+
+# Explicit context caching of static prompt prefixes.
+#
+# Every grade_student_work call for an assignment starts with the same preamble (system
+# prompt, instructions, schema, rubric and, without a diff, the answer key); only the
+# student's data at the end differs. The preamble is uploaded once as a cached content
+# (client.caches) and each request then sends only its suffix with cached_content=name,
+# so the preamble is billed at the cached rate and isn't re-processed per student.
+#
+# A cache is created on first use of a prefix, reused while it lives, refreshed (its TTL
+# extended) when a request arrives close to expiry, and forgotten once expired. Prefixes
+# below the model's minimum cacheable size are sent inline, as is everything for a model
+# that refused to create a cache.
+#
+# Settings (environment):
+#   GRADER_CONTEXT_CACHE=0                 always send whole prompts
+#   GRADER_CONTEXT_CACHE_TTL=seconds       lifetime of a cached prefix (default 3600)
+#   GRADER_CONTEXT_CACHE_MIN_TOKENS=n      smallest prefix worth caching (default 4096)
+
+DEFAULT_TTL = 3600
+DEFAULT_MIN_TOKENS = 4096
+
+
+class GenaiCacheBackend:
+    """Cached contents on the Gemini API (client.caches of a genai.Client)."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model, contents, ttl, display_name=None):
+        from google.genai import types
+        config = types.CreateCachedContentConfig(contents=[contents], ttl=f"{int(ttl)}s", display_name=display_name)
+        return self.client.caches.create(model=model, config=config).name
+
+    def refresh(self, name, ttl):
+        from google.genai import types
+        self.client.caches.update(name=name, config=types.UpdateCachedContentConfig(ttl=f"{int(ttl)}s"))
+
+    def delete(self, name):
+        self.client.caches.delete(name=name)
+
+
+class LocalCacheBackend:
+    """
+    In-memory stand-in for client.caches (tests, offline runs). resolve(name) gives the
+    cached text back, or raises KeyError like the API does for an expired cache.
+    """
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.caches = {}
+        self.created = 0
+
+    def create(self, model, contents, ttl, display_name=None):
+        self.created += 1
+        name = f"cachedContents/local-{self.created}"
+        self.caches[name] = {"model": model, "contents": contents, "expires": self.clock() + ttl}
+        return name
+
+    def refresh(self, name, ttl):
+        self.resolve(name)
+        self.caches[name]["expires"] = self.clock() + ttl
+
+    def delete(self, name):
+        self.caches.pop(name, None)
+
+    def resolve(self, name):
+        entry = self.caches.get(name)
+        if entry is None or entry["expires"] <= self.clock():
+            self.caches.pop(name, None)
+            raise KeyError(f"{name} not found")
+        return entry["contents"]
+
+
+class ContextCacheManager:
+    """
+    Maps (model, prefix) to a live cached content on the backend (by default the caches
+    of the current utils.llm_backend). A request that arrives within refresh_margin
+    seconds of expiry extends the TTL instead of creating a new one.
+    Safe to share between threads; concurrent requests for the same prefix create it once.
+    """
+
+    def __init__(self, backend=None, ttl=DEFAULT_TTL, min_tokens=DEFAULT_MIN_TOKENS, refresh_margin=None,
+                 enabled=True, clock=time.time):
+        self.backend = backend
+        self.ttl = ttl
+        self.min_tokens = min_tokens
+        self.refresh_margin = ttl / 4 if refresh_margin is None else refresh_margin
+        self.enabled = enabled
+        self.clock = clock
+        self.entries = {}       # key -> {"name", "expires", "tokens"}
+        self.unsupported = set()
+        self.counts = {"created": 0, "reused": 0, "refreshed": 0, "expired": 0, "fallbacks": 0, "cached_tokens": 0}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def _backend(self):
+        if self.backend is not None:
+            return self.backend
+        from utils.llm_backend import get_backend
+        return get_backend().caches
+
+    def key(self, model, prefix):
+        raw = f"{model}\0{normalize_prompt(prefix)}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def lookup(self, model, prefix):
+        """
+        Name of a live cached content holding prefix for model (created or refreshed as
+        needed), or None when the prompt should be sent whole.
+        """
+        if not (self.enabled and prefix) or model in self.unsupported:
+            return None
+        backend = self._backend()
+        if backend is None:
+            return None
+        tokens = estimate_tokens(prefix)
+        if tokens < self.min_tokens:
+            return None
+        key = self.key(model, prefix)
+        with self._key_lock(key):
+            now = self.clock()
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires"] <= now:
+                del self.entries[key]
+                self._count("expired")
+                entry = None
+            if entry is not None and entry["expires"] - now < self.refresh_margin:
+                try:
+                    backend.refresh(entry["name"], self.ttl)
+                    entry["expires"] = now + self.ttl
+                    self._count("refreshed")
+                except Exception:
+                    del self.entries[key]
+                    entry = None
+            elif entry is not None:
+                self._count("reused")
+            if entry is None:
+                try:
+                    name = backend.create(model, prefix, self.ttl, display_name=f"grader-{key[:16]}")
+                except Exception as e:
+                    if classify_error(e) == "client":
+                        self.unsupported.add(model)   # e.g. the model doesn't support caching
+                    self._count("fallbacks")
+                    return None
+                entry = self.entries[key] = {"name": name, "expires": now + self.ttl, "tokens": tokens}
+                self._count("created")
+            self._count("cached_tokens", tokens)
+            return entry["name"]
+
+    def invalidate(self, model, prefix):
+        """Forgets the cache of a prefix (the server no longer has it)."""
+        with self._lock:
+            self.entries.pop(self.key(model, prefix), None)
+            self.counts["fallbacks"] += 1
+
+    def clear(self):
+        """Deletes every cache this manager created."""
+        with self._lock:
+            entries, self.entries = list(self.entries.values()), {}
+        backend = self._backend()
+        for entry in entries:
+            try:
+                backend.delete(entry["name"])
+            except Exception:
+                pass # It expires on its own anyway
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, live=len(self.entries))
+
+
+_default_manager = None
+
+def get_context_cache():
+    """The process-wide manager, configured from the environment on first use."""
+    global _default_manager
+    if _default_manager is None:
+        _default_manager = ContextCacheManager(
+            ttl=float(os.environ.get('GRADER_CONTEXT_CACHE_TTL', DEFAULT_TTL)),
+            min_tokens=int(os.environ.get('GRADER_CONTEXT_CACHE_MIN_TOKENS', DEFAULT_MIN_TOKENS)),
+            enabled=os.environ.get('GRADER_CONTEXT_CACHE', '1') != '0'
+        )
+    return _default_manager
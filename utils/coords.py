@@ -0,0 +1,43 @@
+import re
+from functools import lru_cache
+
+# "B12", "$B$12", "xfd1048576"
+COORD_RE = re.compile(r"\$?([A-Za-z]{1,3})\$?(\d+)")
+
+MAX_COL = 16384
+
+@lru_cache(maxsize=None)
+def column_index(letters):
+    """'A' -> 1, 'Z' -> 26, 'AA' -> 27"""
+    col = 0
+    for ch in letters.upper():
+        col = col * 26 + ord(ch) - 64
+    return col
+
+@lru_cache(maxsize=MAX_COL)
+def column_letters(col):
+    """1 -> 'A', 27 -> 'AA'"""
+    letters = ""
+    while col > 0:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+@lru_cache(maxsize=65536)
+def parse_coord(coord):
+    """
+    "B12" -> (12, 2). Absolute markers ($) are ignored.
+    Returns None for anything that isn't a single A1 reference.
+    """
+    m = COORD_RE.fullmatch(coord)
+    if not m:
+        return None
+    return int(m.group(2)), column_index(m.group(1))
+
+def to_coord(row, col):
+    """(12, 2) -> "B12" """
+    return f"{column_letters(col)}{row}"
+
+def coord_sort_key(coord):
+    """Row-major sort key; invalid references sort first."""
+    return parse_coord(coord) or (0, 0)
@@ -0,0 +1,235 @@
+import json
+from bisect import bisect_left
+from utils.cell_store import json_default
+from utils.coords import parse_coord, to_coord
+
+# Metadata sections compared item by item (see parse_sheet_full)
+LIST_SECTIONS = ("validations", "conditional_formatting", "drawings", "sparklines", "merge_cells")
+
+# Cell fields left out of the delta when they hold their default
+CELL_DEFAULTS = {"formula": None, "formula_type": "normal", "formula_ref": ""}
+
+
+def compute_workbook_delta(template_data, student_data):
+    """
+    Reduces a parsed submission (parse_workbook_to_json output) to what differs from
+    the parsed blank template it was started from:
+    {
+       "delta_against_template": true,
+       "sheets": {
+           "Sheet1": {
+               "added":   { "B4": cell, ... },
+               "changed": { "B5": { value + changed fields, "template": {what the template had} } },
+               "removed": { "B6": template cell },
+               "context": { "A4": "Revenue", "B1": "2023" },  # row/column labels of the cells above
+               "metadata": { "drawings": {"added": [...], "removed": [...]}, ... }
+           }
+       },
+       "added_sheets": { name: full sheet entry },
+       "removed_sheets": [ name, ... ],
+       "unchanged_sheets": [ name, ... ],
+       "workbook_metadata": { ... }
+    }
+    """
+    template_sheets = template_data.get("sheets", {})
+    student_sheets = student_data.get("sheets", {})
+
+    delta = {
+        "delta_against_template": True,
+        "sheets": {},
+        "added_sheets": {},
+        "removed_sheets": [],
+        "unchanged_sheets": [],
+        "workbook_metadata": _metadata_delta(template_data.get("workbook_metadata", {}),
+                                             student_data.get("workbook_metadata", {}))
+    }
+    skipped = student_data.get("workbook_metadata", {}).get("skipped_sheets", {})
+    if skipped:
+        delta["workbook_metadata"]["skipped_sheets"] = skipped
+
+    for name, entry in student_sheets.items():
+        if name not in template_sheets:
+            delta["added_sheets"][name] = entry
+            continue
+        sheet_delta = compute_sheet_delta(template_sheets[name], entry)
+        if sheet_delta:
+            delta["sheets"][name] = sheet_delta
+        else:
+            delta["unchanged_sheets"].append(name)
+
+    for name in template_sheets:
+        if name not in student_sheets and name not in skipped:
+            delta["removed_sheets"].append(name)
+
+    return delta
+
+def compute_sheet_delta(template_entry, student_entry):
+    """
+    Cell and metadata delta for one sheet entry ({"cells", "metadata"}).
+    Cells are slimmed down to their non-default fields.
+    Returns None if the sheets are identical.
+    """
+    template_cells = template_entry.get("cells", {})
+    student_cells = student_entry.get("cells", {})
+
+    added, changed, removed = {}, {}, {}
+    for coord, cell in student_cells.items():
+        if coord not in template_cells:
+            added[coord] = _slim(cell)
+            continue
+        before = template_cells[coord]
+        if before != cell:
+            fields = [k for k in CELL_KEYS if before.get(k) != cell.get(k)]
+            entry = {"value": cell.get("value")}
+            entry.update((k, cell.get(k)) for k in fields)
+            entry["template"] = {k: before.get(k) for k in fields}
+            changed[coord] = entry
+    for coord, cell in template_cells.items():
+        if coord not in student_cells:
+            removed[coord] = _slim(cell)
+
+    metadata = _metadata_delta(template_entry.get("metadata", {}), student_entry.get("metadata", {}))
+
+    if not (added or changed or removed or metadata):
+        return None
+
+    sheet_delta = {}
+    if added:
+        sheet_delta["added"] = added
+    if changed:
+        sheet_delta["changed"] = changed
+    if removed:
+        sheet_delta["removed"] = removed
+    context = anchor_context(student_cells, list(added) + list(changed))
+    if context:
+        sheet_delta["context"] = context
+    if metadata:
+        sheet_delta["metadata"] = metadata
+    return sheet_delta
+
+def anchor_context(cells, coords):
+    """
+    For each coord, the nearest text label to its left (row header) and above it
+    (column header), so the model can tell what a changed cell means.
+    Returns { label coord: label text } for labels not already in coords.
+    """
+    row_labels, col_labels = {}, {}
+    for coord, cell in cells.items():
+        if cell.get("formula") or not _is_label(cell.get("value")):
+            continue
+        pos = parse_coord(coord)
+        if pos:
+            row_labels.setdefault(pos[0], []).append(pos[1])
+            col_labels.setdefault(pos[1], []).append(pos[0])
+    # Cells come row-major, so row_labels lists are sorted already
+    for rows in col_labels.values():
+        rows.sort()
+
+    wanted = set(coords)
+    context = {}
+    for coord in coords:
+        pos = parse_coord(coord)
+        if not pos:
+            continue
+        row, col = pos
+        cols = row_labels.get(row, [])
+        i = bisect_left(cols, col)
+        if i:
+            context.setdefault(to_coord(row, cols[i - 1]), None)
+        rows = col_labels.get(col, [])
+        i = bisect_left(rows, row)
+        if i:
+            context.setdefault(to_coord(rows[i - 1], col), None)
+
+    return {c: cells[c].get("value") for c in sorted(context, key=parse_coord) if c not in wanted}
+
+CELL_KEYS = ("value", "formula", "formula_type", "formula_ref", "style")
+
+def _slim(cell):
+    return {k: v for k, v in cell.items() if k not in CELL_DEFAULTS or v not in (None, CELL_DEFAULTS[k])}
+
+def _is_label(value):
+    if not value or not isinstance(value, str):
+        return False
+    try:
+        float(value)
+        return False
+    except ValueError:
+        return True
+
+def _metadata_delta(template_meta, student_meta):
+    """
+    Added/removed items per list section; other keys are reported when they differ.
+    """
+    delta = {}
+    for key in set(template_meta) | set(student_meta):
+        if key == "skipped_sheets":
+            continue
+        before, after = template_meta.get(key), student_meta.get(key)
+        if key in LIST_SECTIONS and isinstance(before or [], list) and isinstance(after or [], list):
+            added, removed = _list_delta(before or [], after or [])
+            changed = _pair_objects(added, removed) if key == "drawings" else []
+            if added or removed or changed:
+                delta[key] = {}
+                if added:
+                    delta[key]["added"] = added
+                if changed:
+                    delta[key]["changed"] = changed
+                if removed:
+                    delta[key]["removed"] = removed
+        elif before != after:
+            delta[key] = {"template": before, "submission": after}
+    return delta
+
+def _list_delta(before, after):
+    """Multiset difference of two lists of JSON-like items."""
+    remaining = {}
+    for item in before:
+        remaining.setdefault(_canonical(item), []).append(item)
+    added = []
+    for item in after:
+        bucket = remaining.get(_canonical(item))
+        if bucket:
+            bucket.pop()
+        else:
+            added.append(item)
+    removed = [item for bucket in remaining.values() for item in bucket]
+    return added, removed
+
+def _pair_objects(added, removed):
+    """
+    Matches drawing objects present on both sides (same type and rId/name) and replaces
+    each pair by its field-level changes, so an edited chart is not sent twice.
+    Mutates added/removed; returns the list of changed objects.
+    """
+    changed = []
+    for item in list(added):
+        if not isinstance(item, dict):
+            continue
+        ident = (item.get("type"), item.get("rId"), item.get("name"))
+        match = next((old for old in removed if isinstance(old, dict)
+                      and (old.get("type"), old.get("rId"), old.get("name")) == ident), None)
+        if match is None:
+            continue
+        added.remove(item)
+        removed.remove(match)
+        entry = {k: item[k] for k in ("type", "rId", "name") if item.get(k) is not None}
+        entry["changes"] = _dict_changes(match, item)
+        changed.append(entry)
+    return changed
+
+def _dict_changes(before, after, prefix=""):
+    """
+    Flattened differences between two JSON-like values:
+    { "details.axes.123.max": {"template": "100", "submission": "120"} }
+    """
+    if isinstance(before, dict) and isinstance(after, dict):
+        changes = {}
+        for key in list(before) + [k for k in after if k not in before]:
+            if before.get(key) != after.get(key):
+                changes.update(_dict_changes(before.get(key), after.get(key), f"{prefix}{key}."))
+        return changes
+    return {prefix.rstrip('.'): {"template": before, "submission": after}}
+
+def _canonical(item):
+    return json.dumps(item, sort_keys=True, default=json_default)
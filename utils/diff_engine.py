@@ -0,0 +1,298 @@
+import json
+import re
+from utils.cell_store import json_default
+from utils.formula_engine import FormulaEngine, formulas_equivalent
+
+# Defaults for numeric comparison: |a - b| <= max(ABS_TOLERANCE, REL_TOLERANCE * max(|a|, |b|))
+ABS_TOLERANCE = 1e-6
+REL_TOLERANCE = 1e-9
+
+# Chart properties that carry grading requirements (axis scale, series ranges, titles...)
+CHART_FIELDS = ("types", "title", "title_formula", "legend_pos")
+AXIS_FIELDS = ("min", "max", "major_unit", "orientation")
+SERIES_FIELDS = ("values", "categories", "name", "type")
+
+_STRING_RE = re.compile(r'"(?:[^"]|"")*"')
+_FN_PREFIX_RE = re.compile(r"_xl(?:fn|ws)\.", re.IGNORECASE)
+
+
+def normalize_formula(formula):
+    """
+    Canonical form of a formula for comparison: no leading '=', no '$' anchors,
+    no _xlfn. prefixes, no whitespace and upper case -- except inside string literals.
+    """
+    if not formula:
+        return ""
+    formula = formula.strip().lstrip('=')
+    parts = []
+    last = 0
+    for m in _STRING_RE.finditer(formula):
+        parts.append(_normalize_code(formula[last:m.start()]))
+        parts.append(m.group(0))
+        last = m.end()
+    parts.append(_normalize_code(formula[last:]))
+    return "".join(parts)
+
+def _normalize_code(code):
+    code = _FN_PREFIX_RE.sub("", code)
+    return re.sub(r"\s+", "", code.replace('$', '')).upper()
+
+def _as_number(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    try:
+        return float(str(value).strip().replace(',', ''))
+    except (TypeError, ValueError):
+        return None
+
+def values_match(actual, expected, abs_tol=ABS_TOLERANCE, rel_tol=REL_TOLERANCE):
+    """
+    Numeric comparison with tolerance when both sides are numbers, otherwise a
+    trimmed, case-insensitive string comparison.
+    """
+    a, e = _as_number(actual), _as_number(expected)
+    if a is not None and e is not None:
+        return abs(a - e) <= max(abs_tol, rel_tol * max(abs(a), abs(e)))
+    return str(actual or "").strip().casefold() == str(expected or "").strip().casefold()
+
+def _issue(sheet, cell, expected, actual, explanation, kind):
+    return {
+        "sheet": sheet,
+        "cell": cell,
+        "expected": expected if isinstance(expected, str) else json.dumps(expected, default=json_default),
+        "actual": actual if isinstance(actual, str) else json.dumps(actual, default=json_default),
+        "explanation": explanation,
+        "kind": kind
+    }
+
+
+def diff_workbooks(student_data, key_data, abs_tol=ABS_TOLERANCE, rel_tol=REL_TOLERANCE, check_styles=True,
+                   recompute=True):
+    """
+    Deterministic comparison of two parse_workbook_to_json outputs (student vs answer key).
+    Sheets are aligned by name; every answer-key cell is checked for its value (with numeric
+    tolerance), formula (normalized) and style, and charts, data validations, conditional
+    formatting and sparklines are compared per sheet.
+    Returns the grade_workbook_comparison schema:
+    { "passed", "score" (percent of checks passed), "incorrect_cells": [
+        {"sheet", "cell", "expected", "actual", "explanation", "kind"} ], "comments",
+      "review": [ same items ], "equivalent": [ same items ] }
+    A different formula that yields the right result is recomputed against the answer
+    key's data with perturbed inputs (recompute=True): if it tracks the key's formula it
+    goes to "equivalent", if it diverges it becomes a "formula" issue. What the formula
+    engine can't settle stays in "review" for the model (or a human).
+    """
+    student_sheets = student_data.get("sheets", {})
+    key_sheets = key_data.get("sheets", {})
+    skipped = set(student_data.get("workbook_metadata", {}).get("skipped_sheets", {}))
+    by_folded = {name.strip().casefold(): name for name in student_sheets}
+
+    issues = []
+    review = []
+    checks = 0
+    missing_sheets = []
+    for name, key_entry in key_sheets.items():
+        student_name = name if name in student_sheets else by_folded.get(name.strip().casefold())
+        if student_name is None:
+            if name not in skipped:
+                missing_sheets.append(name)
+                issues.append(_issue(name, "", "Sheet present", "Sheet missing",
+                                     f"Sheet '{name}' from the answer key is missing.", "sheet"))
+                checks += 1
+            continue
+        sheet_checks, sheet_issues = diff_sheet(name, student_sheets[student_name], key_entry,
+                                                abs_tol, rel_tol, check_styles)
+        checks += sheet_checks
+        for issue in sheet_issues:
+            (review if issue["kind"] == "formula_review" else issues).append(issue)
+
+    equivalent = []
+    if recompute and review:
+        review, equivalent, diverging = _settle_review(review, key_data)
+        issues.extend(diverging)
+
+    extra_sheets = [n for n in student_sheets
+                    if n not in key_sheets and n.strip().casefold() not in {k.strip().casefold() for k in key_sheets}]
+
+    failed = len(issues)
+    score = round(100.0 * (checks - failed) / checks, 1) if checks else 100.0
+    comments = f"Compared {checks} answer-key checks locally; {failed} did not match."
+    if missing_sheets:
+        comments += f" Missing sheets: {', '.join(missing_sheets)}."
+    if extra_sheets:
+        comments += f" Extra sheets: {', '.join(extra_sheets)}."
+    if equivalent:
+        comments += f" {len(equivalent)} different formula(s) recompute like the answer key's."
+    if review:
+        comments += f" {len(review)} cell(s) reach the right result with a different formula."
+
+    return {
+        "passed": failed == 0,
+        "score": score,
+        "incorrect_cells": issues,
+        "comments": comments,
+        "review": review,
+        "equivalent": equivalent
+    }
+
+def _settle_review(review, key_data):
+    """
+    Splits formula_review items into (still to review, equivalent, diverging issues)
+    with the formula engine. A student formula that reads sheets or cells the answer key
+    doesn't have can't be recomputed on the key, so it stays to review.
+    """
+    engine = FormulaEngine(key_data)
+    remaining, equivalent, diverging = [], [], []
+    for item in review:
+        if engine.reads_missing(str(item["actual"]).lstrip("="), item["sheet"]):
+            remaining.append(item)
+            continue
+        verdict = formulas_equivalent(engine, item["sheet"], item["actual"], item["expected"])
+        if verdict is None:
+            remaining.append(item)
+        elif verdict:
+            equivalent.append(item)
+        else:
+            diverging.append(dict(item, kind="formula",
+                                  explanation="The formula matches the answer key's result only for the current "
+                                              "inputs; it computes something different."))
+    return remaining, equivalent, diverging
+
+def diff_sheet(sheet, student_entry, key_entry, abs_tol=ABS_TOLERANCE, rel_tol=REL_TOLERANCE, check_styles=True):
+    """
+    Compares one sheet entry ({"cells", "metadata"}). Returns (checks, issues);
+    issues of kind "formula_review" are equivalent-result formulas, not errors.
+    """
+    student_cells = student_entry.get("cells", {})
+    key_cells = key_entry.get("cells", {})
+    issues = []
+    checks = 0
+
+    for coord, key_cell in key_cells.items():
+        key_value = key_cell.get("value")
+        key_formula = key_cell.get("formula")
+        has_formula = bool(key_formula) or key_cell.get("formula_type") == "shared"
+        if not (key_value or has_formula or (check_styles and key_cell.get("style"))):
+            continue
+
+        student_cell = student_cells.get(coord) or {}
+        actual_value = student_cell.get("value")
+        actual_formula = student_cell.get("formula")
+
+        if key_value or has_formula:
+            checks += 1
+            if not values_match(actual_value, key_value, abs_tol, rel_tol):
+                issues.append(_issue(sheet, coord, key_value or "", actual_value or "",
+                                     "Value does not match the answer key." if student_cell else "Cell is empty.",
+                                     "value"))
+            elif has_formula and not (actual_formula or student_cell.get("formula_type") == "shared"):
+                issues.append(_issue(sheet, coord, f"={key_formula}" if key_formula else "a formula",
+                                     actual_value or "",
+                                     "The answer key computes this cell with a formula; the value was typed in.",
+                                     "formula"))
+            elif key_formula and actual_formula and normalize_formula(key_formula) != normalize_formula(actual_formula):
+                issues.append(_issue(sheet, coord, f"={key_formula}", f"={actual_formula}",
+                                     "Formula differs from the answer key (the result matches).", "formula_review"))
+
+        if check_styles and (key_cell.get("style") or student_cell.get("style")):
+            checks += 1
+            key_style = key_cell.get("style") or {}
+            actual_style = student_cell.get("style") or {}
+            if key_style != actual_style:
+                parts = sorted(k for k in set(key_style) | set(actual_style) if key_style.get(k) != actual_style.get(k))
+                issues.append(_issue(sheet, coord, {k: key_style.get(k) for k in parts},
+                                     {k: actual_style.get(k) for k in parts},
+                                     f"Formatting differs ({', '.join(parts)}).", "style"))
+
+    meta_checks, meta_issues = diff_metadata(sheet, student_entry.get("metadata", {}), key_entry.get("metadata", {}))
+    return checks + meta_checks, issues + meta_issues
+
+def diff_metadata(sheet, student_meta, key_meta):
+    """
+    Compares charts (type, title, axes, series ranges, legend), data validations,
+    conditional formatting and sparklines. Returns (checks, issues).
+    """
+    issues = []
+    checks = 0
+
+    key_charts = chart_details(key_meta)
+    student_charts = chart_details(student_meta)
+    for i, key_chart in enumerate(key_charts):
+        checks += 1
+        label = f"Chart {i + 1}"
+        if i >= len(student_charts):
+            issues.append(_issue(sheet, label, "Chart present", "Chart missing",
+                                 f"The answer key has {len(key_charts)} chart(s) on this sheet; found {len(student_charts)}.",
+                                 "chart"))
+            continue
+        differences = _chart_differences(student_charts[i], key_chart)
+        if differences:
+            issues.append(_issue(sheet, label, {k: e for k, (e, _) in differences.items()},
+                                 {k: a for k, (_, a) in differences.items()},
+                                 f"Chart differs from the answer key: {', '.join(differences)}.", "chart"))
+
+    for section, fields, label in (("validations", ("type", "sqref", "formula1", "formula2"), "Data validation"),
+                                   ("conditional_formatting", ("sqref", "type", "formula"), "Conditional formatting"),
+                                   ("sparklines", None, "Sparklines")):
+        key_items = [_project(item, fields) for item in key_meta.get(section, [])]
+        student_items = [_project(item, fields) for item in student_meta.get(section, [])]
+        for item in key_items:
+            checks += 1
+            if item in student_items:
+                student_items.remove(item)
+            else:
+                where = item.get("sqref") if isinstance(item, dict) and item.get("sqref") else label
+                issues.append(_issue(sheet, where, item, "missing",
+                                     f"{label} from the answer key was not found.", section))
+
+    return checks, issues
+
+def chart_details(meta):
+    """The parsed chart details of a sheet's metadata, in drawing order."""
+    return [obj.get("details", {}) for obj in meta.get("drawings", [])
+            if isinstance(obj, dict) and obj.get("type") == "chart"]
+
+def _project(item, fields):
+    if fields is None or not isinstance(item, dict):
+        return item
+    return {k: item.get(k) for k in fields}
+
+def _chart_differences(actual, expected):
+    """ { "axes[1].max": (expected, actual), ... } for the graded chart properties."""
+    differences = {}
+    for field in CHART_FIELDS:
+        e, a = expected.get(field), actual.get(field)
+        if field == "types":
+            # Plot order inside a combination chart doesn't matter
+            e, a = sorted(e or []), sorted(a or [])
+        if e != a:
+            differences[field] = (expected.get(field), actual.get(field))
+
+    # Axis ids are random per file; compare axes in document order
+    key_axes = list((expected.get("axes") or {}).values())
+    actual_axes = list((actual.get("axes") or {}).values())
+    for i, key_axis in enumerate(key_axes):
+        axis = actual_axes[i] if i < len(actual_axes) else {}
+        for field in AXIS_FIELDS:
+            if not values_match(axis.get(field), key_axis.get(field)):
+                differences[f"axes[{i + 1}].{field}"] = (key_axis.get(field), axis.get(field))
+
+    # Series are matched by their data range, not by position
+    key_series = expected.get("series") or []
+    actual_series = list(actual.get("series") or [])
+    if len(key_series) != len(actual_series):
+        differences["series count"] = (len(key_series), len(actual_series))
+    for i, key_ser in enumerate(key_series):
+        values = normalize_formula(key_ser.get("values"))
+        ser = next((s for s in actual_series if normalize_formula(s.get("values")) == values), None)
+        if ser is None:
+            differences[f"series[{i + 1}]"] = (key_ser.get("values"), None)
+            continue
+        actual_series.remove(ser)
+        for field in SERIES_FIELDS:
+            e, a = key_ser.get(field), ser.get(field)
+            if field in ("values", "categories"):
+                e, a = normalize_formula(e), normalize_formula(a)
+            if e != a:
+                differences[f"series[{i + 1}].{field}"] = (key_ser.get(field), ser.get(field))
+    return differences
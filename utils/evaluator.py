@@ -1,6 +1,23 @@
 from utils.llm_helper import grade_manual_review_batch
+from utils.coords import parse_coord
+from utils.diff_engine import chart_details, normalize_formula
+from utils.rubric_extractor import resolve_sheet
+from utils.prompt_encoding import compact_json, encode_cells, prune
+from utils.request_governor import estimate_tokens
+from concurrent.futures import ThreadPoolExecutor
 import re
-import json
+
+# Rubric wording -> parsed chart type (see parse_chart_xml); Excel's column charts are bar charts
+CHART_TYPES = {
+    "bar": "Bar", "column": "Bar", "line": "Line", "pie": "Pie", "area": "Area",
+    "scatter": "XY Scatter", "xy": "XY Scatter", "xy scatter": "XY Scatter", "x-y": "XY Scatter",
+    "bubble": "Bubble", "radar": "Radar", "stock": "Stock"
+}
+
+LEGEND_POSITIONS = {"top": "t", "bottom": "b", "left": "l", "right": "r", "top right": "tr", "none": ""}
+
+# Sparkline group types; Win/Loss sparklines are stored as "stacked"
+SPARKLINE_TYPES = {"line": "line", "column": "column", "win/loss": "stacked", "winloss": "stacked", "stacked": "stacked"}
 
 def check_value_match(cell_data, expected_value, tolerance=None):
     """
@@ -33,46 +50,178 @@ def check_formula_match(cell_data, expected_substring, is_regex=False):
     else:
         return expected_substring.lower() in actual_formula.lower()
 
-def evaluate_criteria(sheet_data, criteria):
+def _select_charts(sheet_metadata, chart=None):
+    """All charts of the sheet, or only the 1-based chart index given."""
+    charts = chart_details(sheet_metadata or {})
+    if chart:
+        return charts[int(chart) - 1:int(chart)]
+    return charts
+
+def check_chart_type(sheet_metadata, expected, chart=None):
+    """
+    Checks that a chart (any chart on the sheet unless an index is given) has the
+    expected type, e.g. "scatter", "column" or ["column", "line"] for a combination chart.
+    """
+    wanted = sorted(CHART_TYPES.get(str(t).strip().lower(), str(t)) for t in
+                    (expected if isinstance(expected, list) else [expected]))
+    for details in _select_charts(sheet_metadata, chart):
+        if sorted(details.get('types') or []) == wanted:
+            return True
+    return False
+
+def _axis(details, axis):
+    """
+    Picks an axis by name: "y" / "value" (primary value axis), "y2" / "secondary",
+    "x" / "category". Scatter charts have two value axes; the first one is X.
+    Numbers are 1-based positions in document order.
     """
-    Evaluates a single criteria object against the sheet data.
+    axes = list((details.get('axes') or {}).values())
+    if isinstance(axis, int) or str(axis).isdigit():
+        i = int(axis) - 1
+        return axes[i] if 0 <= i < len(axes) else None
+    value_axes = [a for a in axes if a.get('tag') == 'c:valAx']
+    category_axes = [a for a in axes if a.get('tag') != 'c:valAx']
+    if not category_axes and len(value_axes) > 1:
+        category_axes, value_axes = value_axes[:1], value_axes[1:]
+    axis = str(axis or 'y').strip().lower()
+    if axis in ('x', 'category', 'horizontal'):
+        pool, i = category_axes, 0
+    elif axis in ('y2', 'secondary', 'right'):
+        pool, i = value_axes, 1
+    else:
+        pool, i = value_axes, 0
+    return pool[i] if i < len(pool) else None
+
+def check_chart_axis(sheet_metadata, field, expected, axis='y', chart=None, tolerance=None):
+    """
+    Checks an axis scale setting (min, max, major_unit) of a chart. "auto" means unset.
+    """
+    for details in _select_charts(sheet_metadata, chart):
+        found = _axis(details, axis)
+        if found is None:
+            continue
+        actual = found.get(field, 'auto')
+        if str(expected).lower() == 'auto':
+            if actual == 'auto':
+                return True
+        elif actual != 'auto' and check_value_match({'value': actual}, expected, tolerance if tolerance is not None else 1e-9):
+            return True
+    return False
+
+def check_legend_position(sheet_metadata, expected, chart=None):
+    """Checks a chart's legend position ("top", "bottom", "b", "none"...)."""
+    wanted = LEGEND_POSITIONS.get(str(expected).strip().lower(), str(expected).strip().lower())
+    return any(details.get('legend_pos', '') == wanted for details in _select_charts(sheet_metadata, chart))
+
+def check_sparkline(sheet_metadata, expected_type=None, location=None):
+    """Checks for a sparkline of a type ("line", "column", "win/loss"), optionally at a cell."""
+    wanted = SPARKLINE_TYPES.get(str(expected_type).strip().lower()) if expected_type else None
+    for group in (sheet_metadata or {}).get('sparklines', []):
+        if wanted and group.get('type', 'line') != wanted:
+            continue
+        for sparkline in group.get('sparklines', []):
+            if not location or _in_sqref(location, sparkline.get('location') or ''):
+                return True
+    return False
+
+def check_data_validation(sheet_metadata, cell=None, expected_type=None, formula=None):
+    """Checks for a data validation covering cell, with a given type and/or source formula."""
+    for dv in (sheet_metadata or {}).get('validations', []):
+        if cell and not _in_sqref(cell, dv.get('sqref') or ''):
+            continue
+        if expected_type and (dv.get('type') or '').lower() != str(expected_type).lower():
+            continue
+        if formula and normalize_formula(dv.get('formula1')) != normalize_formula(formula):
+            continue
+        return True
+    return False
+
+def _in_sqref(cell, sqref):
+    """True if cell ("C5") lies in a space-separated list of ranges ("A1 C2:C9")."""
+    pos = parse_coord(cell.replace('$', '').split('!')[-1])
+    if pos is None:
+        return False
+    for part in sqref.replace('$', '').split():
+        first, _, last = part.partition(':')
+        start, end = parse_coord(first), parse_coord(last or first)
+        if start and end and start[0] <= pos[0] <= end[0] and start[1] <= pos[1] <= end[1]:
+            return True
+    return False
+
+# Criteria types checked against the sheet metadata rather than a cell
+METADATA_CHECKS = {
+    'chart_type': lambda meta, c: check_chart_type(meta, c.get('expected'), c.get('chart')),
+    'chart_axis': lambda meta, c: check_chart_axis(meta, c.get('field', 'max'), c.get('expected'), c.get('axis', 'y'),
+                                                   c.get('chart'), c.get('tolerance')),
+    'legend_position': lambda meta, c: check_legend_position(meta, c.get('expected'), c.get('chart')),
+    'sparkline': lambda meta, c: check_sparkline(meta, c.get('expected'), c.get('cell')),
+    'data_validation': lambda meta, c: check_data_validation(meta, c.get('cell'), c.get('expected'), c.get('formula')),
+}
+
+LOCAL_CRITERIA_TYPES = {'value_match', 'formula_match', 'exists'} | set(METADATA_CHECKS)
+
+def evaluate_criteria(sheet_data, criteria, sheet_metadata=None):
+    """
+    Evaluates a single criteria object against the sheet data (and metadata, for
+    chart/sparkline/validation criteria).
     Returns (points_earned, feedback_list)
     """
     cell_ref = criteria.get('cell')
     ctype = criteria.get('type')
     points = criteria.get('points', 0)
-    
+
     # Bypass cell check for manual review or other types that don't need a specific cell
     if ctype == 'manual_review':
         # This is now handled in batch by the task evaluator, but if called individually,
         # we return 0/Pending if logic not here.
         # Ideally, we shouldn't call this individually for manual_review if we want batching.
         return 0, ["Processed in batch"]
-        
-    if cell_ref not in sheet_data:
-        return 0, [f"Cell {cell_ref} not found or empty."]
-        
-    cell = sheet_data.get(cell_ref, {})
+
     passed = False
-    
-    if ctype == 'value_match':
-        passed = check_value_match(cell, criteria.get('expected'), criteria.get('tolerance'))
-    elif ctype == 'formula_match':
-        passed = check_formula_match(cell, criteria.get('expected'), criteria.get('regex', False))
-    elif ctype == 'exists':
-        passed = True # Cell exists check passed effectively by 'if cell_ref not in sheet_data' above
-    else:
+
+    if ctype in METADATA_CHECKS:
+        passed = METADATA_CHECKS[ctype](sheet_metadata, criteria)
+    elif ctype not in LOCAL_CRITERIA_TYPES:
         return 0, [f"Unknown criteria type: {ctype}"]
-        
+    elif cell_ref not in sheet_data:
+        return 0, [f"Cell {cell_ref} not found or empty."]
+    else:
+        cell = sheet_data.get(cell_ref, {})
+        if ctype == 'value_match':
+            passed = check_value_match(cell, criteria.get('expected'), criteria.get('tolerance'))
+        elif ctype == 'formula_match':
+            passed = check_formula_match(cell, criteria.get('expected'), criteria.get('regex', False))
+        elif ctype == 'exists':
+            passed = True # Cell exists check passed effectively by 'if cell_ref not in sheet_data' above
+
     if passed:
         return points, []
     else:
-        feedback = criteria.get('feedback_on_fail', f"Check {ctype} in {cell_ref} failed.")
+        where = f" in {cell_ref}" if cell_ref else ""
+        feedback = criteria.get('feedback_on_fail', f"Check {ctype}{where} failed.")
         return 0, [feedback]
 
-def evaluate_task(task, sheet_data, sheet_metadata=None):
+def render_sheet_text(sheet_data, sheet_metadata=None):
+    """
+    Text form of a sheet for manual review: the non-empty cells one row per line in the
+    compact prompt encoding (styles left out), then the metadata.
+    """
+    full_text = "\n".join(encode_cells(sheet_data))
+
+    # Add metadata context if provided
+    metadata = prune(sheet_metadata or {})
+    if metadata:
+         full_text += "\n\n[METADATA START]\n"
+         full_text += compact_json(metadata)
+         full_text += "\n[METADATA END]\n"
+    return full_text
+
+def evaluate_task(task, sheet_data, sheet_metadata=None, manual_results=None):
     """
     Evaluates a full task (list of criteria).
+    manual_results: verdicts for the task's manual_review criteria, keyed by _id or
+    description, when they were already graded (see evaluate_workbook); otherwise the
+    task's manual criteria are sent to the model in one batch.
     """
     task_name = task.get('name', 'Unknown Task')
     max_points = task.get('points', 0)
@@ -88,7 +237,7 @@ def evaluate_task(task, sheet_data, sheet_metadata=None):
     
     # 1. Process Automated
     for crit in automated_criteria:
-        p, fb = evaluate_criteria(sheet_data, crit)
+        p, fb = evaluate_criteria(sheet_data, crit, sheet_metadata)
         earned_points += p
         all_feedback.extend(fb)
         
@@ -106,42 +255,16 @@ def evaluate_task(task, sheet_data, sheet_metadata=None):
         
     # 2. Process Manual (Batch)
     if manual_criteria:
-        # Convert sheet data to text representation
-        # We'll dump non-empty cells relevant for context
-        # Sorting helps LLM read it like a grid
-        def parse_coord(coord):
-            match = re.match(r"([A-Z]+)(\d+)", coord)
-            if match:
-                return match.group(1), int(match.group(2))
-            return "A", 0
-            
-        sorted_cells = sorted(sheet_data.items(), key=lambda x: parse_coord(x[0])[1])
-        sheet_text = []
-        for coord, meta in sorted_cells:
-            val = meta.get('value', '')
-            formula = meta.get('formula')
-            if val or formula:
-                content = f"{coord}: {val}"
-                if formula:
-                    content += f" (Formula: {formula})"
-                sheet_text.append(content)
-        
-        full_text = "\n".join(sheet_text)
-        
-        # Add metadata context if provided
-        if sheet_metadata:
-             full_text += "\n\n[METADATA START]\n"
-             full_text += json.dumps(sheet_metadata, indent=2)
-             full_text += "\n[METADATA END]\n"
-        
-        # Call LLM
-        llm_results = grade_manual_review_batch(full_text, manual_criteria)
-        
+        if manual_results is None:
+            # Call LLM
+            manual_results = grade_manual_review_batch(render_sheet_text(sheet_data, sheet_metadata), manual_criteria)
+
         for crit in manual_criteria:
             desc = crit.get('description')
             points = crit.get('points', 0)
             
-            res = llm_results.get(desc, {"passed": False, "feedback": "LLM Verification Failed"})
+            res = manual_results.get(str(crit.get('_id'))) or manual_results.get(desc) or \
+                {"passed": False, "feedback": "LLM Verification Failed"}
             
             p_earned = 0
             if res.get('passed'):
@@ -173,3 +296,83 @@ def evaluate_task(task, sheet_data, sheet_metadata=None):
         "feedback": "; ".join(all_feedback) if all_feedback else "Correct",
         "criteria_results": criteria_results
     }
+
+# Token budget of one cross-task manual review call (sheet text + criteria)
+MANUAL_BATCH_TOKENS = 24000
+MANUAL_BATCH_WORKERS = 4
+def plan_manual_batches(groups, max_tokens=MANUAL_BATCH_TOKENS):
+    """
+    Packs per-sheet groups [(sheet, sheet_text, criteria)] into as few batches as the
+    token budget allows (first fit, largest first). A group over the budget on its own
+    still gets a batch, since a sheet is never split.
+    Returns a list of batches, each a list of groups.
+    """
+    sized = sorted(((estimate_tokens(text) + estimate_tokens(compact_json(criteria)), sheet, text, criteria)
+                    for sheet, text, criteria in groups), key=lambda g: -g[0])
+    batches = []  # [tokens, [groups]]
+    for tokens, sheet, text, criteria in sized:
+        target = next((b for b in batches if b[0] + tokens <= max_tokens), None)
+        if target is None:
+            batches.append([tokens, [(sheet, text, criteria)]])
+        else:
+            target[0] += tokens
+            target[1].append((sheet, text, criteria))
+    return [groups for _, groups in batches]
+
+def _grade_batch(batch):
+    """One model call for a batch of sheet groups; verdicts keyed by criterion _id."""
+    content = "\n\n".join(f"=== SHEET: {sheet} ===\n{text}" for sheet, text, _ in batch)
+    criteria = [crit for _, _, group in batch for crit in group]
+    return grade_manual_review_batch(content, criteria, key='_id')
+
+def evaluate_workbook(rubric, workbook_data, max_batch_tokens=MANUAL_BATCH_TOKENS, max_workers=MANUAL_BATCH_WORKERS):
+    """
+    Evaluates every task of a rubric ({"tasks": [...]}) against a parsed workbook
+    (parse_workbook_to_json output).
+    Each referenced sheet is rendered once, and the manual_review criteria of all tasks
+    are graded together: one model call, or a few token-budgeted ones run concurrently.
+    The verdicts are then fanned back out to each task's criteria_results.
+    Returns {"tasks": [evaluate_task results], "points_earned", "max_points", "batches"}
+    """
+    tasks = rubric.get('tasks', []) if isinstance(rubric, dict) else []
+    sheets = workbook_data.get('sheets', {})
+    sheet_names = list(sheets)
+
+    planned = []
+    manual = {}  # sheet -> manual_review criteria of every task on it
+    for i, task in enumerate(tasks):
+        sheet = resolve_sheet(task, sheet_names)
+        task = dict(task, criteria=[dict(c) for c in task.get('criteria', [])])
+        for j, crit in enumerate(task['criteria']):
+            crit.setdefault('_id', f"T{i + 1}_crit_{j + 1}")
+            if crit.get('type') == 'manual_review':
+                manual.setdefault(sheet, []).append(dict(crit, sheet=sheet or "(not identified)"))
+        planned.append((task, sheet))
+
+    groups = []
+    for sheet, criteria in manual.items():
+        entry = sheets.get(sheet, {})
+        text = render_sheet_text(entry.get('cells', {}), entry.get('metadata')) if entry else \
+            "(No sheet of the workbook could be matched to these criteria.)"
+        groups.append((sheet or "(not identified)", text, criteria))
+
+    batches = plan_manual_batches(groups, max_batch_tokens)
+    verdicts = {}
+    if len(batches) == 1:
+        verdicts.update(_grade_batch(batches[0]))
+    elif batches:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(batches))) as pool:
+            for result in pool.map(_grade_batch, batches):
+                verdicts.update(result)
+
+    results = []
+    for task, sheet in planned:
+        entry = sheets.get(sheet, {})
+        results.append(evaluate_task(task, entry.get('cells', {}), entry.get('metadata'), manual_results=verdicts))
+
+    return {
+        "tasks": results,
+        "points_earned": round(sum(r['points_earned'] for r in results), 2),
+        "max_points": sum(r['max_points'] for r in results),
+        "batches": len(batches)
+    }
@@ -0,0 +1,1268 @@
+import math
+import random
+import re
+from collections import deque
+from functools import lru_cache
+from utils.coords import column_index, parse_coord, to_coord
+
+# Formula engine for the functions these assignments use (SUM, AVERAGE, IF, VLOOKUP,
+# INDEX/MATCH, COUNTIF, ROUND, ...), so a student's formula can be recomputed and
+# compared without asking the model.
+#
+# ASTs are tuples, parsed once per distinct formula text (parse_formula is LRU-cached):
+#   ("num", 1.5) ("str", "x") ("bool", True) ("err", "#N/A") ("name", "TaxRate")
+#   ("ref", sheet or None, (row, col, row_abs, col_abs))
+#   ("range", sheet or None, (row, col, row_abs, col_abs), (row, col, row_abs, col_abs))
+#       -- row or col is None for whole-column / whole-row ranges
+#   ("fn", "SUM", (args...)) ("neg", x) ("pct", x) ("op", "+", a, b)
+
+MAX_OPEN_RANGE_ROWS = 1048576
+MAX_OPEN_RANGE_COLS = 16384
+
+
+class FormulaSyntaxError(ValueError):
+    pass
+
+class UnsupportedFormula(Exception):
+    """The formula uses a function or construct the engine doesn't implement."""
+
+class ExcelError(Exception):
+    """
+    An Excel error value (#N/A, #DIV/0!, ...). Raised while evaluating so it propagates
+    like in Excel, and returned (not raised) as the value of the cell.
+    """
+    def __init__(self, code):
+        super().__init__(code)
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, ExcelError) and other.code == self.code
+
+    def __hash__(self):
+        return hash(self.code)
+
+    def __repr__(self):
+        return self.code
+
+ERROR_CODES = ("#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A")
+
+
+# --- Tokenizer / parser ---
+
+_CELL = r"\$?[A-Za-z]{1,3}\$?\d+"
+_SHEET = r"(?:'(?:[^']|'')+'|[A-Za-z_][\w.]*)!"
+_TOKEN_RE = re.compile(rf"""
+    (?P<ws>\s+)
+  | (?P<str>"(?:[^"]|"")*")
+  | (?P<err>\#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A))
+  | (?P<func>(?:_xl(?:fn|ws)\.)?[A-Za-z_][\w.]*(?=\())
+  | (?P<ref>(?:{_SHEET})?(?:{_CELL}(?::{_CELL})?|\$?[A-Za-z]{{1,3}}:\$?[A-Za-z]{{1,3}}|\$?\d+:\$?\d+)(?![\w.(!]))
+  | (?P<num>(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<name>[A-Za-z_\\][\w.]*)
+  | (?P<op><>|<=|>=|[-+*/^&=<>%])
+  | (?P<lp>\()
+  | (?P<rp>\))
+  | (?P<sep>[,;])
+""", re.VERBOSE)
+
+_COMPARISONS = ("=", "<>", "<", ">", "<=", ">=")
+_BINARY_PRECEDENCE = {"=": 1, "<>": 1, "<": 1, ">": 1, "<=": 1, ">=": 1, "&": 2, "+": 3, "-": 3, "*": 4, "/": 4, "^": 5}
+
+_PART_RE = re.compile(r"(\$?)([A-Za-z]{1,3})?(\$?)(\d+)?")
+
+
+def _tokenize(text):
+    tokens = []
+    pos = 0
+    while pos < len(text):
+        m = _TOKEN_RE.match(text, pos)
+        if not m:
+            raise FormulaSyntaxError(f"Unexpected {text[pos:pos + 10]!r} in formula")
+        pos = m.end()
+        if m.lastgroup != "ws":
+            tokens.append((m.lastgroup, m.group()))
+    return tokens
+
+def _split_sheet(ref):
+    if "!" not in ref:
+        return None, ref
+    sheet, ref = ref.rsplit("!", 1)
+    if sheet.startswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    return sheet, ref
+
+def _ref_part(part):
+    """"$B$3" -> (3, 2, True, True); "B" -> (None, 2, False, False); "3" -> (3, None, False, False)"""
+    m = _PART_RE.fullmatch(part)
+    col_abs, letters, row_abs, digits = m.groups()
+    if letters is None:
+        # A whole-row part like "$3": the only '$' was captured as the column marker
+        row_abs, col_abs = col_abs, ""
+    return (int(digits) if digits else None,
+            column_index(letters) if letters else None,
+            bool(row_abs), bool(col_abs))
+
+def _ref_node(token):
+    sheet, ref = _split_sheet(token)
+    if ":" not in ref:
+        return ("ref", sheet, _ref_part(ref))
+    first, last = ref.split(":")
+    return ("range", sheet, _ref_part(first), _ref_part(last))
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, kind=None):
+        tok = self.peek()
+        if tok[0] is None or (kind and tok[0] != kind):
+            raise FormulaSyntaxError(f"Expected {kind or 'a token'}, got {tok[1]!r}")
+        self.pos += 1
+        return tok
+
+    def parse(self):
+        node = self.expression(0)
+        if self.peek()[0] is not None:
+            raise FormulaSyntaxError(f"Unexpected {self.peek()[1]!r}")
+        return node
+
+    def expression(self, min_prec):
+        left = self.unary()
+        while True:
+            kind, value = self.peek()
+            prec = _BINARY_PRECEDENCE.get(value) if kind == "op" else None
+            if prec is None or prec < min_prec:
+                return left
+            self.pos += 1
+            # All Excel binary operators are left-associative (2^3^2 = 64)
+            left = ("op", value, left, self.expression(prec + 1))
+
+    def unary(self):
+        kind, value = self.peek()
+        if kind == "op" and value in "+-":
+            self.pos += 1
+            operand = self.unary()
+            return ("neg", operand) if value == "-" else operand
+        node = self.primary()
+        while self.peek() == ("op", "%"):
+            self.pos += 1
+            node = ("pct", node)
+        return node
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == "num":
+            return ("num", float(value))
+        if kind == "str":
+            return ("str", value[1:-1].replace('""', '"'))
+        if kind == "err":
+            return ("err", value.upper())
+        if kind == "ref":
+            return _ref_node(value)
+        if kind == "name":
+            upper = value.upper()
+            if upper in ("TRUE", "FALSE"):
+                return ("bool", upper == "TRUE")
+            return ("name", value)
+        if kind == "func":
+            name = re.sub(r"^_XL(?:FN|WS)\.", "", value.upper())
+            self.take("lp")
+            args = []
+            if self.peek()[0] != "rp":
+                while True:
+                    if self.peek()[0] in ("sep", "rp"):
+                        args.append(("blank",))  # omitted argument, e.g. VLOOKUP(a,b,2,)
+                    else:
+                        args.append(self.expression(0))
+                    if self.peek()[0] == "sep":
+                        self.pos += 1
+                        continue
+                    break
+            self.take("rp")
+            return ("fn", name, tuple(args))
+        if kind == "lp":
+            node = self.expression(0)
+            self.take("rp")
+            return node
+        raise FormulaSyntaxError(f"Unexpected {value!r}")
+
+
+@lru_cache(maxsize=8192)
+def parse_formula(text):
+    """
+    Parses formula text (with or without the leading '=') into an AST.
+    Raises FormulaSyntaxError for anything outside the supported grammar.
+    """
+    text = text.strip()
+    if text.startswith("="):
+        text = text[1:]
+    return _Parser(_tokenize(text)).parse()
+
+def shift_formula(node, drow, dcol):
+    """
+    Moves the relative parts of every reference in an AST by (drow, dcol),
+    as Excel does when a formula is filled down/right (shared formulas).
+    """
+    kind = node[0]
+    if kind == "ref":
+        return ("ref", node[1], _shift_part(node[2], drow, dcol))
+    if kind == "range":
+        return ("range", node[1], _shift_part(node[2], drow, dcol), _shift_part(node[3], drow, dcol))
+    if kind == "fn":
+        return ("fn", node[1], tuple(shift_formula(a, drow, dcol) for a in node[2]))
+    if kind in ("neg", "pct"):
+        return (kind, shift_formula(node[1], drow, dcol))
+    if kind == "op":
+        return ("op", node[1], shift_formula(node[2], drow, dcol), shift_formula(node[3], drow, dcol))
+    return node
+
+def _shift_part(part, drow, dcol):
+    row, col, row_abs, col_abs = part
+    if row is not None and not row_abs:
+        row += drow
+    if col is not None and not col_abs:
+        col += dcol
+    return (row, col, row_abs, col_abs)
+
+def references(node):
+    """Yields every ref/range/name node of an AST."""
+    kind = node[0]
+    if kind in ("ref", "range", "name"):
+        yield node
+    elif kind == "fn":
+        for arg in node[2]:
+            yield from references(arg)
+    elif kind in ("neg", "pct"):
+        yield from references(node[1])
+    elif kind == "op":
+        yield from references(node[2])
+        yield from references(node[3])
+
+
+# --- Values ---
+
+class RangeValue:
+    """A rectangular block of cell values, read lazily from the engine."""
+
+    def __init__(self, engine, sheet, r1, c1, r2, c2):
+        self.engine = engine
+        self.sheet = sheet
+        self.r1, self.c1, self.r2, self.c2 = r1, c1, r2, c2
+
+    @property
+    def shape(self):
+        return self.r2 - self.r1 + 1, self.c2 - self.c1 + 1
+
+    def cell(self, i, j):
+        """Value at 0-based (i, j) inside the range."""
+        return self.engine._cell_value(self.sheet, self.r1 + i, self.c1 + j)
+
+    def rows(self):
+        for r in range(self.r1, self.r2 + 1):
+            yield [self.engine._cell_value(self.sheet, r, c) for c in range(self.c1, self.c2 + 1)]
+
+    def values(self):
+        for row in self.rows():
+            yield from row
+
+def _parse_literal(text):
+    """Value of a constant cell as stored in the parsed workbook (always text)."""
+    if text is None or text == "":
+        return None
+    if text in ERROR_CODES:
+        return ExcelError(text)
+    try:
+        return float(text)
+    except ValueError:
+        return text
+
+def _raise_error(value):
+    if isinstance(value, ExcelError):
+        raise value
+    return value
+
+def to_number(value):
+    value = _raise_error(value)
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, float):
+        return value
+    if isinstance(value, (int,)):
+        return float(value)
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        raise ExcelError("#VALUE!")
+
+def to_text(value):
+    value = _raise_error(value)
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return format(value, ".15g")
+    return str(value)
+
+def to_bool(value):
+    value = _raise_error(value)
+    if isinstance(value, str):
+        if value.upper() in ("TRUE", "FALSE"):
+            return value.upper() == "TRUE"
+        raise ExcelError("#VALUE!")
+    return bool(to_number(value))
+
+def _scalar(value):
+    if isinstance(value, RangeValue):
+        if value.shape == (1, 1):
+            return value.cell(0, 0)
+        raise ExcelError("#VALUE!")
+    return value
+
+def _type_rank(value):
+    # Excel orders numbers < text < booleans
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, str):
+        return 1
+    return 0
+
+def compare_values(a, b):
+    """-1/0/1 with Excel semantics (case-insensitive text, blank as 0 or "")."""
+    a, b = _raise_error(a), _raise_error(b)
+    if a is None:
+        a = "" if isinstance(b, str) else (False if isinstance(b, bool) else 0.0)
+    if b is None:
+        b = "" if isinstance(a, str) else (False if isinstance(a, bool) else 0.0)
+    ra, rb = _type_rank(a), _type_rank(b)
+    if ra != rb:
+        return -1 if ra < rb else 1
+    if isinstance(a, str):
+        a, b = a.casefold(), b.casefold()
+    return (a > b) - (a < b)
+
+
+# --- Functions ---
+
+def _flatten(args):
+    """Values of all arguments, expanding ranges. Yields (value, came_from_range)."""
+    for arg in args:
+        if isinstance(arg, RangeValue):
+            for v in arg.values():
+                yield v, True
+        else:
+            yield arg, False
+
+def _numbers(args):
+    """Numeric arguments as SUM sees them: text/bools/blanks inside ranges are skipped."""
+    out = []
+    for value, in_range in _flatten(args):
+        _raise_error(value)
+        if in_range:
+            if isinstance(value, float) and not isinstance(value, bool):
+                out.append(value)
+        elif value is not None:
+            out.append(to_number(value))
+    return out
+
+def _average(values):
+    if not values:
+        raise ExcelError("#DIV/0!")
+    return sum(values) / len(values)
+
+def _round(x, digits, mode):
+    digits = int(digits)
+    factor = 10.0 ** digits
+    scaled = abs(x) * factor
+    if mode == "half":
+        # Half away from zero; the epsilon absorbs binary noise (2.675 -> 2.68)
+        scaled = math.floor(scaled + 0.5 + 1e-9)
+    elif mode == "up":
+        scaled = math.ceil(scaled - 1e-9)
+    else:
+        scaled = math.floor(scaled + 1e-9)
+    return math.copysign(scaled / factor, x) if scaled else 0.0
+
+def _stdev(values, sample):
+    n = len(values)
+    if n - (1 if sample else 0) <= 0:
+        raise ExcelError("#DIV/0!")
+    mean = sum(values) / n
+    return sum((v - mean) ** 2 for v in values) / (n - (1 if sample else 0))
+
+_CRITERIA_RE = re.compile(r"^(<=|>=|<>|<|>|=)?(.*)$", re.DOTALL)
+
+def _criteria(criterion):
+    """COUNTIF-style criterion ("<>x", ">=5", "a*", 3) -> predicate over cell values."""
+    criterion = _raise_error(_scalar(criterion))
+    if not isinstance(criterion, str):
+        target = to_number(criterion)
+        return lambda v: isinstance(v, float) and v == target
+
+    op, operand = _CRITERIA_RE.match(criterion).groups()
+    op = op or "="
+    try:
+        number = float(operand)
+    except ValueError:
+        number = None
+
+    if number is not None:
+        def numeric(v):
+            if not isinstance(v, float) or isinstance(v, bool):
+                return op == "<>"
+            return {"=": v == number, "<>": v != number, "<": v < number,
+                    ">": v > number, "<=": v <= number, ">=": v >= number}[op]
+        return numeric
+
+    if operand == "":
+        return (lambda v: v is None or v == "") if op == "=" else (lambda v: not (v is None or v == ""))
+
+    pattern = _wildcard_re(operand)
+    if op == "=":
+        return lambda v: isinstance(v, str) and pattern.fullmatch(v) is not None
+    if op == "<>":
+        return lambda v: not (isinstance(v, str) and pattern.fullmatch(v) is not None)
+    accepted = {"<": (-1,), ">": (1,), "<=": (-1, 0), ">=": (0, 1)}[op]
+    return lambda v: isinstance(v, str) and compare_values(v, operand) in accepted
+
+@lru_cache(maxsize=1024)
+def _wildcard_re(text):
+    out = []
+    i = 0
+    while i < len(text):
+        ch = text[i]
+        if ch == "~" and i + 1 < len(text):
+            out.append(re.escape(text[i + 1]))
+            i += 2
+            continue
+        out.append(".*" if ch == "*" else "." if ch == "?" else re.escape(ch))
+        i += 1
+    return re.compile("".join(out), re.IGNORECASE | re.DOTALL)
+
+def _conditional(args, aggregate):
+    """SUMIFS/COUNTIFS/AVERAGEIFS core: args are (target_range or None, [(range, criterion), ...])."""
+    target, pairs = args
+    shape = pairs[0][0].shape
+    tests = [(rng, _criteria(crit)) for rng, crit in pairs]
+    if any(rng.shape != shape for rng, _ in tests) or (target is not None and target.shape != shape):
+        raise ExcelError("#VALUE!")
+    picked = []
+    for i in range(shape[0]):
+        for j in range(shape[1]):
+            if all(test(rng.cell(i, j)) for rng, test in tests):
+                picked.append(target.cell(i, j) if target is not None else 1.0)
+    return aggregate(picked)
+
+def _need_range(value):
+    if not isinstance(value, RangeValue):
+        raise ExcelError("#VALUE!")
+    return value
+
+def _fn_sumif(args):
+    rng = _need_range(args[0])
+    target = _need_range(args[2]) if len(args) > 2 else rng
+    return _conditional((target, [(rng, args[1])]), lambda vs: sum(v for v in vs if isinstance(v, float)))
+
+def _fn_averageif(args):
+    rng = _need_range(args[0])
+    target = _need_range(args[2]) if len(args) > 2 else rng
+    return _conditional((target, [(rng, args[1])]), lambda vs: _average([v for v in vs if isinstance(v, float)]))
+
+def _pairs(args):
+    if len(args) % 2:
+        raise ExcelError("#VALUE!")
+    return [(_need_range(args[i]), args[i + 1]) for i in range(0, len(args), 2)]
+
+def _match_position(lookup, values, match_type):
+    """1-based position of lookup in values (MATCH semantics), or raises #N/A."""
+    lookup = _raise_error(lookup)
+    if match_type == 0:
+        if isinstance(lookup, str) and any(ch in lookup for ch in "*?~"):
+            pattern = _wildcard_re(lookup)
+            for i, v in enumerate(values):
+                if isinstance(v, str) and pattern.fullmatch(v):
+                    return i + 1
+        else:
+            for i, v in enumerate(values):
+                if v is not None and not isinstance(v, ExcelError) and _type_rank(v) == _type_rank(lookup) \
+                        and compare_values(v, lookup) == 0:
+                    return i + 1
+        raise ExcelError("#N/A")
+
+    # Approximate: values are assumed sorted (ascending for 1, descending for -1)
+    best = None
+    for i, v in enumerate(values):
+        if v is None or isinstance(v, ExcelError) or _type_rank(v) != _type_rank(lookup):
+            continue
+        c = compare_values(v, lookup)
+        if c == 0:
+            return i + 1
+        if (match_type > 0 and c < 0) or (match_type < 0 and c > 0):
+            best = i + 1
+        else:
+            break
+    if best is None:
+        raise ExcelError("#N/A")
+    return best
+
+def _fn_vlookup(args, horizontal=False):
+    lookup, table, index = _scalar(args[0]), _need_range(args[1]), int(to_number(_scalar(args[2])))
+    approximate = to_bool(_scalar(args[3])) if len(args) > 3 and args[3] is not None else True
+    rows, cols = table.shape
+    if index < 1 or index > (rows if horizontal else cols):
+        raise ExcelError("#REF!")
+    keys = [table.cell(0, j) for j in range(cols)] if horizontal else [table.cell(i, 0) for i in range(rows)]
+    pos = _match_position(lookup, keys, 1 if approximate else 0) - 1
+    return table.cell(index - 1, pos) if horizontal else table.cell(pos, index - 1)
+
+def _fn_match(args):
+    lookup, rng = _scalar(args[0]), _need_range(args[1])
+    match_type = int(to_number(_scalar(args[2]))) if len(args) > 2 and args[2] is not None else 1
+    rows, cols = rng.shape
+    if rows != 1 and cols != 1:
+        raise ExcelError("#N/A")
+    return float(_match_position(lookup, list(rng.values()), match_type))
+
+def _fn_index(args):
+    rng = args[0]
+    if not isinstance(rng, RangeValue):
+        return rng
+    rows, cols = rng.shape
+    row = int(to_number(_scalar(args[1]))) if len(args) > 1 and args[1] is not None else 0
+    col = int(to_number(_scalar(args[2]))) if len(args) > 2 and args[2] is not None else 0
+    if rows == 1 and len(args) == 2:
+        row, col = 1, row  # INDEX(A1:E1, 3) picks the 3rd column
+    if row < 0 or col < 0 or row > rows or col > cols:
+        raise ExcelError("#REF!")
+    if row and col:
+        return rng.cell(row - 1, col - 1)
+    if row:
+        return RangeValue(rng.engine, rng.sheet, rng.r1 + row - 1, rng.c1, rng.r1 + row - 1, rng.c2)
+    if col:
+        return RangeValue(rng.engine, rng.sheet, rng.r1, rng.c1 + col - 1, rng.r2, rng.c1 + col - 1)
+    return rng
+
+def _fn_xlookup(args):
+    lookup, keys, results = _scalar(args[0]), _need_range(args[1]), _need_range(args[2])
+    try:
+        pos = _match_position(lookup, list(keys.values()), 0) - 1
+    except ExcelError:
+        if len(args) > 3 and args[3] is not None:
+            return _scalar(args[3])
+        raise
+    rows, cols = keys.shape
+    return results.cell(pos, 0) if cols == 1 else results.cell(0, pos)
+
+def _text_arg(args, i, default=None):
+    if i >= len(args) or args[i] is None:
+        return default
+    return to_text(_scalar(args[i]))
+
+def _num_arg(args, i, default=None):
+    if i >= len(args) or args[i] is None:
+        if default is None:
+            raise ExcelError("#VALUE!")
+        return default
+    return to_number(_scalar(args[i]))
+
+def _fn_find(args, case_sensitive):
+    needle, haystack = _text_arg(args, 0), _text_arg(args, 1)
+    start = int(_num_arg(args, 2, 1.0))
+    if case_sensitive:
+        pos = haystack.find(needle, start - 1)
+    else:
+        m = _wildcard_re(needle).search(haystack, start - 1) if needle else None
+        pos = m.start() if m else -1
+    if pos < 0 or start < 1:
+        raise ExcelError("#VALUE!")
+    return float(pos + 1)
+
+def _fn_substitute(args):
+    text, old, new = _text_arg(args, 0), _text_arg(args, 1), _text_arg(args, 2)
+    if len(args) > 3 and args[3] is not None:
+        nth = int(_num_arg(args, 3))
+        idx = -1
+        for _ in range(nth):
+            idx = text.find(old, idx + 1)
+            if idx < 0:
+                return text
+        return text[:idx] + new + text[idx + len(old):]
+    return text.replace(old, new) if old else text
+
+def _sumproduct(args):
+    ranges = [_need_range(a) for a in args]
+    shape = ranges[0].shape
+    if any(r.shape != shape for r in ranges):
+        raise ExcelError("#VALUE!")
+    columns = [list(r.values()) for r in ranges]
+    total = 0.0
+    for items in zip(*columns):
+        product = 1.0
+        for v in items:
+            _raise_error(v)
+            product *= v if isinstance(v, float) else 0.0
+        total += product
+    return total
+
+def _kth(args, largest):
+    values = sorted(_numbers([args[0]]), reverse=largest)
+    k = int(_num_arg(args, 1))
+    if k < 1 or k > len(values):
+        raise ExcelError("#NUM!")
+    return values[k - 1]
+
+def _median(values):
+    if not values:
+        raise ExcelError("#NUM!")
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2
+
+def _countblank(args):
+    return float(sum(1 for v, _ in _flatten(args) if v is None or v == ""))
+
+def _safe_div(a, b):
+    if b == 0:
+        raise ExcelError("#DIV/0!")
+    return a / b
+
+def _fn_mod(args):
+    n, d = _num_arg(args, 0), _num_arg(args, 1)
+    if d == 0:
+        raise ExcelError("#DIV/0!")
+    return n - d * math.floor(n / d)
+
+def _fn_sqrt(args):
+    x = _num_arg(args, 0)
+    if x < 0:
+        raise ExcelError("#NUM!")
+    return math.sqrt(x)
+
+def _fn_log(args, base=None):
+    x = _num_arg(args, 0)
+    b = base or _num_arg(args, 1, 10.0)
+    if x <= 0 or b <= 0 or b == 1:
+        raise ExcelError("#NUM!")
+    return math.log(x, b)
+
+def _fn_choose(args):
+    index = int(_num_arg(args, 0))
+    if index < 1 or index >= len(args):
+        raise ExcelError("#VALUE!")
+    return args[index]
+
+# Functions receiving evaluated arguments (RangeValue for ranges, None for omitted args)
+FUNCTIONS = {
+    "SUM": lambda a: sum(_numbers(a)),
+    "PRODUCT": lambda a: math.prod(_numbers(a)),
+    "AVERAGE": lambda a: _average(_numbers(a)),
+    "MIN": lambda a: min(_numbers(a), default=0.0),
+    "MAX": lambda a: max(_numbers(a), default=0.0),
+    "MEDIAN": lambda a: _median(_numbers(a)),
+    "COUNT": lambda a: float(sum(1 for v, r in _flatten(a)
+                                 if isinstance(v, float) or (not r and isinstance(v, str) and _is_numeric_text(v)))),
+    "COUNTA": lambda a: float(sum(1 for v, _ in _flatten(a) if v is not None and v != "")),
+    "COUNTBLANK": _countblank,
+    "STDEV": lambda a: math.sqrt(_stdev(_numbers(a), True)),
+    "STDEV.S": lambda a: math.sqrt(_stdev(_numbers(a), True)),
+    "STDEV.P": lambda a: math.sqrt(_stdev(_numbers(a), False)),
+    "VAR": lambda a: _stdev(_numbers(a), True),
+    "VAR.S": lambda a: _stdev(_numbers(a), True),
+    "VAR.P": lambda a: _stdev(_numbers(a), False),
+    "LARGE": lambda a: _kth(a, True),
+    "SMALL": lambda a: _kth(a, False),
+    "SUMPRODUCT": _sumproduct,
+    "ROUND": lambda a: _round(_num_arg(a, 0), _num_arg(a, 1, 0.0), "half"),
+    "ROUNDUP": lambda a: _round(_num_arg(a, 0), _num_arg(a, 1, 0.0), "up"),
+    "ROUNDDOWN": lambda a: _round(_num_arg(a, 0), _num_arg(a, 1, 0.0), "down"),
+    "TRUNC": lambda a: _round(_num_arg(a, 0), _num_arg(a, 1, 0.0), "down"),
+    "INT": lambda a: float(math.floor(_num_arg(a, 0))),
+    "ABS": lambda a: abs(_num_arg(a, 0)),
+    "SIGN": lambda a: float((_num_arg(a, 0) > 0) - (_num_arg(a, 0) < 0)),
+    "MOD": _fn_mod,
+    "POWER": lambda a: _num_arg(a, 0) ** _num_arg(a, 1),
+    "SQRT": _fn_sqrt,
+    "EXP": lambda a: math.exp(_num_arg(a, 0)),
+    "LN": lambda a: _fn_log(a, math.e),
+    "LOG": _fn_log,
+    "LOG10": lambda a: _fn_log(a, 10.0),
+    "PI": lambda a: math.pi,
+    "SUMIF": _fn_sumif,
+    "SUMIFS": lambda a: _conditional((_need_range(a[0]), _pairs(a[1:])), lambda vs: sum(v for v in vs if isinstance(v, float))),
+    "COUNTIF": lambda a: _conditional((None, [(_need_range(a[0]), a[1])]), lambda vs: float(len(vs))),
+    "COUNTIFS": lambda a: _conditional((None, _pairs(a)), lambda vs: float(len(vs))),
+    "AVERAGEIF": _fn_averageif,
+    "AVERAGEIFS": lambda a: _conditional((_need_range(a[0]), _pairs(a[1:])), lambda vs: _average([v for v in vs if isinstance(v, float)])),
+    "AND": lambda a: all([to_bool(v) for v, _ in _flatten(a) if v is not None]),
+    "OR": lambda a: any([to_bool(v) for v, _ in _flatten(a) if v is not None]),
+    "NOT": lambda a: not to_bool(_scalar(a[0])),
+    "TRUE": lambda a: True,
+    "FALSE": lambda a: False,
+    "CHOOSE": _fn_choose,
+    "VLOOKUP": _fn_vlookup,
+    "HLOOKUP": lambda a: _fn_vlookup(a, horizontal=True),
+    "MATCH": _fn_match,
+    "INDEX": _fn_index,
+    "XLOOKUP": _fn_xlookup,
+    "CONCATENATE": lambda a: "".join(to_text(v) for v, _ in _flatten(a)),
+    "CONCAT": lambda a: "".join(to_text(v) for v, _ in _flatten(a)),
+    "LEFT": lambda a: _text_arg(a, 0)[:int(_num_arg(a, 1, 1.0))],
+    "RIGHT": lambda a: (lambda t, n: t[len(t) - n:] if n else "")(_text_arg(a, 0), int(_num_arg(a, 1, 1.0))),
+    "MID": lambda a: _text_arg(a, 0)[int(_num_arg(a, 1)) - 1:int(_num_arg(a, 1)) - 1 + int(_num_arg(a, 2))],
+    "LEN": lambda a: float(len(_text_arg(a, 0))),
+    "UPPER": lambda a: _text_arg(a, 0).upper(),
+    "LOWER": lambda a: _text_arg(a, 0).lower(),
+    "PROPER": lambda a: _text_arg(a, 0).title(),
+    "TRIM": lambda a: re.sub(r" +", " ", _text_arg(a, 0)).strip(" "),
+    "REPT": lambda a: _text_arg(a, 0) * int(_num_arg(a, 1)),
+    "EXACT": lambda a: _text_arg(a, 0) == _text_arg(a, 1),
+    "VALUE": lambda a: to_number(_text_arg(a, 0)),
+    "FIND": lambda a: _fn_find(a, True),
+    "SEARCH": lambda a: _fn_find(a, False),
+    "SUBSTITUTE": _fn_substitute,
+    "ISBLANK": lambda a: _scalar(a[0]) is None,
+    "ISNUMBER": lambda a: isinstance(_scalar(a[0]), float) and not isinstance(_scalar(a[0]), bool),
+    "ISTEXT": lambda a: isinstance(_scalar(a[0]), str),
+}
+
+# Functions that control which arguments are evaluated (handled by the engine)
+LAZY_FUNCTIONS = {"IF", "IFERROR", "IFNA", "ISERROR", "ISERR", "ISNA", "IFS"}
+
+SUPPORTED_FUNCTIONS = frozenset(FUNCTIONS) | LAZY_FUNCTIONS
+
+def _is_numeric_text(text):
+    try:
+        float(text)
+        return True
+    except ValueError:
+        return False
+
+
+# --- Engine ---
+
+class FormulaEngine:
+    """
+    Evaluates the formulas of a parsed workbook (parse_workbook_to_json output).
+
+    A dependency graph (cell -> formula cells that read it) is built up front from the
+    cached ASTs; computed values are memoized and set_cell() only invalidates the
+    formula cells downstream of the change. Shared-formula children, which the file
+    stores without text, are rebuilt from their master's formula and ref range.
+    """
+
+    def __init__(self, workbook_data):
+        self._sheets = {}        # folded name -> name
+        self._cells = {}         # (sheet, row, col) -> constant value or ("=", ast, text)
+        self._values = {}        # memoized results of formula cells
+        self._dependents = {}    # (sheet, row, col) -> {formula cells}
+        self._range_dependents = []  # (sheet, r1, c1, r2, c2, formula cell)
+        self._extent = {}        # sheet -> (max row, max col)
+        self._evaluating = set()
+        self._names = {}
+
+        for name, formula in (workbook_data.get("workbook_metadata", {}).get("definedNames") or {}).items():
+            if formula:
+                self._names[name.casefold()] = formula
+
+        for sheet, entry in workbook_data.get("sheets", {}).items():
+            self._sheets[sheet.strip().casefold()] = sheet
+            self._load_sheet(sheet, entry.get("cells", {}))
+
+        for key, content in self._cells.items():
+            if isinstance(content, tuple):
+                self._link(key, content[1])
+
+    def _load_sheet(self, sheet, cells):
+        masters = []
+        children = []
+        max_row = max_col = 0
+        for coord, cell in cells.items():
+            pos = parse_coord(coord)
+            if pos is None:
+                continue
+            row, col = pos
+            max_row, max_col = max(max_row, row), max(max_col, col)
+            key = (sheet, row, col)
+            formula = cell.get("formula")
+            if formula:
+                self._cells[key] = self._formula_content(formula)
+                if cell.get("formula_type") == "shared" and cell.get("formula_ref"):
+                    masters.append((row, col, cell.get("formula_ref"), self._cells[key]))
+            elif cell.get("formula_type") == "shared":
+                children.append(key)
+                self._cells[key] = _parse_literal(cell.get("value"))
+            else:
+                self._cells[key] = _parse_literal(cell.get("value"))
+        self._extent[sheet] = (max_row, max_col)
+
+        for key in children:
+            _, row, col = key
+            for m_row, m_col, ref, content in masters:
+                if content[1] is None or not _in_range(ref, row, col):
+                    continue
+                self._cells[key] = ("=", shift_formula(content[1], row - m_row, col - m_col), None)
+                break
+
+    @staticmethod
+    def _formula_content(text):
+        try:
+            return ("=", parse_formula(text), text)
+        except FormulaSyntaxError:
+            return ("=", None, text)
+
+    def _sheet_name(self, sheet, current):
+        if sheet is None:
+            return current
+        return self._sheets.get(sheet.strip().casefold(), sheet)
+
+    def _link(self, key, ast):
+        """Registers key as a dependent of every cell/range its formula reads."""
+        if ast is None:
+            return
+        for ref in references(ast):
+            if ref[0] == "name":
+                target = self._name_ast(ref[1])
+                if target is not None and target[0] in ("ref", "range"):
+                    ref = target
+                else:
+                    continue
+            sheet = self._sheet_name(ref[1], key[0])
+            if ref[0] == "ref":
+                self._dependents.setdefault((sheet, ref[2][0], ref[2][1]), set()).add(key)
+            else:
+                r1, c1, r2, c2 = self._bounds(sheet, ref[2], ref[3])
+                self._range_dependents.append((sheet, r1, c1, r2, c2, key))
+
+    def _name_ast(self, name):
+        formula = self._names.get(name.casefold())
+        if not formula:
+            return None
+        try:
+            return parse_formula(formula)
+        except FormulaSyntaxError:
+            return None
+
+    def _bounds(self, sheet, first, last):
+        r1, c1 = first[0], first[1]
+        r2, c2 = last[0], last[1]
+        max_row, max_col = self._extent.get(sheet, (0, 0))
+        # Whole columns / rows only need to reach the used area
+        r1 = r1 if r1 is not None else 1
+        c1 = c1 if c1 is not None else 1
+        r2 = r2 if r2 is not None else min(max(max_row, r1), MAX_OPEN_RANGE_ROWS)
+        c2 = c2 if c2 is not None else min(max(max_col, c1), MAX_OPEN_RANGE_COLS)
+        return min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2)
+
+    # Graph queries
+
+    def precedents(self, sheet, coord):
+        """References read by a formula cell: [("Sheet", "A1"), ("Sheet", "B1:B9"), ...]"""
+        row, col = parse_coord(coord)
+        content = self._cells.get((sheet, row, col))
+        if not isinstance(content, tuple) or content[1] is None:
+            return []
+        out = []
+        for ref in references(content[1]):
+            if ref[0] == "name":
+                out.append((sheet, ref[1]))
+                continue
+            ref_sheet = self._sheet_name(ref[1], sheet)
+            if ref[0] == "ref":
+                out.append((ref_sheet, to_coord(ref[2][0], ref[2][1])))
+            else:
+                r1, c1, r2, c2 = self._bounds(ref_sheet, ref[2], ref[3])
+                out.append((ref_sheet, f"{to_coord(r1, c1)}:{to_coord(r2, c2)}"))
+        return out
+
+    def dependents(self, sheet, coord, transitive=False):
+        """Formula cells that read a cell (directly, or through other formulas)."""
+        row, col = parse_coord(coord)
+        found = self._downstream((sheet, row, col)) if transitive else self._direct_dependents((sheet, row, col))
+        return sorted((s, to_coord(r, c)) for s, r, c in found)
+
+    def _direct_dependents(self, key):
+        sheet, row, col = key
+        found = set(self._dependents.get(key, ()))
+        for r_sheet, r1, c1, r2, c2, dep in self._range_dependents:
+            if r_sheet == sheet and r1 <= row <= r2 and c1 <= col <= c2:
+                found.add(dep)
+        return found
+
+    def _downstream(self, key):
+        seen = set()
+        queue = deque([key])
+        while queue:
+            for dep in self._direct_dependents(queue.popleft()):
+                if dep not in seen:
+                    seen.add(dep)
+                    queue.append(dep)
+        return seen
+
+    # Evaluation
+
+    def value(self, sheet, coord):
+        """
+        Value of a cell: computed for formula cells, the stored constant otherwise.
+        Numbers are floats, blanks None, errors ExcelError instances.
+        Raises UnsupportedFormula if the formula can't be evaluated here.
+        """
+        row, col = parse_coord(coord)
+        return self._cell_value(self._sheet_name(sheet, sheet), row, col)
+
+    def evaluate(self, formula, sheet):
+        """
+        Evaluates formula text as if it sat on sheet -- e.g. a student's formula
+        recomputed against the answer key's data.
+        """
+        try:
+            ast = parse_formula(formula)
+        except FormulaSyntaxError as e:
+            raise UnsupportedFormula(str(e))
+        return self._evaluate_top(ast, self._sheet_name(sheet, sheet))
+
+    def set_cell(self, sheet, coord, value=None, formula=None):
+        """
+        Replaces a cell's content and invalidates only the formulas downstream of it.
+        """
+        sheet = self._sheet_name(sheet, sheet)
+        row, col = parse_coord(coord)
+        key = (sheet, row, col)
+        old = self._cells.get(key)
+        if isinstance(old, tuple) and old[1] is not None:
+            for deps in self._dependents.values():
+                deps.discard(key)
+            self._range_dependents = [r for r in self._range_dependents if r[5] != key]
+
+        if formula:
+            self._cells[key] = self._formula_content(formula)
+            self._link(key, self._cells[key][1])
+        else:
+            self._cells[key] = value if not isinstance(value, str) else _parse_literal(value)
+
+        max_row, max_col = self._extent.get(sheet, (0, 0))
+        self._extent[sheet] = (max(max_row, row), max(max_col, col))
+
+        self._values.pop(key, None)
+        for dep in self._downstream(key):
+            self._values.pop(dep, None)
+
+    def recalculate(self):
+        """
+        Computes every formula cell. Returns { (sheet, coord): value or UnsupportedFormula }.
+        Cells are visited row-major per sheet, so running totals resolve without deep recursion.
+        """
+        results = {}
+        for key in sorted(k for k, v in self._cells.items() if isinstance(v, tuple)):
+            try:
+                value = self._cell_value(*key)
+            except UnsupportedFormula as e:
+                value = e
+            results[(key[0], to_coord(key[1], key[2]))] = value
+        return results
+
+    def _cell_value(self, sheet, row, col):
+        key = (sheet, row, col)
+        content = self._cells.get(key)
+        if not isinstance(content, tuple):
+            return content
+        if key in self._values:
+            return self._values[key]
+        if content[1] is None:
+            raise UnsupportedFormula(f"Cannot parse formula {content[2]!r}")
+        if key in self._evaluating:
+            return ExcelError("#REF!")  # circular reference
+        self._evaluating.add(key)
+        try:
+            value = self._evaluate_top(content[1], sheet)
+        finally:
+            self._evaluating.discard(key)
+        self._values[key] = value
+        return value
+
+    def _evaluate_top(self, ast, sheet):
+        try:
+            value = _scalar(self._eval(ast, sheet))
+        except ExcelError as e:
+            return e
+        except RecursionError:
+            raise UnsupportedFormula("Dependency chain too deep")
+        if value is None:
+            return 0.0  # a formula pointing at a blank cell shows 0
+        return value
+
+    def _eval(self, node, sheet):
+        kind = node[0]
+        if kind == "num" or kind == "str" or kind == "bool":
+            return node[1]
+        if kind == "blank":
+            return None
+        if kind == "err":
+            raise ExcelError(node[1])
+        if kind == "ref":
+            return self._cell_value(self._sheet_name(node[1], sheet), node[2][0], node[2][1])
+        if kind == "range":
+            ref_sheet = self._sheet_name(node[1], sheet)
+            return RangeValue(self, ref_sheet, *self._bounds(ref_sheet, node[2], node[3]))
+        if kind == "name":
+            target = self._name_ast(node[1])
+            if target is None:
+                raise ExcelError("#NAME?")
+            return self._eval(target, sheet)
+        if kind == "neg":
+            return -to_number(_scalar(self._eval(node[1], sheet)))
+        if kind == "pct":
+            return to_number(_scalar(self._eval(node[1], sheet))) / 100.0
+        if kind == "op":
+            return self._binary(node[1], _scalar(self._eval(node[2], sheet)), _scalar(self._eval(node[3], sheet)))
+        if kind == "fn":
+            return self._call(node[1], node[2], sheet)
+        raise UnsupportedFormula(f"Unknown node {kind}")
+
+    def _binary(self, op, a, b):
+        if op in _COMPARISONS:
+            c = compare_values(a, b)
+            return {"=": c == 0, "<>": c != 0, "<": c < 0, ">": c > 0, "<=": c <= 0, ">=": c >= 0}[op]
+        if op == "&":
+            return to_text(a) + to_text(b)
+        x, y = to_number(a), to_number(b)
+        if op == "+":
+            return x + y
+        if op == "-":
+            return x - y
+        if op == "*":
+            return x * y
+        if op == "/":
+            return _safe_div(x, y)
+        if op == "^":
+            try:
+                result = x ** y
+            except (OverflowError, ZeroDivisionError):
+                raise ExcelError("#NUM!")
+            if isinstance(result, complex):
+                raise ExcelError("#NUM!")
+            return result
+        raise UnsupportedFormula(f"Operator {op}")
+
+    def _call(self, name, args, sheet):
+        if name in LAZY_FUNCTIONS:
+            return self._call_lazy(name, args, sheet)
+        fn = FUNCTIONS.get(name)
+        if fn is None:
+            raise UnsupportedFormula(f"Function {name} is not supported")
+        values = [None if a[0] == "blank" else self._eval(a, sheet) for a in args]
+        try:
+            result = fn(values)
+        except (IndexError, TypeError):
+            raise ExcelError("#VALUE!")
+        if isinstance(result, bool) or isinstance(result, (str, RangeValue, ExcelError)) or result is None:
+            return result
+        if isinstance(result, float) and (math.isnan(result) or math.isinf(result)):
+            raise ExcelError("#NUM!")
+        return float(result)
+
+    def _call_lazy(self, name, args, sheet):
+        def arg(i, default=None):
+            if i >= len(args) or args[i][0] == "blank":
+                return default
+            return _scalar(self._eval(args[i], sheet))
+
+        if name == "IF":
+            if to_bool(arg(0)):
+                return arg(1, True)
+            return arg(2, False)
+        if name == "IFS":
+            for i in range(0, len(args) - 1, 2):
+                if to_bool(arg(i)):
+                    return arg(i + 1)
+            raise ExcelError("#N/A")
+        try:
+            value = arg(0)
+            failed = isinstance(value, ExcelError)
+        except ExcelError as e:
+            value, failed = e, True
+        if name == "IFERROR":
+            return arg(1, "") if failed else value
+        if name == "IFNA":
+            return arg(1, "") if failed and value.code == "#N/A" else _raise_error(value)
+        if name in ("ISERROR", "ISERR"):
+            return failed and not (name == "ISERR" and value.code == "#N/A")
+        if name == "ISNA":
+            return failed and value.code == "#N/A"
+        raise UnsupportedFormula(name)
+
+    def input_cells(self, formula, sheet, limit=5000):
+        """
+        Numeric constant cells a formula ultimately reads (through other formulas),
+        or None when there are more than limit of them.
+        """
+        try:
+            pending = [(parse_formula(formula), sheet)]
+        except FormulaSyntaxError:
+            return None
+        seen, inputs = set(), set()
+        while pending:
+            ast, current = pending.pop()
+            if ast is None:
+                continue
+            for ref in references(ast):
+                if ref[0] == "name":
+                    target = self._name_ast(ref[1])
+                    if target is not None:
+                        pending.append((target, current))
+                    continue
+                ref_sheet = self._sheet_name(ref[1], current)
+                if ref[0] == "ref":
+                    cells = [(ref[2][0], ref[2][1])]
+                else:
+                    r1, c1, r2, c2 = self._bounds(ref_sheet, ref[2], ref[3])
+                    if (r2 - r1 + 1) * (c2 - c1 + 1) > limit:
+                        return None
+                    cells = [(r, c) for r in range(r1, r2 + 1) for c in range(c1, c2 + 1)]
+                for row, col in cells:
+                    key = (ref_sheet, row, col)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    content = self._cells.get(key)
+                    if isinstance(content, tuple):
+                        pending.append((content[1], ref_sheet))
+                    elif isinstance(content, float):
+                        inputs.add(key)
+                if len(seen) > limit:
+                    return None
+        return inputs
+
+    def reads_missing(self, formula, sheet):
+        """
+        True when the formula reads a sheet this workbook doesn't have, a cell it has
+        nothing in, or a range it has nothing in (e.g. a student's helper cells, evaluated
+        on the answer key). Only the formula's own references are checked.
+        """
+        try:
+            pending = [parse_formula(formula)]
+        except FormulaSyntaxError:
+            return False
+        while pending:
+            ast = pending.pop()
+            if ast is None:
+                continue
+            for ref in references(ast):
+                if ref[0] == "name":
+                    target = self._name_ast(ref[1])
+                    if target is None:
+                        return True
+                    pending.append(target)
+                    continue
+                if ref[1] is not None and ref[1].strip().casefold() not in self._sheets:
+                    return True
+                ref_sheet = self._sheet_name(ref[1], sheet)
+                if ref[0] == "ref":
+                    if (ref_sheet, ref[2][0], ref[2][1]) not in self._cells:
+                        return True
+                    continue
+                r1, c1, r2, c2 = self._bounds(ref_sheet, ref[2], ref[3])
+                if not any(key[0] == ref_sheet and r1 <= key[1] <= r2 and c1 <= key[2] <= c2 for key in self._cells):
+                    return True
+        return False
+
+
+def formulas_equivalent(engine, sheet, formula, other, trials=3, seed=0):
+    """
+    Recompute-and-compare check for two formulas meant for the same cell: both are
+    evaluated on the workbook's data and again with their numeric inputs perturbed.
+    Returns True if they always agree, False if they diverge, None if the engine
+    can't tell (unsupported function, no numeric inputs, too many inputs).
+    """
+    try:
+        if not _same_result(engine.evaluate(formula, sheet), engine.evaluate(other, sheet)):
+            return False
+        inputs = [engine.input_cells(f, engine._sheet_name(sheet, sheet)) for f in (formula, other)]
+        if inputs[0] is None or inputs[1] is None or not (inputs[0] | inputs[1]):
+            return None
+        inputs = sorted(inputs[0] | inputs[1])
+        original = {key: engine._cells[key] for key in inputs}
+        rng = random.Random(seed)
+        try:
+            for _ in range(trials):
+                for key, value in original.items():
+                    # Keep the sign (lookups and IF branches stay plausible), vary the magnitude
+                    engine.set_cell(key[0], to_coord(key[1], key[2]), value * rng.uniform(0.5, 1.5) + rng.choice((-1, 1)))
+                if not _same_result(engine.evaluate(formula, sheet), engine.evaluate(other, sheet)):
+                    return False
+        finally:
+            for key, value in original.items():
+                engine.set_cell(key[0], to_coord(key[1], key[2]), value)
+        return True
+    except UnsupportedFormula:
+        return None
+
+def _same_result(a, b, abs_tol=1e-6, rel_tol=1e-9):
+    if isinstance(a, (float, bool)) and isinstance(b, (float, bool)):
+        a, b = float(a), float(b)
+        return abs(a - b) <= max(abs_tol, rel_tol * max(abs(a), abs(b)))
+    if isinstance(a, str) and isinstance(b, str):
+        return a.casefold() == b.casefold()
+    return a == b
+
+
+def _in_range(ref, row, col):
+    if ":" not in ref:
+        return parse_coord(ref) == (row, col)
+    first, last = (parse_coord(p) for p in ref.split(":", 1))
+    if first is None or last is None:
+        return False
+    return first[0] <= row <= last[0] and first[1] <= col <= last[1]
+
+def results_match(computed, cached, abs_tol=1e-6, rel_tol=1e-9):
+    """Compares an engine value with a value as stored in the parsed workbook (text)."""
+    if isinstance(computed, ExcelError):
+        return str(cached or "").strip() == computed.code
+    if isinstance(computed, bool):
+        computed = 1.0 if computed else 0.0
+    stored = _parse_literal(cached if cached is not None else "")
+    if isinstance(computed, float) and isinstance(stored, float):
+        return abs(computed - stored) <= max(abs_tol, rel_tol * max(abs(computed), abs(stored)))
+    if computed is None or computed == "":
+        return stored is None
+    return to_text(computed).strip().casefold() == str(cached or "").strip().casefold()
+
+def recompute_and_compare(workbook_data, reference_data=None, abs_tol=1e-6, rel_tol=1e-9):
+    """
+    Recomputes every formula of workbook_data and compares the results with the values
+    Excel cached in the file -- or, when reference_data (e.g. the answer key) is given,
+    with the values at the same cells there.
+    Returns {"checked": n, "mismatches": [{sheet, cell, formula, expected, computed}],
+             "unsupported": [{sheet, cell, formula, reason}]}
+    """
+    engine = FormulaEngine(workbook_data)
+    reference = reference_data if reference_data is not None else workbook_data
+    ref_sheets = {name.strip().casefold(): entry for name, entry in reference.get("sheets", {}).items()}
+    sheets = workbook_data.get("sheets", {})
+
+    report = {"checked": 0, "mismatches": [], "unsupported": []}
+    for (sheet, coord), value in engine.recalculate().items():
+        formula = sheets[sheet]["cells"][coord].get("formula") or "(shared formula)"
+        if isinstance(value, UnsupportedFormula):
+            report["unsupported"].append({"sheet": sheet, "cell": coord, "formula": formula, "reason": str(value)})
+            continue
+        ref_entry = ref_sheets.get(sheet.strip().casefold())
+        if ref_entry is None:
+            continue
+        ref_cell = ref_entry.get("cells", {}).get(coord) or {}
+        report["checked"] += 1
+        if not results_match(value, ref_cell.get("value"), abs_tol, rel_tol):
+            report["mismatches"].append({
+                "sheet": sheet, "cell": coord, "formula": formula,
+                "expected": ref_cell.get("value"),
+                "computed": value.code if isinstance(value, ExcelError) else to_text(value)
+            })
+    return report
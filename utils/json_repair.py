@@ -0,0 +1,210 @@
+import json
+import re
+
+# Tolerant parsing of model answers that are meant to be JSON.
+#
+# salvage_json() reads the first JSON object or array in the text, ignoring anything around
+# it (```json fences, a sentence of preamble), and accepts the usual glitches: trailing or
+# missing commas, single-quoted strings and bare keys, raw newlines inside strings,
+# Python's True/False/None and // or /* */ comments. When the answer stops part way (output
+# limit, dropped stream) or turns to garbage, everything up to that point is kept: open
+# containers are closed, an array element that was cut off is dropped, and a member whose
+# value was cut off is dropped unless the value is a container (kept with what it had).
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)\s*(?:```|$)", re.DOTALL)
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_ESCAPES = {'"': '"', "'": "'", "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+_DELIMITERS = set(",:]}") | set(" \t\r\n")
+
+
+class _Truncated(Exception):
+    """The text ended inside a value."""
+
+
+class _Parser:
+    def __init__(self, text, pos):
+        self.text = text
+        self.pos = pos
+        self.complete = True
+
+    def skip(self):
+        text, n = self.text, len(self.text)
+        while self.pos < n:
+            c = text[self.pos]
+            if c in " \t\r\n":
+                self.pos += 1
+            elif text.startswith("//", self.pos):
+                end = text.find("\n", self.pos)
+                self.pos = n if end < 0 else end + 1
+            elif text.startswith("/*", self.pos):
+                end = text.find("*/", self.pos + 2)
+                self.pos = n if end < 0 else end + 2
+            else:
+                break
+
+    def peek(self):
+        self.skip()
+        if self.pos >= len(self.text):
+            raise _Truncated()
+        return self.text[self.pos]
+
+    def value(self):
+        c = self.peek()
+        if c == "{":
+            return self.object()
+        if c == "[":
+            return self.array()
+        if c in "\"'":
+            return self.string()
+        return self.literal()
+
+    def _stop(self):
+        """Marks the answer incomplete; the caller returns what it has."""
+        self.complete = False
+
+    def object(self):
+        self.pos += 1
+        result = {}
+        while True:
+            try:
+                c = self.peek()
+                if c == "}":
+                    self.pos += 1
+                    return result
+                if c == ",":
+                    self.pos += 1
+                    continue
+                key = self.string() if c in "\"'" else self.bare_key()
+                if self.peek() != ":":
+                    raise ValueError(f"expected ':' at {self.pos}")
+                self.pos += 1
+                value = self.value()
+            except (_Truncated, ValueError):
+                self._stop()
+                return result
+            if self.complete or isinstance(value, (dict, list)):
+                result[key] = value
+            if not self.complete:
+                return result
+
+    def array(self):
+        self.pos += 1
+        result = []
+        while True:
+            try:
+                c = self.peek()
+                if c == "]":
+                    self.pos += 1
+                    return result
+                if c == ",":
+                    self.pos += 1
+                    continue
+                value = self.value()
+            except (_Truncated, ValueError):
+                self._stop()
+                return result
+            if not self.complete:
+                return result   # The element was cut off part way
+            result.append(value)
+
+    def string(self):
+        text, n = self.text, len(self.text)
+        quote = text[self.pos]
+        self.pos += 1
+        parts = []
+        while True:
+            end = self.pos
+            while end < n and text[end] not in (quote, "\\"):
+                end += 1
+            parts.append(text[self.pos:end])
+            if end >= n:
+                raise _Truncated()
+            if text[end] == quote:
+                self.pos = end + 1
+                return "".join(parts)
+            if end + 1 >= n:
+                raise _Truncated()
+            escape = text[end + 1]
+            if escape == "u":
+                digits = text[end + 2:end + 6]
+                if len(digits) < 4:
+                    raise _Truncated()
+                try:
+                    parts.append(chr(int(digits, 16)))
+                except ValueError:
+                    parts.append("\\u" + digits)
+                self.pos = end + 6
+            else:
+                parts.append(_ESCAPES.get(escape, escape))
+                self.pos = end + 2
+
+    def _word(self):
+        text, n = self.text, len(self.text)
+        end = self.pos
+        while end < n and text[end] not in _DELIMITERS:
+            end += 1
+        if end >= n:
+            raise _Truncated()   # A number or word may continue past the end
+        word, self.pos = text[self.pos:end], end
+        return word
+
+    def bare_key(self):
+        word = self._word()
+        if not word:
+            raise ValueError(f"unexpected {self.text[self.pos]!r} at {self.pos}")
+        return word
+
+    def literal(self):
+        start = self.pos
+        word = self._word()
+        if word in _LITERALS:
+            return _LITERALS[word]
+        try:
+            return json.loads(word)
+        except ValueError:
+            self.pos = start
+            raise ValueError(f"unexpected {word[:20]!r} at {start}")
+
+
+def _strip_fences(text):
+    match = _FENCE_RE.search(text)
+    return match.group(1) if match else text
+
+def _next_start(text, pos):
+    starts = [i for i in (text.find("{", pos), text.find("[", pos)) if i >= 0]
+    return min(starts) if starts else -1
+
+def salvage_json(text):
+    """
+    (value, complete) for a model answer: value is the first JSON object or array in
+    text, repaired as described above, or None when there is none; complete is False
+    when anything had to be dropped because the answer stopped or broke off.
+    """
+    if not isinstance(text, str):
+        return None, False
+    body = _strip_fences(text.strip())
+    try:
+        value = json.loads(body)
+        if isinstance(value, (dict, list)):
+            return value, True
+    except ValueError:
+        pass
+    best = None
+    start = _next_start(body, 0)
+    for _ in range(5):   # "[Note] {...}": try the next bracket when one yields nothing
+        if start < 0:
+            break
+        parser = _Parser(body, start)
+        value = parser.value()
+        if value or parser.complete:
+            return value, parser.complete
+        best = best or (value, False)
+        start = _next_start(body, start + 1)
+    return best or (None, False)
+
+def loads_tolerant(text):
+    """The salvaged value of an answer; raises ValueError when nothing could be salvaged."""
+    value, _ = salvage_json(text)
+    if value is None:
+        raise ValueError("no JSON object or array in the response")
+    return value
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+from abc import ABC, abstractmethod
+from utils.batch_jobs import GenaiBatchBackend, LocalBatchBackend
+from utils.context_cache import GenaiCacheBackend, LocalCacheBackend
+from utils.request_governor import estimate_tokens
+
+# Model backends behind utils.llm_helper.
+#
+# A backend turns (model, prompt, config) into a Completion; llm_helper wraps it with the
+# response cache, the request governor and the context cache. GenaiBackend calls the
+# Gemini API. SimulatedBackend answers locally with schema-valid canned JSON after a
+# simulated delay, so the grading pipeline's throughput and concurrency can be measured
+# offline (see bench_grading_throughput.py).
+#
+# Settings (environment):
+#   GRADER_LLM_BACKEND=genai|simulated   (default genai)
+#   GEMINI_API_KEY=key                   for genai
+#   GRADER_SIM_LATENCY=seconds           simulated median time to first token (default 0.8)
+#   GRADER_SIM_JITTER=sigma              spread of the lognormal latency (default 0.5)
+#   GRADER_SIM_TPS=n                     simulated output tokens per second (default 150)
+#   GRADER_SIM_ERROR_RATE=p              share of calls failing with a 503 (default 0)
+#   GRADER_SIM_RATE_LIMIT_RATE=p         share of calls failing with a 429 (default 0)
+#   GRADER_SIM_TRUNCATE_RATE=p           share of answers cut off part way (default 0)
+#   GRADER_SIM_SEED=n                    repeatable delays and failures
+
+
+class Completion:
+    """The text of a model answer and its prompt tokens (None when unknown)."""
+
+    def __init__(self, text, tokens=None):
+        self.text = text
+        self.tokens = tokens
+
+
+class LLMBackend(ABC):
+    """
+    The protocol llm_helper talks to:
+      generate(model, contents, config=None) -> Completion
+      async generate_async(model, contents, config=None) -> Completion
+      caches: a context-cache backend (create/refresh/delete, see utils.context_cache),
+              or None when prefixes can't be cached.
+      batches: a batch-job backend (submit/poll/results, see utils.batch_jobs),
+               or None when requests can't be batched.
+    config is a generate_content config dict; config['cached_content'] names a cache
+    created through caches that holds the start of the prompt.
+    Failures raise exceptions that utils.request_governor.classify_error understands.
+    """
+
+    caches = None
+    batches = None
+
+    @abstractmethod
+    def generate(self, model, contents, config=None):
+        pass
+
+    async def generate_async(self, model, contents, config=None):
+        return await asyncio.to_thread(self.generate, model, contents, config)
+
+
+def _usage_tokens(response):
+    # Prompt tokens only, the unit GRADER_LLM_TPM is counted in (see utils.request_governor)
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, 'prompt_token_count', None)
+
+
+class GenaiBackend(LLMBackend):
+    """
+    The Gemini API through google-genai (client may be given, e.g. a fake in tests).
+    google.genai is imported, and the client built, when the backend is first used.
+    """
+
+    def __init__(self, api_key=None, client=None):
+        if client is None:
+            from google import genai  # about 0.4 s of imports, so not at module load
+            # Without a key every call fails with an authentication error
+            client = genai.Client(api_key=api_key or os.environ.get('GEMINI_API_KEY') or "MISSING_API_KEY")
+        self.client = client
+        self.caches = GenaiCacheBackend(client)
+        self.batches = GenaiBatchBackend(client)
+
+    def _kwargs(self, model, contents, config):
+        kwargs = {'model': model, 'contents': contents}
+        if config is not None:
+            kwargs['config'] = config
+        return kwargs
+
+    def generate(self, model, contents, config=None):
+        response = self.client.models.generate_content(**self._kwargs(model, contents, config))
+        return Completion(response.text, _usage_tokens(response))
+
+    async def generate_async(self, model, contents, config=None):
+        response = await self.client.aio.models.generate_content(**self._kwargs(model, contents, config))
+        return Completion(response.text, _usage_tokens(response))
+
+
+class SimulatedError(Exception):
+    """A simulated API failure; code is the HTTP status (see classify_error)."""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+_KEY_RE = re.compile(r"the criterion's '(\w+)'")
+_TOTAL_RE = re.compile(r'MUST EXACTLY EQUAL (\d+(?:\.\d+)?)')
+
+
+def _json_after(text, marker):
+    """The JSON value that follows marker in text, or None."""
+    start = text.find(marker)
+    if start < 0:
+        return None
+    rest = text[start + len(marker):].lstrip()
+    try:
+        return json.JSONDecoder().raw_decode(rest)[0]
+    except ValueError:
+        return None
+
+def _criteria(rubric):
+    if isinstance(rubric, dict) and "tasks" in rubric:
+        return [c for task in rubric["tasks"] for c in task.get("criteria", [])]
+    return [c for c in rubric if isinstance(c, dict)] if isinstance(rubric, list) else []
+
+
+class SimulatedBackend(LLMBackend):
+    """
+    Local stand-in for the API. Each call waits a lognormal latency (median latency,
+    sigma jitter) plus the answer's tokens / tokens_per_second, then returns canned JSON
+    in the schema the prompt asks for (grading report, manual-review verdicts, comparison
+    or rubric). error_rate / rate_limit_rate of the calls fail with a 503 / 429 instead,
+    and truncate_rate of the answers stop half way, like a response hitting its limit.
+    Context caches are kept in memory (caches is a LocalCacheBackend) and batch jobs
+    are answered through generate in GRADER_BATCH_DIR (batches is a LocalBatchBackend).
+    """
+
+    def __init__(self, latency=0.8, jitter=0.5, tokens_per_second=150.0, error_rate=0.0, rate_limit_rate=0.0,
+                 truncate_rate=0.0, seed=None, sleep=time.sleep, async_sleep=asyncio.sleep):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.truncate_rate = truncate_rate
+        self.random = random.Random(seed)
+        self.sleep = sleep
+        self.async_sleep = async_sleep
+        self.caches = LocalCacheBackend()
+        self.batches = LocalBatchBackend(self.generate)
+        self.counts = {"calls": 0, "errors": 0, "in_flight": 0, "peak_in_flight": 0,
+                       "input_tokens": 0, "output_tokens": 0}
+        self._lock = threading.Lock()
+
+    def respond(self, prompt):
+        """The canned answer to a prompt."""
+        if "STUDENT SUBMISSION DATA" in prompt:
+            results = [{"_id": c.get("_id"), "obtainedPoints": c.get("points", 0),
+                        "explanation": "Your workbook meets this criterion.",
+                        "evidence": "Simulated response.", "achievedLevel": "Correct"}
+                       for c in _criteria(_json_after(prompt, "GRADING CRITERIA (Follow IDs and points exactly):"))]
+            if "FOLLOW-UP:" in prompt:
+                wanted = set(_json_after(prompt, "criterion _ids:") or [])
+                return json.dumps({"result": [r for r in results if str(r["_id"]) in wanted]})
+            earned = sum(float(r["obtainedPoints"] or 0) for r in results)
+            return json.dumps({"summary": "Simulated grading.", "score": {"earned": earned, "max": earned, "letter": "A"},
+                               "result": results, "incorrect_cells": []})
+        if "CRITERIA TO EVALUATE:" in prompt:
+            match = _KEY_RE.search(prompt)
+            key = match.group(1) if match else "description"
+            criteria = _json_after(prompt, "CRITERIA TO EVALUATE:") or []
+            return json.dumps([{"id": str(c.get(key)), "passed": True, "feedback": "Simulated review."}
+                               for c in criteria if isinstance(c, dict)])
+        if "Compare the STUDENT workbook to the ANSWER KEY" in prompt:
+            return json.dumps({"passed": True, "score": 100, "incorrect_cells": [], "comments": "Simulated comparison."})
+        match = _TOTAL_RE.search(prompt)
+        if match:
+            total = float(match.group(1))
+            return json.dumps([{"_id": f"SIM_{i}", "name": f"Criterion {i}", "points": total / 2,
+                                "sub_criteria": [{"level": "Correct", "desc": "Done", "pts": total / 2},
+                                                 {"level": "Incorrect", "desc": "Missing", "pts": 0}]}
+                               for i in (1, 2)])
+        return "{}"
+
+    def _start(self, model, contents, config):
+        """Resolves the prompt, draws the outcome; returns (delay, completion or error)."""
+        name = (config or {}).get("cached_content")
+        prompt = contents if isinstance(contents, str) else json.dumps(contents, default=str)
+        if name:
+            try:
+                prompt = self.caches.resolve(name) + prompt
+            except KeyError:
+                return 0.0, SimulatedError(404, f"cached content {name} not found")
+        with self._lock:
+            self.counts["calls"] += 1
+            roll = self.random.random()
+            delay = self.random.lognormvariate(0.0, self.jitter) * self.latency if self.latency > 0 else 0.0
+        if roll < self.rate_limit_rate:
+            return delay / 4, SimulatedError(429, "RESOURCE_EXHAUSTED (simulated)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            return delay, SimulatedError(503, "UNAVAILABLE (simulated)")
+        text = self.respond(prompt)
+        if roll > 1.0 - self.truncate_rate:
+            text = text[:len(text) // 2]
+        input_tokens, output_tokens = estimate_tokens(prompt), estimate_tokens(text)
+        if self.tokens_per_second:
+            delay += output_tokens / self.tokens_per_second
+        with self._lock:
+            self.counts["input_tokens"] += input_tokens
+            self.counts["output_tokens"] += output_tokens
+        return delay, Completion(text, input_tokens)
+
+    def _enter(self):
+        with self._lock:
+            self.counts["in_flight"] += 1
+            self.counts["peak_in_flight"] = max(self.counts["peak_in_flight"], self.counts["in_flight"])
+
+    def _leave(self, outcome):
+        with self._lock:
+            self.counts["in_flight"] -= 1
+            if isinstance(outcome, Exception):
+                self.counts["errors"] += 1
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def generate(self, model, contents, config=None):
+        self._enter()
+        delay, outcome = self._start(model, contents, config)
+        self.sleep(delay)
+        return self._leave(outcome)
+
+    async def generate_async(self, model, contents, config=None):
+        self._enter()
+        delay, outcome = self._start(model, contents, config)
+        await self.async_sleep(delay)
+        return self._leave(outcome)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+_default_backend = None
+
+def get_backend():
+    """The process-wide backend, chosen by GRADER_LLM_BACKEND on first use."""
+    global _default_backend
+    if _default_backend is None:
+        if os.environ.get('GRADER_LLM_BACKEND', 'genai') == 'simulated':
+            seed = os.environ.get('GRADER_SIM_SEED')
+            _default_backend = SimulatedBackend(
+                latency=float(os.environ.get('GRADER_SIM_LATENCY', 0.8)),
+                jitter=float(os.environ.get('GRADER_SIM_JITTER', 0.5)),
+                tokens_per_second=float(os.environ.get('GRADER_SIM_TPS', 150)),
+                error_rate=float(os.environ.get('GRADER_SIM_ERROR_RATE', 0)),
+                rate_limit_rate=float(os.environ.get('GRADER_SIM_RATE_LIMIT_RATE', 0)),
+                truncate_rate=float(os.environ.get('GRADER_SIM_TRUNCATE_RATE', 0)),
+                seed=int(seed) if seed else None
+            )
+        else:
+            _default_backend = GenaiBackend()
+    return _default_backend
+
+def set_backend(backend):
+    """Installs backend for every later call; returns the previous one (None if none was made yet)."""
+    global _default_backend
+    previous, _default_backend = _default_backend, backend
+    return previous
@@ -1,16 +1,20 @@
-import re
-from google import genai
+import asyncio
 import os
-import json
-
-# Configure API Key securely via environment variable
-api_key = os.environ.get('GEMINI_API_KEY')
-if not api_key:
-    # Use a placeholder or raise an error in a production environment
-    # For Streamlit, this will prompt the user to configure secrets
-    api_key = "MISSING_API_KEY"
-
-client = genai.Client(api_key=api_key)
+from utils.context_cache import get_context_cache
+from utils.diff_engine import diff_workbooks
+from utils.json_repair import loads_tolerant, salvage_json
+from utils.llm_backend import get_backend
+from utils.prompt_encoding import ENCODING_NOTE, compact_json, encode_for_prompt
+from utils.request_governor import classify_error, estimate_tokens, get_governor
+from utils.response_cache import get_response_cache
+from utils.response_schemas import (COMPARISON_SCHEMA, GRADING_SCHEMA, MANUAL_REVIEW_SCHEMA, RESULTS_SCHEMA,
+                                    RUBRIC_SCHEMA, json_config)
+
+# Models (environment): GRADER_MODEL grades, compares and writes rubrics,
+# GRADER_REVIEW_MODEL checks manual_review criteria. The API itself is behind
+# utils.llm_backend (GRADER_LLM_BACKEND, GEMINI_API_KEY).
+GRADING_MODEL = os.environ.get('GRADER_MODEL', 'gemini-2.0-flash')
+REVIEW_MODEL = os.environ.get('GRADER_REVIEW_MODEL', 'gemini-3-flash-preview')
 
 ATOMIC_RUBRIC_PROMPT = """
 You are an expert Education Consultant specializing in Technical & Data Assessment.
@@ -71,33 +75,122 @@ RULES:
 7. Return ONLY clean JSON.
 """
 
-def clean_json_response(text):
+def _check_json(text):
     """
-    Cleans an LLM response to extract valid JSON.
+    Raises unless some JSON can be salvaged from the response (used to keep unusable
+    answers out of the cache; a cut-off answer is kept, so its follow-up replays too).
     """
-    text = text.strip()
-    
-    # 1. Handle Markdown blocks
-    if "```json" in text:
-        match = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL)
-        if match:
-             text = match.group(1).strip()
-    elif "```" in text:
-        text = text.replace('```', '').strip()
-        
-    # 2. Basic cleanup for common LLM JSON errors
-    # - Remove potential trailing commas before closing braces/brackets
-    text = re.sub(r',\s*([}\]])', r'\1', text)
-    
-    return text
+    loads_tolerant(text)
 
-def generate_structured_rubric(context_text, total_points, guidelines="", strategy="holistic"):
+def _usage_tokens(completion):
+    return completion.tokens
+
+def _request(contents, config, prefix, cache_name):
+    """(contents, config) to send; with a context cache only the part after the prefix is sent."""
+    if cache_name:
+        return contents, dict(config or {}, cached_content=cache_name)
+    return (prefix + contents if prefix else contents), config
+
+def generate_text(model, contents, config=None, validate=_check_json, use_cache=True, prefix=None):
     """
-    Generates a structured JSON rubric based on the chosen strategy (atomic or holistic).
+    Returns the text of the model's answer (see utils.llm_backend), served from the response
+    cache when the same model, config and prompt were seen before (see utils.response_cache).
+    use_cache=False, or GRADER_LLM_CACHE=0, always calls the model.
+    Calls are paced and retried by the shared governor (see utils.request_governor).
+    prefix: static start of the prompt shared by many calls, sent through an explicit
+    context cache when it is large enough (see utils.context_cache); contents follows it.
     """
+    prompt = prefix + contents if prefix else contents
+    tokens = estimate_tokens(str(prompt))
+    def send(cache_name):
+        backend = get_backend()
+        request, request_config = _request(contents, config, prefix, cache_name)
+        return get_governor().call(lambda: backend.generate(model, request, request_config),
+                                   tokens=tokens, usage=_usage_tokens).text
+    def call():
+        context_cache = get_context_cache()
+        cache_name = context_cache.lookup(model, prefix) if prefix else None
+        try:
+            return send(cache_name)
+        except Exception as e:
+            if not cache_name or classify_error(e) != "client":
+                raise
+            context_cache.invalidate(model, prefix)   # Expired or deleted on the server
+            return send(None)
+    return get_response_cache().fetch(model, prompt, config, call, validate=validate, use_cache=use_cache)
+
+async def generate_text_async(model, contents, config=None, validate=_check_json, use_cache=True, prefix=None):
+    """generate_text through the backend's generate_async; the caches and governor are shared."""
+    prompt = prefix + contents if prefix else contents
+    tokens = estimate_tokens(str(prompt))
+    async def send(cache_name):
+        backend = get_backend()
+        request, request_config = _request(contents, config, prefix, cache_name)
+        completion = await get_governor().call_async(lambda: backend.generate_async(model, request, request_config),
+                                                     tokens=tokens, usage=_usage_tokens)
+        return completion.text
+    async def call():
+        context_cache = get_context_cache()
+        cache_name = await asyncio.to_thread(context_cache.lookup, model, prefix) if prefix else None
+        try:
+            return await send(cache_name)
+        except Exception as e:
+            if not cache_name or classify_error(e) != "client":
+                raise
+            context_cache.invalidate(model, prefix)
+            return await send(None)
+    return await get_response_cache().fetch_async(model, prompt, config, call, validate=validate, use_cache=use_cache)
+
+def _drive(steps):
+    """
+    Runs a request loop written as a generator (e.g. _rubric_steps): each (model, contents,
+    config) it yields goes through generate_text and the answer text, or the exception,
+    is sent back. Returns what the generator returns.
+    """
+    outcome = None
+    try:
+        while True:
+            model, contents, config = steps.send(outcome)
+            try:
+                outcome = generate_text(model, contents, config)
+            except Exception as e:
+                outcome = e
+    except StopIteration as done:
+        return done.value
+
+async def _drive_async(steps):
+    """_drive through generate_text_async."""
+    outcome = None
+    try:
+        while True:
+            model, contents, config = steps.send(outcome)
+            try:
+                outcome = await generate_text_async(model, contents, config)
+            except Exception as e:
+                outcome = e
+    except StopIteration as done:
+        return done.value
+
+def _answer_text(outcome):
+    """The answer text sent back by _drive; raises the exception the request failed with."""
+    if isinstance(outcome, Exception):
+        raise outcome
+    return outcome
+
+def _rubric_config(temperature):
+    return json_config(RUBRIC_SCHEMA, temperature=temperature)
+
+def _rubric_answer(text, last_attempt):
+    """The rubric in the answer; a cut-off rubric is asked for again, unless this was the last try."""
+    value, complete = salvage_json(text)
+    if value is None or not (complete or last_attempt):
+        raise ValueError("incomplete rubric JSON" if value is not None else "no JSON in the response")
+    return value
+
+def _generation_prompt(context_text, total_points, guidelines, strategy):
     base_prompt = ATOMIC_RUBRIC_PROMPT if strategy == "atomic" else HOLISTIC_RUBRIC_PROMPT
-    
-    prompt = f"""
+
+    return f"""
     {base_prompt.format(total_points=total_points)}
     
     BASELINE MATERIALS (Context):
@@ -108,37 +201,45 @@ def generate_structured_rubric(context_text, total_points, guidelines="", strate
     CUSTOMIZATION GUIDELINES (Optional):
     {guidelines}
     """
-    
+
+def _rubric_steps(prompt, temperature, action):
+    """The request loop of rubric generation / refinement (action: "generate" or "refine"), for _drive."""
+    label = "Generation" if action == "generate" else "Refinement"
     for attempt in range(3):
         try:
-            response = client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=prompt,
-                config={
-                    'temperature': 0.2 + (attempt * 0.1), # Increase temperature slightly on retry
-                    'response_mime_type': 'application/json'
-                }
-            )
-            text = clean_json_response(response.text)
-            return json.loads(text)
-        except Exception as e:
-            print(f"Rubric Generation Error (Attempt {attempt+1}): {e}")
+            # Increase temperature slightly on retry
+            outcome = yield GRADING_MODEL, prompt, _rubric_config(temperature + attempt * 0.1)
+            return _rubric_answer(_answer_text(outcome), attempt == 2)
+        except ValueError as e:
+            # Nothing usable, or cut off: ask again (API errors were already retried by the governor)
+            print(f"Rubric {label} Error (Attempt {attempt+1}): {e}")
             if attempt == 2:
-                return [{"error": f"Failed to generate rubric after 3 attempts: {str(e)}"}]
+                return [{"error": f"Failed to {action} rubric after 3 attempts: {str(e)}"}]
+        except Exception as e:
+            print(f"Rubric {label} Error: {e}")
+            return [{"error": f"Failed to {action} rubric: {str(e)}"}]
 
-def refine_structured_rubric(current_rubric, feedback, context_text, total_points, strategy="holistic"):
+def generate_structured_rubric(context_text, total_points, guidelines="", strategy="holistic"):
     """
-    Refines an existing rubric based on user feedback.
+    Generates a structured JSON rubric based on the chosen strategy (atomic or holistic).
     """
+    prompt = _generation_prompt(context_text, total_points, guidelines, strategy)
+    return _drive(_rubric_steps(prompt, 0.2, "generate"))
+
+async def generate_structured_rubric_async(context_text, total_points, guidelines="", strategy="holistic"):
+    prompt = _generation_prompt(context_text, total_points, guidelines, strategy)
+    return await _drive_async(_rubric_steps(prompt, 0.2, "generate"))
+
+def _refinement_prompt(current_rubric, feedback, context_text, total_points, strategy):
     base_prompt = ATOMIC_RUBRIC_PROMPT if strategy == "atomic" else HOLISTIC_RUBRIC_PROMPT
-    
-    prompt = f"""
+
+    return f"""
     {base_prompt.format(total_points=total_points)}
     
     GOAL: REFINE the existing rubric based on feedback while maintaining the overall strategy ({strategy}).
     
     CURRENT RUBRIC:
-    {json.dumps(current_rubric, indent=2)}
+    {compact_json(current_rubric)}
     
     USER FEEDBACK:
     {feedback}
@@ -146,23 +247,17 @@ def refine_structured_rubric(current_rubric, feedback, context_text, total_point
     BASELINE MATERIALS (Context):
     {context_text}
     """
-    
-    for attempt in range(3):
-        try:
-            response = client.models.generate_content(
-                model='gemini-2.0-flash',
-                contents=prompt,
-                config={
-                    'temperature': 0.1 + (attempt * 0.1),
-                    'response_mime_type': 'application/json'
-                }
-            )
-            text = clean_json_response(response.text)
-            return json.loads(text)
-        except Exception as e:
-            print(f"Rubric Refinement Error (Attempt {attempt+1}): {e}")
-            if attempt == 2:
-                return [{"error": f"Failed to refine rubric after 3 attempts: {str(e)}"}]
+
+def refine_structured_rubric(current_rubric, feedback, context_text, total_points, strategy="holistic"):
+    """
+    Refines an existing rubric based on user feedback.
+    """
+    prompt = _refinement_prompt(current_rubric, feedback, context_text, total_points, strategy)
+    return _drive(_rubric_steps(prompt, 0.1, "refine"))
+
+async def refine_structured_rubric_async(current_rubric, feedback, context_text, total_points, strategy="holistic"):
+    prompt = _refinement_prompt(current_rubric, feedback, context_text, total_points, strategy)
+    return await _drive_async(_rubric_steps(prompt, 0.1, "refine"))
 
 EDVISOR_GRADING_SYSTEM_PROMPT = """
 You are an expert grading system with expertise across all subjects. Your goal is to apply consistent, fair grading standards that align with established educational assessment principles.
@@ -210,60 +305,108 @@ Within each response, identify ALL core points, claims, and information provided
 5. **Decimals**: Respect that point values can be decimals (e.g., 0.5, 2.75).
 """
 
-def grade_manual_review_batch(sheet_text_content, criteria_list):
-    """
-    Sends a batch of criteria to Gemini to evaluate against the sheet content.
-    Returns a dict mapping criteria_description -> {points, feedback, passed}
-    """
-    
-    prompt = f"""
+def _manual_review_prompt(sheet_text_content, criteria_list, key):
+    return f"""
     You are an expert Excel Grader. 
     I will provide you with the raw text content of an Excel worksheet (extracted from XML).
     Your task is to evaluate a list of grading criteria against this data.
     
+    {ENCODING_NOTE}
     DATA START:
     {sheet_text_content}
     DATA END
     
     CRITERIA TO EVALUATE:
-    {json.dumps(criteria_list, indent=2)}
+    {compact_json(criteria_list)}
     
     INSTRUCTIONS:
     1. For each criteria, determine if the data satisfies the requirement.
     2. Be lenient with minor spelling differences but strict on logic.
-    3. Return a JSON object where keys are the criteria 'description' and values are an object:
-       {{ "passed": boolean, "feedback": string }}
+    3. Return a JSON array with one object per criterion:
+       {{ "id": the criterion's '{key}', "passed": boolean, "feedback": string }}
     4. Feedback should explain why it passed or failed based on the data seen.
-    5. Return ONLY JSON.
+    5. When a criterion has a 'sheet', judge it against that sheet's section of the data.
+    6. Return ONLY JSON.
     """
-    
-    try:
-        response = client.models.generate_content(
-            model='gemini-3-flash-preview',
-            contents=prompt,
-            config={
-                'temperature': 0    # Very strict/consistent
-            }
-        )
-        text = response.text.strip()
-        
-        # Clean up markdown code blocks if present
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
-            
-        return json.loads(text)
-    except Exception as e:
-        print(f"LLM Error: {e}")
-        # Return fail for all
-        return {}
+
+def _manual_review_verdicts(text):
+    """
+    {id: {"passed", "feedback"}} from an answer (an array per MANUAL_REVIEW_SCHEMA, or an
+    object keyed by criterion); whatever can be salvaged from a cut-off answer counts.
+    """
+    value, _ = salvage_json(text)
+    if isinstance(value, dict):
+        value = [dict(verdict, id=k) for k, verdict in value.items() if isinstance(verdict, dict)]
+    verdicts = {}
+    for item in value if isinstance(value, list) else []:
+        if isinstance(item, dict) and item.get("id") is not None and isinstance(item.get("passed"), bool):
+            verdicts[str(item["id"])] = {"passed": item["passed"], "feedback": item.get("feedback", "")}
+    return verdicts
+
+def _unanswered(criteria_list, key, verdicts):
+    return [c for c in criteria_list if str(c.get(key)) not in verdicts]
+
+MANUAL_REVIEW_CONFIG = json_config(MANUAL_REVIEW_SCHEMA, temperature=0)   # Very strict/consistent
+
+def _manual_review_steps(sheet_text_content, criteria_list, key):
+    """The request loop of grade_manual_review_batch, for _drive."""
+    verdicts, pending = {}, criteria_list
+    for _ in range(2):
+        outcome = yield REVIEW_MODEL, _manual_review_prompt(sheet_text_content, pending, key), MANUAL_REVIEW_CONFIG
+        try:
+            verdicts.update(_manual_review_verdicts(_answer_text(outcome)))
+        except Exception as e:
+            print(f"LLM Error: {e}")
+            break
+        pending = _unanswered(criteria_list, key, verdicts)
+        if not pending:
+            break
+    return verdicts
+
+def grade_manual_review_batch(sheet_text_content, criteria_list, key='description'):
+    """
+    Sends a batch of criteria to the model to evaluate against the sheet content.
+    Returns a dict mapping criteria[key] (the description by default) -> {passed, feedback}.
+    Batches spanning several sheets label each sheet's section and give every criterion a 'sheet'.
+    Criteria the answer leaves out (or cuts off) are asked for once more, on their own;
+    those still missing are left out of the result.
+    """
+    return _drive(_manual_review_steps(sheet_text_content, criteria_list, key))
+
+async def grade_manual_review_batch_async(sheet_text_content, criteria_list, key='description'):
+    return await _drive_async(_manual_review_steps(sheet_text_content, criteria_list, key))
+
+def is_workbook_data(data):
+    """True for a full parse_workbook_to_json output (not text, not a template delta)."""
+    return isinstance(data, dict) and "sheets" in data and not data.get("delta_against_template")
 
 def grade_workbook_comparison(student_data, answer_key_data):
     """
-    Compares student workbook data against answer key data using Gemini.
+    Compares student workbook data against answer key data.
+    Parsed workbooks are compared locally by utils.diff_engine, without a model call;
+    anything else (e.g. a text answer key) is compared by the model.
     """
-    prompt = f"""
+    if is_workbook_data(student_data) and is_workbook_data(answer_key_data):
+        return diff_workbooks(student_data, answer_key_data)
+
+    prompt = _comparison_prompt(student_data, answer_key_data)
+    try:
+        return _comparison_answer(generate_text(GRADING_MODEL, prompt, COMPARISON_CONFIG))
+    except Exception as e:
+        return _comparison_failure(e)
+
+async def grade_workbook_comparison_async(student_data, answer_key_data):
+    if is_workbook_data(student_data) and is_workbook_data(answer_key_data):
+        return diff_workbooks(student_data, answer_key_data)
+
+    prompt = _comparison_prompt(student_data, answer_key_data)
+    try:
+        return _comparison_answer(await generate_text_async(GRADING_MODEL, prompt, COMPARISON_CONFIG))
+    except Exception as e:
+        return _comparison_failure(e)
+
+def _comparison_prompt(student_data, answer_key_data):
+    return f"""
     You are an Excel Homework Auto-Grader.
     Compare the STUDENT workbook to the ANSWER KEY workbook.
 
@@ -297,55 +440,102 @@ def grade_workbook_comparison(student_data, answer_key_data):
     
     ----
     STUDENT WORKBOOK:
-    {json.dumps(student_data, indent=2)}
+    {encode_for_prompt(student_data)}
     
     ANSWER KEY WORKBOOK:
-    {json.dumps(answer_key_data, indent=2)}
+    {encode_for_prompt(answer_key_data)}
     """
-    
-    try:
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=prompt
-        )
-        text = response.text.strip()
-        
-        if text.startswith("```json"):
-            text = text[7:]
-        if text.endswith("```"):
-            text = text[:-3]
-            
-        return json.loads(text)
-    except Exception as e:
-        return {
-            "passed": False,
-            "score": 0,
-            "comments": f"Error during AI comparison: {str(e)}",
-            "incorrect_cells": []
-        }
+
+COMPARISON_CONFIG = json_config(COMPARISON_SCHEMA)
+
+def _comparison_answer(text):
+    """The comparison in the answer, with defaults for fields a cut-off answer lost."""
+    value = loads_tolerant(text)
+    if not isinstance(value, dict):
+        raise ValueError("expected a JSON object")
+    return dict({"passed": False, "score": 0, "incorrect_cells": [], "comments": ""}, **value)
+
+def _comparison_failure(e):
+    return {
+        "passed": False,
+        "score": 0,
+        "comments": f"Error during AI comparison: {str(e)}",
+        "incorrect_cells": []
+    }
 
 
 
-def grade_student_work(student_data, rubric_data=None, answer_key_data=None):
+def flatten_rubric(rubric_data):
     """
-    Unified AI Grading Function.
-    
-    Modes:
-    1. Hybrid (Rubric + Key): Use Key for truth, Rubric for structure/points.
-    2. Rubric Only: Use Rubric descriptions to grade Student data.
-    3. Key Only: Use Key for truth, assign generic score.
+    The criteria of a rubric as a flat list: task-based rubrics ({"tasks": [...]}) are
+    flattened, lists are returned as is, text rubrics have no structured criteria.
+    """
+    if isinstance(rubric_data, dict) and "tasks" in rubric_data:
+        return [crit for task in rubric_data["tasks"] for crit in task.get("criteria", [])]
+    if isinstance(rubric_data, list):
+        return rubric_data
+    return []
+
+def map_results_to_ui(results, flat_rubric):
+    """
+    Maps Edvisor 'result' entries to the UI's 'criteria' list
+    ({name, earned, max, feedback, achievedLevel}), taking names and points from the rubric.
+    """
+    by_id = {}
+    for r_item in flat_rubric:
+        if isinstance(r_item, dict):
+            by_id.setdefault(str(r_item.get('_id')), r_item)
+    ui_criteria = []
+    for res in results:
+        # Find the original name from the rubric if possible for better UI display
+        r_item = by_id.get(str(res.get('_id')))
+        name = "Criterion"
+        max_pts = 0
+        if r_item is not None:
+            name = r_item.get('name') or r_item.get('description', 'Criterion')
+            max_pts = r_item.get('points', 0)
+
+        ui_criteria.append({
+            "name": name,
+            "earned": res.get('obtainedPoints', 0),
+            "max": max_pts,
+            "feedback": f"{res.get('explanation', '')}\n\n**Evidence Found:** {res.get('evidence', 'N/A')}",
+            "achievedLevel": res.get('achievedLevel')
+        })
+    return ui_criteria
+
+def _student_work_prompt(student_data, rubric_data, answer_key_data, key_diff):
+    """
+    Builds the grading prompt. Returns (prefix, suffix, flat_rubric, key_diff): the prefix
+    is the same for every submission of an assignment (instructions, schema, rubric, answer
+    key) and is context-cached; the suffix holds this submission's diff and data.
     """
     
     context_instruction = ""
     context_data = ""
+    diff_data = ""
     
     
-    def format_data(data):
-        if isinstance(data, (dict, list)):
-            return json.dumps(data, indent=2)
-        return str(data)
+    format_data = encode_for_prompt
+
+    if key_diff is None and answer_key_data and is_workbook_data(student_data) and is_workbook_data(answer_key_data):
+        key_diff = diff_workbooks(student_data, answer_key_data)
+
+    if rubric_data and answer_key_data and key_diff is not None:
+        mode = "HYBRID"
+        context_instruction = """
+        The student's workbook was already compared cell by cell against an ANSWER KEY (Gold Standard).
+        1. The ANSWER KEY DIFF lists every value, formula, style, chart, validation and sparkline that does NOT match the key. Anything not listed matches the key exactly.
+        2. Items under 'review' compute the right result with a different formula; decide whether they satisfy the rubric.
+        3. Use the RUBRIC to organize your output and assign points.
+        4. You must strictly follow the Rubric's point allocations.
+        5. Deduct points only for rubric items affected by the listed discrepancies, and cite them as evidence.
+        6. Return an empty "incorrect_cells" array; it is filled in from the diff.
+        """
+        context_data = f"RUBRIC:\n{format_data(rubric_data)}"
+        diff_data = f"ANSWER KEY DIFF:\n{format_data({k: key_diff[k] for k in ('incorrect_cells', 'review', 'comments')})}\n\n    "
 
-    if rubric_data and answer_key_data:
+    elif rubric_data and answer_key_data:
         mode = "HYBRID"
         context_instruction = """
         You are provided with an ANSWER KEY (Gold Standard) and a RUBRIC.
@@ -353,8 +543,8 @@ def grade_student_work(student_data, rubric_data=None, answer_key_data=None):
         2. Use the RUBRIC to organize your output and assign points.
         3. You must strictly follow the Rubric's point allocations.
         4. Be precise: detect formula mismatches, value errors, and logic discrepancies.
-        5. VERTICAL VERIFICATION: Check the 'metadata' -> 'drawings' section. It now contains 'details' for charts, including chart 'type' (e.g. barChart, scatterChart), axis 'min'/'max'/'major_unit', and 'series' data ranges. Use this to verify formatting requirements exactly.
-        6. DEEP STYLE VERIFICATION: Each cell now has a 'style' field with 'fill' (shading), 'border' (separator lines), and 'num_fmt' (currency/percentage). Use this to verify if the student correctly applied formatting like Bold, borders, or specific shading.
+        5. VERTICAL VERIFICATION: Check the METADATA 'drawings' section of each sheet. It contains 'details' for charts, including chart 'type' (e.g. barChart, scatterChart), axis 'min'/'max'/'major_unit', and 'series' data ranges. Use this to verify formatting requirements exactly.
+        6. DEEP STYLE VERIFICATION: A cell's [sN] tag refers to its style in the STYLES legend, with 'fill' (shading), 'border' (separator lines), and 'num_fmt' (currency/percentage). Use this to verify if the student correctly applied formatting like Bold, borders, or specific shading.
         """
         context_data = f"RUBRIC:\n{format_data(rubric_data)}\n\nANSWER KEY:\n{format_data(answer_key_data)}"
         
@@ -369,8 +559,8 @@ def grade_student_work(student_data, rubric_data=None, answer_key_data=None):
            - Actual formulas (e.g., "=VLOOKUP(...)")
            - Newly entered data in expected sheets.
            - Presence of charts or pivot tables in the metadata.
-        5. DEEP CHART VERIFICATION: Check the 'metadata' -> 'drawings' section. It contains 'details' with the exact chart 'type', axis scales ('min', 'max', 'major_unit'), and legend positions. Use these to verify if the student actually changed the formatting as required.
-        6. DEEP STYLE VERIFICATION: Each cell now has a 'style' field with 'fill' (shading), 'border' (separator lines), and 'num_fmt' (currency/percentage). Use these to verify if shading/borders were removed or if number formats were correctly adjusted as per the rubric.
+        5. DEEP CHART VERIFICATION: Check the METADATA 'drawings' section of each sheet. It contains 'details' with the exact chart 'type', axis scales ('min', 'max', 'major_unit'), and legend positions. Use these to verify if the student actually changed the formatting as required.
+        6. DEEP STYLE VERIFICATION: A cell's [sN] tag refers to its style in the STYLES legend, with 'fill' (shading), 'border' (separator lines), and 'num_fmt' (currency/percentage). Use these to verify if shading/borders were removed or if number formats were correctly adjusted as per the rubric.
         7. If the submission is just a blank template containing the instructions, the score must be 0.
         """
         context_data = f"RUBRIC:\n{format_data(rubric_data)}"
@@ -400,17 +590,15 @@ def grade_student_work(student_data, rubric_data=None, answer_key_data=None):
     """
 
     # Normalize rubric data to a flat list of criteria if it's the task-based structure
-    flat_rubric = []
-    if isinstance(rubric_data, dict) and "tasks" in rubric_data:
-        for task in rubric_data["tasks"]:
-            flat_rubric.extend(task.get("criteria", []))
-    elif isinstance(rubric_data, list):
-        flat_rubric = rubric_data
-    else:
-        # If it's a string (generic text), we don't have structured IDs
-        flat_rubric = []
-
-    prompt = f"""
+    flat_rubric = flatten_rubric(rubric_data)
+
+    # Submissions graded against a blank template only carry what the student changed
+    delta_instruction = ""
+    if isinstance(student_data, dict) and student_data.get("delta_against_template"):
+        delta_instruction = """
+    10. The STUDENT SUBMISSION DATA is a DELTA against the blank assignment template (as is the ANSWER KEY, if provided): only cells, charts and settings that were added, changed or removed are listed, with 'template:' showing the original. Anything not listed is unchanged template content and is NOT student work. CONTEXT gives nearby row/column labels for orientation."""
+
+    prefix = f"""
     {EDVISOR_GRADING_SYSTEM_PROMPT}
     
     INSTRUCTIONS:
@@ -422,6 +610,7 @@ def grade_student_work(student_data, rubric_data=None, answer_key_data=None):
     6. Provide a global "summary" and "score" representing the entire submission.
     7. For each criterion in the rubric, generate an entry in the "result" array. 
     8. "explanation" MUST be student-centric (use "you", "your answer", "your workbook").
+    9. Sheets listed under SKIPPED SHEETS were not referenced by the rubric and were omitted on purpose. Do NOT treat them as missing work.{delta_instruction}
     
     JSON OUTPUT SCHEMA (MANDATORY):
     {edvisor_schema}
@@ -431,64 +620,191 @@ def grade_student_work(student_data, rubric_data=None, answer_key_data=None):
     
     GRADING CRITERIA (Follow IDs and points exactly):
     {format_data(rubric_data)}
-    
-    STUDENT SUBMISSION DATA:
+    """
+    suffix = f"""
+    {diff_data}STUDENT SUBMISSION DATA:
     {format_data(student_data)}
     
     Output ONLY valid JSON.
     """
+    return prefix, suffix, flat_rubric, key_diff
+
+def _student_work_answer(text):
+    """The report object in an answer, and whether it came through whole."""
+    value, complete = salvage_json(text)
+    if not isinstance(value, dict):
+        raise ValueError("no JSON object in the response")
+    return value, complete
+
+def _graded(answer):
+    return [r for r in answer.get('result') or [] if isinstance(r, dict) and 'obtainedPoints' in r]
+
+def _missing_results(answer, flat_rubric):
+    """_ids of the rubric criteria the answer has no result entry for."""
+    answered = {str(r.get('_id')) for r in _graded(answer)}
+    return [str(c['_id']) for c in flat_rubric
+            if isinstance(c, dict) and c.get('_id') is not None and str(c['_id']) not in answered]
+
+def _follow_up_suffix(suffix, missing):
+    """The grading suffix plus a request for just the missing criteria (the cached prefix is reused)."""
+    return suffix + f"""
+    FOLLOW-UP: Your previous answer left out (or was cut off before) the "result" entries for these criterion _ids:
+    {compact_json(missing)}
+    Grade ONLY these criteria and return {{"result": [...]}} with one entry per _id, in the same format.
+    """
+
+def _merge_follow_up(answer, text, missing, flat_rubric):
+    """Adds the follow-up's entries for the missing _ids to the answer, in rubric order, and rescores it."""
+    value, _ = salvage_json(text)
+    extra = _graded(value) if isinstance(value, dict) else []
+    wanted = set(missing)
+    results = _graded(answer)
+    for entry in extra:
+        if str(entry.get('_id')) in wanted:
+            results.append(entry)
+            wanted.discard(str(entry.get('_id')))
+    order = {str(c.get('_id')): i for i, c in enumerate(flat_rubric) if isinstance(c, dict)}
+    results.sort(key=lambda r: order.get(str(r.get('_id')), len(order)))
+    answer['result'] = results
+
+def letter_grade(percent):
+    for floor, letter in ((90, "A"), (80, "B"), (70, "C"), (60, "D")):
+        if percent >= floor:
+            return letter
+    return "F"
+
+def _rescore(answer, flat_rubric):
+    """Makes the score (and letter) of a cut-off or completed answer match its result entries."""
+    score = answer.get('score') if isinstance(answer.get('score'), dict) else {}
+    score['earned'] = sum(float(r.get('obtainedPoints') or 0) for r in _graded(answer))
+    score.setdefault('max', sum(float(c.get('points') or 0) for c in flat_rubric if isinstance(c, dict)))
+    try:
+        maximum = float(score['max'] or 0)
+    except (TypeError, ValueError):
+        maximum = 0.0
+    score['letter'] = letter_grade(100.0 * score['earned'] / maximum if maximum else 0.0)
+    answer['score'] = score
+    answer.setdefault('summary', "")
+
+def _student_work_report(answer, prompt, flat_rubric, key_diff):
+    """The {"report", "prompt"} result of grade_student_work for the model's (parsed) answer."""
+    result_json = answer
+
+    # --- EDVISOR TO UI MAPPING ---
+    result_json['criteria'] = map_results_to_ui(result_json.get('result', []), flat_rubric)
+    result_json['mode'] = "edvisor_unified"
+    if key_diff is not None:
+        # Deterministic, so it replaces whatever the model listed
+        result_json['incorrect_cells'] = key_diff['incorrect_cells']
+
+    return {
+        "report": result_json,
+        "prompt": prompt
+    }
+
+def _student_work_failure(e, prompt):
+    import traceback
+    print(f"Edvisor Grading Error: {e}")
+    traceback.print_exc()
+    return {
+        "report": {"error": f"Grading failed: {str(e)}"},
+        "prompt": prompt
+    }
+
+GRADING_CONFIG = json_config(GRADING_SCHEMA, temperature=0)
+FOLLOW_UP_CONFIG = json_config(RESULTS_SCHEMA, temperature=0)
+
+def _complete_student_work(answer, complete, missing, follow_up, prompt, flat_rubric, key_diff):
+    """grade_student_work's result from the parsed first answer and the follow-up's text (None if not asked or failed)."""
+    if follow_up is not None:
+        _merge_follow_up(answer, follow_up, missing, flat_rubric)
+    if missing or not complete:
+        _rescore(answer, flat_rubric)
+    return _student_work_report(answer, prompt, flat_rubric, key_diff)
+
+def _finish_student_work(text, prefix, suffix, flat_rubric, key_diff):
+    """grade_student_work's result for the model's first answer; missing criteria are asked for once more."""
+    answer, complete = _student_work_answer(text)
+    missing = _missing_results(answer, flat_rubric)
+    follow_up = None
+    if missing:
+        try:
+            follow_up = generate_text(GRADING_MODEL, _follow_up_suffix(suffix, missing), FOLLOW_UP_CONFIG, prefix=prefix)
+        except Exception as e:
+            print(f"Edvisor Follow-up Error: {e}")
+    return _complete_student_work(answer, complete, missing, follow_up, prefix + suffix, flat_rubric, key_diff)
+
+async def _finish_student_work_async(text, prefix, suffix, flat_rubric, key_diff):
+    """_finish_student_work with the follow-up through generate_text_async."""
+    answer, complete = _student_work_answer(text)
+    missing = _missing_results(answer, flat_rubric)
+    follow_up = None
+    if missing:
+        try:
+            follow_up = await generate_text_async(GRADING_MODEL, _follow_up_suffix(suffix, missing), FOLLOW_UP_CONFIG,
+                                                  prefix=prefix)
+        except Exception as e:
+            print(f"Edvisor Follow-up Error: {e}")
+    return _complete_student_work(answer, complete, missing, follow_up, prefix + suffix, flat_rubric, key_diff)
+
+def grade_student_work(student_data, rubric_data=None, answer_key_data=None, key_diff=None):
+    """
+    Unified AI Grading Function.
     
+    Modes:
+    1. Hybrid (Rubric + Key): Use Key for truth, Rubric for structure/points.
+    2. Rubric Only: Use Rubric descriptions to grade Student data.
+    3. Key Only: Use Key for truth, assign generic score.
+
+    In Hybrid mode with parsed workbooks the answer key is compared locally
+    (utils.diff_engine) and the model only sees the discrepancies, not the whole key.
+    key_diff: a precomputed diff_workbooks(student, key) result, e.g. when the
+    workbooks passed here are already reduced to a template delta.
+    A malformed or cut-off answer is repaired (utils.json_repair); criteria it has no
+    result for are asked for once more on their own instead of regrading everything.
+    """
+    prefix, suffix, flat_rubric, key_diff = _student_work_prompt(student_data, rubric_data, answer_key_data, key_diff)
     try:
-        response = client.models.generate_content(
-            model='gemini-2.0-flash',
-            contents=prompt,
-            config={'temperature': 0}
-        )
-        text = response.text.strip()
-        
-        # Clean markdown
-        if "```json" in text:
-            text = re.search(r'```json\s*(.*?)\s*```', text, re.DOTALL).group(1)
-        elif "```" in text:
-            text = text.replace('```', '')
+        text = generate_text(GRADING_MODEL, suffix, GRADING_CONFIG, prefix=prefix)
+        return _finish_student_work(text, prefix, suffix, flat_rubric, key_diff)
+    except Exception as e:
+        return _student_work_failure(e, prefix + suffix)
 
-        result_json = json.loads(text)
-        
-        # --- EDVISOR TO UI MAPPING ---
-        # Map 'result' to 'criteria' and internal keys for UI compatibility
-        ui_criteria = []
-        for res in result_json.get('result', []):
-            # Find the original name from the rubric if possible for better UI display
-            name = "Criterion"
-            max_pts = 0
-            if flat_rubric:
-                for r_item in flat_rubric:
-                    # Handle both _id and description/name matching
-                    if str(r_item.get('_id')) == str(res.get('_id')):
-                        name = r_item.get('name') or r_item.get('description', 'Criterion')
-                        max_pts = r_item.get('points', 0)
-                        break
-            
-            ui_criteria.append({
-                "name": name,
-                "earned": res.get('obtainedPoints', 0),
-                "max": max_pts,
-                "feedback": f"{res.get('explanation', '')}\n\n**Evidence Found:** {res.get('evidence', 'N/A')}",
-                "achievedLevel": res.get('achievedLevel')
-            })
-        
-        result_json['criteria'] = ui_criteria
-        result_json['mode'] = "edvisor_unified"
-        
-        return {
-            "report": result_json,
-            "prompt": prompt
-        }
+async def grade_student_work_async(student_data, rubric_data=None, answer_key_data=None, key_diff=None):
+    """grade_student_work through the backend's async API, for grading many submissions concurrently."""
+    prefix, suffix, flat_rubric, key_diff = _student_work_prompt(student_data, rubric_data, answer_key_data, key_diff)
+    try:
+        text = await generate_text_async(GRADING_MODEL, suffix, GRADING_CONFIG, prefix=prefix)
+        return await _finish_student_work_async(text, prefix, suffix, flat_rubric, key_diff)
     except Exception as e:
-        import traceback
-        print(f"Edvisor Grading Error: {e}")
-        traceback.print_exc()
-        return {
-            "report": {"error": f"Grading failed: {str(e)}"},
-            "prompt": prompt
-        }
+        return _student_work_failure(e, prefix + suffix)
+
+def student_work_batch_request(student_data, rubric_data=None, answer_key_data=None, key_diff=None):
+    """
+    grade_student_work split around a batch job (see utils.batch_jobs): returns
+    {"prompt", "config", "answer", "finish"}, the whole prompt and config to queue for
+    GRADING_MODEL, the response cache's answer to it (None when it has to be queued) and
+    finish(answer), grade_student_work's result for the answer text or the exception the
+    request failed with. A new answer is cached; a follow-up goes through generate_text.
+    """
+    prefix, suffix, flat_rubric, key_diff = _student_work_prompt(student_data, rubric_data, answer_key_data, key_diff)
+    prompt = prefix + suffix
+    cache = get_response_cache()
+    key = cache.key(GRADING_MODEL, prompt, GRADING_CONFIG)
+    cached = cache.get(key) if cache.enabled else None
+
+    def finish(answer):
+        try:
+            if isinstance(answer, Exception):
+                raise answer
+            if cache.enabled and answer != cached:
+                try:
+                    _check_json(answer)
+                    cache.put(key, GRADING_MODEL, answer)
+                except ValueError:
+                    pass
+            return _finish_student_work(answer, prefix, suffix, flat_rubric, key_diff)
+        except Exception as e:
+            return _student_work_failure(e, prompt)
+
+    return {"prompt": prompt, "config": GRADING_CONFIG, "answer": cached, "finish": finish}
@@ -0,0 +1,193 @@
+import io
+import os
+import posixpath
+import zipfile
+import xml.etree.ElementTree as ET
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+
+RELS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+
+
+def rels_part_for(part):
+    """
+    Returns the relationships part name for a part.
+    e.g. "xl/worksheets/sheet1.xml" -> "xl/worksheets/_rels/sheet1.xml.rels"
+    """
+    folder, name = posixpath.split(part)
+    return posixpath.join(folder, '_rels', f'{name}.rels')
+
+def resolve_target(source_part, target):
+    """
+    Resolves a relationship Target (relative to the source part's folder,
+    or absolute when it starts with '/') to a part name inside the package.
+    """
+    if target.startswith('/'):
+        return posixpath.normpath(target.lstrip('/'))
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+
+class BasePackage(ABC):
+    """
+    Read-only view over the parts of an OOXML package (.xlsx/.xlsm).
+    Parts are addressed by their name inside the archive, e.g. "xl/workbook.xml".
+    """
+
+    @abstractmethod
+    def exists(self, part):
+        pass
+
+    @abstractmethod
+    def open(self, part):
+        """Returns a binary stream for the part."""
+
+    def read(self, part):
+        with self.open(part) as f:
+            return f.read()
+
+    def locate(self, part):
+        """Returns the location handed out to callers (e.g. by get_sheet_map) for a part."""
+        return part
+
+    def part_name(self, location):
+        """Inverse of locate(): accepts a location or a part name and returns the part name."""
+        return location.replace('\\', '/').lstrip('/')
+
+    def read_rels(self, part):
+        """
+        Parses the .rels of a part.
+        Returns { rId: {"target": part name (or raw target if external), "type": uri, "external": bool} }
+        """
+        rels_part = rels_part_for(part)
+        if not self.exists(rels_part):
+            return {}
+
+        with self.open(rels_part) as f:
+            root = ET.parse(f).getroot()
+
+        rels = {}
+        for rel in root.findall(f'{{{RELS_NS}}}Relationship'):
+            target = rel.get('Target') or ""
+            external = rel.get('TargetMode') == 'External'
+            rels[rel.get('Id')] = {
+                "target": target if external else resolve_target(part, target),
+                "type": rel.get('Type') or "",
+                "external": external
+            }
+        return rels
+
+    def portable_source(self):
+        """Returns a picklable source that open_package() can reopen in another process."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class DirectoryPackage(BasePackage):
+    """
+    A package that was already extracted to a directory (the legacy unzip_dir layout).
+    Locations are absolute file paths, as get_sheet_map has always returned.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+
+    def _path(self, part):
+        return os.path.join(self.root, *part.split('/'))
+
+    def exists(self, part):
+        return os.path.isfile(self._path(part))
+
+    def open(self, part):
+        return open(self._path(part), 'rb')
+
+    def locate(self, part):
+        return os.path.normpath(self._path(part))
+
+    def portable_source(self):
+        return self.root
+
+    def part_name(self, location):
+        if os.path.isabs(location):
+            location = os.path.relpath(location, self.root)
+        return super().part_name(location)
+
+
+class ZipPackage(BasePackage):
+    """
+    A package read straight from the .xlsx/.xlsm archive.
+    Members are opened as streams on demand; nothing is extracted to disk.
+    """
+
+    def __init__(self, source):
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        self.source = source
+        self._zip = zipfile.ZipFile(source, 'r')
+        self._names = set(self._zip.namelist())
+
+    def exists(self, part):
+        return part in self._names
+
+    def open(self, part):
+        return self._zip.open(part)
+
+    def portable_source(self):
+        if isinstance(self.source, (str, os.PathLike)):
+            return os.fspath(self.source)
+        # In-memory archive: ship the bytes
+        if isinstance(self.source, io.BytesIO):
+            return self.source.getvalue()
+        self.source.seek(0)
+        return self.source.read()
+
+    def close(self):
+        self._zip.close()
+
+
+class MemoryPackage(BasePackage):
+    """
+    A package made of in-memory parts: { part name: bytes }.
+    """
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def exists(self, part):
+        return part in self.parts
+
+    def open(self, part):
+        return io.BytesIO(self.parts[part])
+
+
+def open_package(source):
+    """
+    Returns a package for source: an existing package, an extracted directory,
+    a path to an .xlsx/.xlsm file, raw bytes or a binary file object.
+    """
+    if isinstance(source, BasePackage):
+        return source
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        return DirectoryPackage(source)
+    return ZipPackage(source)
+
+@contextmanager
+def package_from(source):
+    """
+    Context manager around open_package() that only closes packages it opened itself.
+    """
+    if isinstance(source, BasePackage):
+        yield source
+        return
+    package = open_package(source)
+    try:
+        yield package
+    finally:
+        package.close()
@@ -0,0 +1,204 @@
+import hashlib
+import io
+import os
+import pickle
+import tempfile
+import time
+import zlib
+from utils.package import BasePackage, DirectoryPackage
+
+# Settings (environment):
+#   GRADER_PARSE_CACHE=0          disable the cache
+#   GRADER_PARSE_CACHE_DIR=path   where entries are stored (default ~/.cache/excel-grader/parse)
+#   GRADER_PARSE_CACHE_MB=n       size bound; least recently used entries are evicted (default 256)
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "excel-grader", "parse")
+DEFAULT_MAX_MB = 256
+
+ENTRY_SUFFIX = ".pz"
+
+
+def source_digest(source):
+    """
+    sha256 of a workbook's bytes. source can be a path, bytes, a binary file object,
+    a package or a Workbook. Returns None for extracted directories, which are not cached.
+    """
+    package = getattr(source, 'package', source)
+    if isinstance(package, DirectoryPackage):
+        return None
+    if isinstance(package, BasePackage):
+        digest = getattr(package, '_content_digest', None)
+        if digest is None:
+            digest = source_digest(package.portable_source())
+            package._content_digest = digest
+        return digest
+
+    h = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray)):
+        h.update(source)
+    elif isinstance(source, io.BytesIO):
+        h.update(source.getbuffer())
+    elif isinstance(source, (str, os.PathLike)):
+        if not os.path.isfile(source):
+            return None
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    elif hasattr(source, 'read') and hasattr(source, 'seek'):
+        pos = source.tell()
+        source.seek(0)
+        for chunk in iter(lambda: source.read(1 << 20), b""):
+            h.update(chunk)
+        source.seek(pos)
+    else:
+        return None
+    return h.hexdigest()
+
+
+class ParseCache:
+    """
+    On-disk cache for parse results, keyed by the workbook bytes plus the parser version.
+    Entries are pickled and zlib-compressed, one file per key. A hit refreshes the
+    entry's mtime; once the directory grows past max_bytes the oldest entries go first.
+    The directory is only listed on the first put and when the running total of this
+    process's writes says it is over max_bytes (other processes are caught up then).
+    """
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=DEFAULT_MAX_MB << 20, enabled=True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._total = None  # Running size of the entries, read from disk on the first put
+
+    def key(self, kind, digest, version, params=None):
+        raw = f"{kind}|{version}|{digest}|{params!r}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ENTRY_SUFFIX)
+
+    def get(self, key):
+        """Returns (True, value) on a hit, (False, None) otherwise."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.loads(zlib.decompress(f.read()))
+        except FileNotFoundError:
+            return False, None
+        except Exception:
+            # Truncated or stale entry: drop it and parse again
+            self._remove(path)
+            return False, None
+        self._touch(path)
+        return True, value
+
+    def put(self, key, value):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 6)
+        try:
+            replaced = os.stat(path).st_size
+        except OSError:
+            replaced = 0
+        # Write then rename, so concurrent readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+        self._touch(path)
+        if self._total is None:
+            self._total = self.size()
+        else:
+            self._total += len(data) - replaced
+        if self._total > self.max_bytes:
+            self.evict()
+
+    def fetch(self, kind, source, version, compute, params=None):
+        """
+        Returns the cached result for (kind, source bytes, version, params),
+        calling compute() and storing its result on a miss.
+        """
+        digest = source_digest(source) if self.enabled else None
+        if digest is None:
+            return compute()
+
+        key = self.key(kind, digest, version, params)
+        hit, value = self.get(key)
+        if hit:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = compute()
+        try:
+            self.put(key, value)
+        except OSError:
+            pass # Read-only or full disk: the cache is only an optimization
+        return value
+
+    def _entries(self):
+        entries = []
+        for folder, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(ENTRY_SUFFIX):
+                    path = os.path.join(folder, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime_ns, st.st_size, path))
+        return entries
+
+    def size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in max_bytes."""
+        entries = self._entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+        self._total = total
+
+    def clear(self):
+        for _, _, path in self._entries():
+            self._remove(path)
+        self._total = 0
+
+    @staticmethod
+    def _touch(path):
+        # Explicit ns timestamp: the filesystem clock may be too coarse to order entries
+        now = time.time_ns()
+        try:
+            os.utime(path, ns=(now, now))
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_default_cache = None
+
+def get_parse_cache():
+    """The process-wide cache, configured from the environment on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ParseCache(
+            directory=os.environ.get('GRADER_PARSE_CACHE_DIR') or DEFAULT_DIR,
+            max_bytes=int(os.environ.get('GRADER_PARSE_CACHE_MB', DEFAULT_MAX_MB)) << 20,
+            enabled=os.environ.get('GRADER_PARSE_CACHE', '1') != '0'
+        )
+    return _default_cache
@@ -0,0 +1,67 @@
+import copy
+import hashlib
+import threading
+from collections import Counter, OrderedDict
+
+DEFAULT_MAX_ENTRIES = 2048
+_MISSING = object()
+
+
+class PartCache:
+    """
+    In-memory cache of parsed package parts, keyed by (kind, sha256 of the part bytes).
+    Submissions made from the same template share most of their styles, charts and
+    shared strings byte for byte, so across a batch each distinct part is parsed once.
+    Every caller gets its own deep copy, so a workbook that edits its styles or chart
+    metadata (delta, restrict, merge steps) can't change another submission's.
+    """
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = Counter()
+        self.misses = Counter()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind, data, parse):
+        """
+        Returns a copy of the parsed value for the part bytes, calling parse() on a miss.
+        """
+        key = (kind, hashlib.sha256(data).digest())
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits[kind] += 1
+                value = self._entries[key]
+            else:
+                value = _MISSING
+        if value is not _MISSING:
+            return copy.deepcopy(value)
+
+        value = parse()
+        with self._lock:
+            self.misses[kind] += 1
+            self._entries[key] = copy.deepcopy(value)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        """{ kind: {"hits": n, "misses": n} } plus the number of cached entries."""
+        kinds = sorted(set(self.hits) | set(self.misses))
+        stats = {kind: {"hits": self.hits[kind], "misses": self.misses[kind]} for kind in kinds}
+        stats["entries"] = len(self._entries)
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+
+_default_part_cache = PartCache()
+
+def get_part_cache():
+    """The process-wide part cache shared by every Workbook."""
+    return _default_part_cache
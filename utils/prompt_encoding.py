@@ -0,0 +1,217 @@
+import json
+import re
+from utils.cell_store import json_default, row_major_items
+from utils.coords import parse_coord
+from utils.request_governor import estimate_tokens
+
+# Compact text encoding of parsed workbooks for prompts (instead of json.dumps(indent=2)).
+#
+#   STYLES: s1={"font":{"bold":true}} s2={"num_fmt":"37"}
+#   === SHEET: T 4 - Summarize ===
+#   B2:"Hours" [s1] | E2:"Rate" [s1]
+#   E8:=F8/160 → 8.159375 {shared E8:E39} [s2] | F8:1305.5
+#   E9:~5.96875 [s2] | F9:955
+#   METADATA: {"drawings":[...]}
+#
+# Cells are grouped one row per line; empty unstyled cells and default fields are left
+# out, styles are listed once and referenced by id, and the cells a shared formula fills
+# carry only their value. Everything else (rubrics, diffs) is compact JSON.
+
+ENCODING_NOTE = (
+    "[Compact workbook encoding: cells are listed row by row as COORD:CONTENT, separated by ' | '. "
+    "CONTENT is a number, a \"quoted string\" or =FORMULA → cached value. "
+    "~value marks a cell filled by a shared formula, given at the first cell of its {shared RANGE}. "
+    "[sN] is a cell style from STYLES; A1..C1 is a run of empty cells sharing one. "
+    "Empty cells without a style are omitted.]"
+)
+
+_NUMBER_RE = re.compile(r"-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?")
+
+
+def compact_json(data):
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False, default=json_default)
+
+def _scalar(value):
+    """A number as its shortest exact form, anything else JSON-quoted."""
+    if value is None:
+        return '""'
+    if isinstance(value, str) and _NUMBER_RE.fullmatch(value):
+        number = float(value)
+        if number.is_integer() and abs(number) < 1e15:
+            return str(int(number))
+        return repr(number)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return repr(value)
+    return json.dumps(value, ensure_ascii=False, default=json_default)
+
+def prune(data):
+    """Drops None, empty strings and empty containers, recursively."""
+    if isinstance(data, dict):
+        pruned = {k: prune(v) for k, v in data.items()}
+        return {k: v for k, v in pruned.items() if v not in (None, "", [], {})}
+    if isinstance(data, list):
+        return [prune(v) for v in data]
+    return data
+
+
+class StyleLegend:
+    """Numbers distinct cell styles s1, s2, ... in order of first use."""
+
+    def __init__(self):
+        self.ids = {}
+
+    def ref(self, style):
+        if not style:
+            return None
+        key = json.dumps(style, sort_keys=True, separators=(",", ":"), default=json_default)
+        if key not in self.ids:
+            self.ids[key] = f"s{len(self.ids) + 1}"
+        return self.ids[key]
+
+    def render(self):
+        return "STYLES: " + " ".join(f"{sid}={key}" for key, sid in self.ids.items()) if self.ids else ""
+
+
+def encode_cell(cell, styles=None):
+    """CONTENT of one cell (see ENCODING_NOTE), or None for an empty unstyled cell."""
+    value, formula = cell.get("value"), cell.get("formula")
+    ftype, fref = cell.get("formula_type") or "normal", cell.get("formula_ref")
+    if formula:
+        text = f"={formula} → {_scalar(value)}"
+        if ftype != "normal":
+            text += f" {{{ftype} {fref}}}" if fref else f" {{{ftype}}}"
+    elif ftype == "shared":
+        text = f"~{_scalar(value)}"
+    elif value in (None, ""):
+        text = None
+    else:
+        text = _scalar(value)
+
+    sid = styles.ref(cell.get("style")) if styles is not None else None
+    if sid:
+        return f"{text if text is not None else _scalar('')} [{sid}]"
+    return text
+
+def encode_cells(cells, styles=None, describe=None):
+    """
+    Row-grouped lines for a cell mapping (coord -> cell). Without a StyleLegend styles
+    are left out. describe(coord, cell) may replace the default encode_cell.
+    Adjacent empty cells of the same style are written as one run (I10..Q10).
+    """
+    lines, parts = [], []
+    row = last_col = None
+    run = None  # [first coord, last coord, text] of the current run of empty styled cells
+
+    def flush_run():
+        if run:
+            span = run[0] if run[0] == run[1] else f"{run[0]}..{run[1]}"
+            parts.append(f"{span}:{run[2]}")
+
+    for coord, cell in row_major_items(cells):
+        text = describe(coord, cell) if describe else encode_cell(cell, styles)
+        if text is None:
+            continue
+        pos = parse_coord(coord) or (coord, None)
+        if pos[0] != row:
+            flush_run()
+            run = None
+            if parts:
+                lines.append(" | ".join(parts))
+                parts = []
+        empty = text.startswith('"" [')
+        if empty and run and run[2] == text and pos[1] is not None and pos[1] == last_col + 1:
+            run[1] = coord
+        else:
+            flush_run()
+            run = [coord, coord, text] if empty else None
+            if not empty:
+                parts.append(f"{coord}:{text}")
+        row, last_col = pos
+    flush_run()
+    if parts:
+        lines.append(" | ".join(parts))
+    return lines
+
+def _sheet_lines(name, entry, styles, heading="SHEET"):
+    lines = [f"=== {heading}: {name} ==="]
+    lines.extend(encode_cells(entry.get("cells", {}), styles))
+    metadata = prune(entry.get("metadata") or {})
+    if metadata:
+        lines.append(f"METADATA: {compact_json(metadata)}")
+    return lines
+
+def _workbook_metadata_lines(meta):
+    meta = dict(meta or {})
+    lines = []
+    skipped = meta.pop("skipped_sheets", None)
+    if meta.get("definedNames"):
+        lines.append(f"DEFINED NAMES: {compact_json(meta.pop('definedNames'))}")
+    meta = prune(meta)
+    if meta:
+        lines.append(f"WORKBOOK METADATA: {compact_json(meta)}")
+    if skipped:
+        lines.append(f"SKIPPED SHEETS (not referenced by the rubric, omitted on purpose): {compact_json(skipped)}")
+    return lines
+
+def encode_workbook(data):
+    """Text encoding of a parse_workbook_to_json result."""
+    styles = StyleLegend()
+    body = []
+    for name, entry in data.get("sheets", {}).items():
+        body.extend(_sheet_lines(name, entry, styles))
+    head = [ENCODING_NOTE]
+    if styles.ids:
+        head.append(styles.render())
+    return "\n".join(head + _workbook_metadata_lines(data.get("workbook_metadata")) + body)
+
+def encode_delta(delta):
+    """Text encoding of a compute_workbook_delta result."""
+    styles = StyleLegend()
+
+    def changed(coord, entry):
+        template = dict(entry, **entry.get("template", {}))
+        now = encode_cell(entry, styles) or '""'
+        before = encode_cell(template, styles) or '""'
+        return f"{now} (template: {before})"
+
+    body = []
+    for name, sheet in delta.get("sheets", {}).items():
+        body.append(f"=== SHEET: {name} ===")
+        for section, label in (("added", "ADDED"), ("changed", "CHANGED"), ("removed", "REMOVED")):
+            if sheet.get(section):
+                body.append(f"{label}:")
+                body.extend(encode_cells(sheet[section], styles, changed if section == "changed" else None))
+        if sheet.get("context"):
+            body.append("CONTEXT (labels near the changes): " +
+                        " | ".join(f"{coord}:{_scalar(value)}" for coord, value in sheet["context"].items()))
+        if sheet.get("metadata"):
+            body.append(f"METADATA CHANGES: {compact_json(sheet['metadata'])}")
+    for name, entry in delta.get("added_sheets", {}).items():
+        body.extend(_sheet_lines(name, entry, styles, heading="ADDED SHEET"))
+    for key, label in (("removed_sheets", "REMOVED SHEETS"), ("unchanged_sheets", "UNCHANGED SHEETS")):
+        if delta.get(key):
+            body.append(f"{label}: {compact_json(delta[key])}")
+
+    head = [ENCODING_NOTE,
+            "[DELTA against the blank assignment template: only what was added, changed or removed is listed; "
+            "'template:' shows what the template had.]"]
+    if styles.ids:
+        head.append(styles.render())
+    return "\n".join(head + _workbook_metadata_lines(delta.get("workbook_metadata")) + body)
+
+def encode_for_prompt(data):
+    """The prompt text for any payload: workbooks and deltas get the grid encoding, other data compact JSON."""
+    if isinstance(data, str):
+        return data
+    if isinstance(data, dict) and data.get("delta_against_template"):
+        return encode_delta(data)
+    if isinstance(data, dict) and isinstance(data.get("sheets"), dict):
+        return encode_workbook(data)
+    return compact_json(data)
+
+def token_report(data):
+    """Estimated prompt tokens of a payload as indented JSON and as encoded here."""
+    before = estimate_tokens(json.dumps(data, indent=2, default=json_default)) if not isinstance(data, str) else estimate_tokens(data)
+    after = estimate_tokens(encode_for_prompt(data))
+    return {"json_tokens": before, "encoded_tokens": after,
+            "saved_percent": round(100.0 * (before - after) / before, 1) if before else 0.0}
@@ -0,0 +1,248 @@
+import asyncio
+import email.utils
+import os
+import random
+import re
+import threading
+import time
+
+# Client-side pacing of model requests, shared by every caller in the process.
+#
+# Two token buckets (requests/minute, tokens/minute) are drawn from before each call;
+# a bucket may go into debt, and a caller waits until its reservation is paid off, so
+# concurrent callers queue up at the quota rate instead of bursting into 429s.
+# Failed calls are retried per error class with exponential backoff and full jitter,
+# or after the server's retry-after; a 429 also pauses every other caller for that long.
+#
+# Settings (environment):
+#   GRADER_LLM_RPM=n   requests per minute (default 60, 0 = unlimited)
+#   GRADER_LLM_TPM=n   prompt tokens per minute (default 1000000, 0 = unlimited)
+
+DEFAULT_RPM = 60
+DEFAULT_TPM = 1000000
+CHARS_PER_TOKEN = 4
+
+# retries: how many times an error of the class is retried (0 = raise at once)
+ERROR_POLICIES = {
+    "rate_limit": {"retries": 6, "base_delay": 2.0, "max_delay": 60.0},
+    "server":     {"retries": 4, "base_delay": 1.0, "max_delay": 30.0},
+    "network":    {"retries": 2, "base_delay": 0.5, "max_delay": 5.0},
+    "client":     {"retries": 0},   # bad request, auth, not found: retrying won't help
+    "other":      {"retries": 0},
+}
+
+_RETRY_DELAY_RE = re.compile(r"^(\d+(?:\.\d+)?)s$")
+
+
+def estimate_tokens(text):
+    """Rough token count of a prompt fragment (about 4 characters per token)."""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def error_status(error):
+    """HTTP status of an API error (genai APIError.code, httpx-style status_code), or None."""
+    for attr in ("code", "status_code"):
+        code = getattr(error, attr, None)
+        if isinstance(code, int):
+            return code
+    response = getattr(error, "response", None)
+    code = getattr(response, "status_code", None)
+    return code if isinstance(code, int) else None
+
+def classify_error(error):
+    """'rate_limit', 'server', 'network', 'client' or 'other' (see ERROR_POLICIES)."""
+    status = error_status(error)
+    if status == 429 or getattr(error, "status", None) == "RESOURCE_EXHAUSTED":
+        return "rate_limit"
+    if status in (500, 502, 503, 504):
+        return "server"
+    if status == 408 or isinstance(error, (TimeoutError, ConnectionError)):
+        return "network"
+    # httpx / requests transport errors, without importing either
+    if any(name in ("TransportError", "TimeoutException", "ConnectionError", "ConnectError", "ReadTimeout")
+           for name in (cls.__name__ for cls in type(error).__mro__)):
+        return "network"
+    if status is not None and 400 <= status < 500:
+        return "client"
+    return "other"
+
+def never_sent(error):
+    """True when the request failed before reaching the server (DNS, refused connection)."""
+    if isinstance(error, ConnectionRefusedError):
+        return True
+    return any(cls.__name__ == "ConnectError" for cls in type(error).__mro__)
+
+def retry_after(error):
+    """Seconds the server asked us to wait (Retry-After header or a RetryInfo detail), or None."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    details = getattr(error, "details", None)
+    if isinstance(details, dict):
+        details = details.get("error", details).get("details")
+    for detail in details if isinstance(details, list) else []:
+        m = _RETRY_DELAY_RE.match(str(detail.get("retryDelay", ""))) if isinstance(detail, dict) else None
+        if m:
+            return float(m.group(1))
+    return None
+
+
+class TokenBucket:
+    """
+    per_minute units refill continuously up to burst. reserve() takes its amount
+    right away (possibly going into debt) and returns how long to wait before using it.
+    """
+
+    def __init__(self, per_minute, burst=None, clock=time.monotonic):
+        self.rate = per_minute / 60.0
+        self.capacity = float(burst or per_minute)
+        self.level = self.capacity
+        self.clock = clock
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        with self._lock:
+            self._refill()
+            self.level -= amount
+            return max(0.0, -self.level / self.rate)
+
+    def charge(self, amount):
+        """Corrects an earlier reservation (negative amounts give units back)."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+    def hold(self, seconds):
+        """Makes every reservation wait at least this long (server asked us to back off)."""
+        with self._lock:
+            self._refill()
+            self.level = min(self.level, -seconds * self.rate)
+
+
+class RequestGovernor:
+    """
+    Paces and retries model calls: call(fn, tokens) / call_async(coro_fn, tokens).
+    rpm / tpm of 0 or None disable that limit. Counters are in stats().
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, policies=None, clock=time.monotonic,
+                 sleep=time.sleep, async_sleep=asyncio.sleep):
+        self.requests = TokenBucket(rpm, clock=clock) if rpm else None
+        self.tokens = TokenBucket(tpm, clock=clock) if tpm else None
+        self.policies = dict(ERROR_POLICIES, **(policies or {}))
+        self.sleep = sleep
+        self.async_sleep = async_sleep
+        self.counts = {"calls": 0, "retries": 0, "failures": 0, "waited": 0.0}
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens):
+        wait = self.requests.reserve(1) if self.requests else 0.0
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        with self._lock:
+            self.counts["calls"] += 1
+            self.counts["waited"] += wait
+        return wait
+
+    def _settle(self, tokens, result, usage):
+        if self.tokens and usage is not None:
+            actual = usage(result)
+            if actual:
+                self.tokens.charge(actual - tokens)
+
+    def _backoff(self, error, attempt, tokens):
+        """Seconds to wait before retrying, or None to give up."""
+        if never_sent(error):
+            # Didn't count against the server's quota, so it doesn't count against ours
+            if self.requests:
+                self.requests.charge(-1)
+            if self.tokens and tokens:
+                self.tokens.charge(-tokens)
+        kind = classify_error(error)
+        policy = self.policies.get(kind, ERROR_POLICIES["other"])
+        if attempt >= policy.get("retries", 0):
+            with self._lock:
+                self.counts["failures"] += 1
+            return None
+        ceiling = min(policy["max_delay"], policy["base_delay"] * 2 ** attempt)
+        delay = random.uniform(0, ceiling)  # full jitter
+        hint = retry_after(error)
+        if hint is not None:
+            delay = hint + random.uniform(0, policy["base_delay"])
+        if kind == "rate_limit" and self.requests:
+            # Everyone backs off, not just the caller that hit the limit
+            self.requests.hold(delay)
+        with self._lock:
+            self.counts["retries"] += 1
+        return delay
+
+    def call(self, fn, tokens=0, usage=None):
+        """
+        Returns fn() once the buckets allow it, retrying failures per ERROR_POLICIES.
+        usage(result), if given, reports the prompt tokens actually used so the estimate is corrected.
+        """
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            if wait:
+                self.sleep(wait)
+            try:
+                result = fn()
+            except Exception as e:
+                delay = self._backoff(e, attempt, tokens)
+                if delay is None:
+                    raise
+                self.sleep(delay)
+                attempt += 1
+                continue
+            self._settle(tokens, result, usage)
+            return result
+
+    async def call_async(self, fn, tokens=0, usage=None):
+        """call() for a coroutine function; waiting doesn't block the event loop."""
+        attempt = 0
+        while True:
+            wait = self._reserve(tokens)
+            if wait:
+                await self.async_sleep(wait)
+            try:
+                result = await fn()
+            except Exception as e:
+                delay = self._backoff(e, attempt, tokens)
+                if delay is None:
+                    raise
+                await self.async_sleep(delay)
+                attempt += 1
+                continue
+            self._settle(tokens, result, usage)
+            return result
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counts, waited=round(self.counts["waited"], 3))
+
+
+_default_governor = None
+
+def get_governor():
+    """The process-wide governor, configured from the environment on first use."""
+    global _default_governor
+    if _default_governor is None:
+        _default_governor = RequestGovernor(
+            rpm=float(os.environ.get('GRADER_LLM_RPM', DEFAULT_RPM)),
+            tpm=float(os.environ.get('GRADER_LLM_TPM', DEFAULT_TPM))
+        )
+    return _default_governor
@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+# Settings (environment):
+#   GRADER_LLM_CACHE=0           bypass the cache (always call the model)
+#   GRADER_LLM_CACHE_PATH=file   SQLite database (default ~/.cache/excel-grader/llm.sqlite3)
+#   GRADER_LLM_CACHE_TTL=hours   entries older than this are ignored and dropped (default 168)
+#   GRADER_LLM_CACHE_MB=n        size bound; least recently used entries are evicted (default 64)
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".cache", "excel-grader", "llm.sqlite3")
+DEFAULT_TTL_HOURS = 168
+DEFAULT_MAX_MB = 64
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    response BLOB NOT NULL
+)
+"""
+
+
+def normalize_prompt(contents):
+    """
+    Canonical text of a prompt for keying: the prompts are indented f-strings, so
+    per-line indentation and trailing whitespace are dropped.
+    """
+    if not isinstance(contents, str):
+        contents = json.dumps(contents, sort_keys=True, default=str)
+    return "\n".join(line.strip() for line in contents.strip().splitlines())
+
+
+class ResponseCache:
+    """
+    SQLite cache of model responses, keyed by model name, generation config and a hash
+    of the normalized prompt. Entries expire after ttl seconds; once the database holds
+    more than max_bytes of responses, the least recently used ones go first.
+    Safe to share between threads (one connection per operation).
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL_HOURS * 3600, max_bytes=DEFAULT_MAX_MB << 20, enabled=True):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._ready = False
+
+    def key(self, model, contents, config=None):
+        prompt_hash = hashlib.sha256(normalize_prompt(contents).encode('utf-8')).hexdigest()
+        raw = json.dumps({"model": model, "config": config or {}, "prompt": prompt_hash}, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def _connect(self):
+        if not self._ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        if not self._ready:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(_SCHEMA)
+            conn.commit()
+            self._ready = True
+        return conn
+
+    def get(self, key):
+        """Returns the cached response text, or None (missing or expired)."""
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("SELECT created, response FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None and now - row[0] > self.ttl:
+                    conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    conn.commit()
+                    row = None
+                if row is not None:
+                    conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                    conn.commit()
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            return None
+        if row is None:
+            return None
+        try:
+            return zlib.decompress(row[1]).decode('utf-8')
+        except (zlib.error, UnicodeDecodeError):
+            return None
+
+    def put(self, key, model, text):
+        data = zlib.compress(text.encode('utf-8'), 6)
+        now = time.time()
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                             (key, model, now, now, len(data), data))
+                conn.commit()
+                self._evict(conn)
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            pass # Locked or read-only database: the cache is only an optimization
+
+    def fetch(self, model, contents, config, generate, validate=None, use_cache=True):
+        """
+        Returns the cached response for (model, contents, config), calling generate()
+        on a miss. The response is stored only if validate(text) doesn't raise, so a
+        malformed answer is asked for again next time.
+        """
+        if not (self.enabled and use_cache):
+            return generate()
+        key = self.key(model, contents, config)
+        text = self.get(key)
+        with self._lock:
+            if text is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if text is not None:
+            return text
+
+        text = generate()
+        try:
+            if validate is not None:
+                validate(text)
+        except Exception:
+            return text
+        self.put(key, model, text)
+        return text
+
+    async def fetch_async(self, model, contents, config, generate, validate=None, use_cache=True):
+        """fetch() for a coroutine generate(); the database is read and written off the event loop."""
+        if not (self.enabled and use_cache):
+            return await generate()
+        key = self.key(model, contents, config)
+        text = await asyncio.to_thread(self.get, key)
+        with self._lock:
+            if text is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if text is not None:
+            return text
+
+        text = await generate()
+        try:
+            if validate is not None:
+                validate(text)
+        except Exception:
+            return text
+        await asyncio.to_thread(self.put, key, model, text)
+        return text
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            total -= size
+        conn.commit()
+
+    def stats(self):
+        """Hit/miss counters of this process plus the size of the database."""
+        entries = size = 0
+        try:
+            conn = self._connect()
+            try:
+                entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            pass
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size
+        }
+
+    def clear(self):
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("DELETE FROM responses")
+                conn.commit()
+            finally:
+                conn.close()
+        except (sqlite3.Error, OSError):
+            pass
+
+
+_default_cache = None
+
+def get_response_cache():
+    """The process-wide cache, configured from the environment on first use."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache(
+            path=os.environ.get('GRADER_LLM_CACHE_PATH') or DEFAULT_PATH,
+            ttl=float(os.environ.get('GRADER_LLM_CACHE_TTL', DEFAULT_TTL_HOURS)) * 3600,
+            max_bytes=int(os.environ.get('GRADER_LLM_CACHE_MB', DEFAULT_MAX_MB)) << 20,
+            enabled=os.environ.get('GRADER_LLM_CACHE', '1') != '0'
+        )
+    return _default_cache
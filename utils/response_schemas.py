@@ -0,0 +1,64 @@
+# Response schemas for the model helpers in utils.llm_helper, passed as the generation
+# config's response_schema (with response_mime_type application/json) so the API
+# constrains decoding to the shape each parser expects. They use the OpenAPI subset the
+# Gemini API accepts: no free-form maps, hence the manual review answer is an array.
+
+_STRING = {"type": "STRING"}
+_NUMBER = {"type": "NUMBER"}
+_BOOLEAN = {"type": "BOOLEAN"}
+
+
+def _object(properties, required=None, optional=()):
+    required = [name for name in properties if name not in optional] if required is None else required
+    return {"type": "OBJECT", "properties": properties, "required": required, "propertyOrdering": list(properties)}
+
+def _array(items):
+    return {"type": "ARRAY", "items": items}
+
+
+# generate_structured_rubric / refine_structured_rubric
+RUBRIC_SCHEMA = _array(_object({
+    "_id": _STRING,
+    "name": _STRING,
+    "points": _NUMBER,
+    "sub_criteria": _array(_object({"level": _STRING, "desc": _STRING, "pts": _NUMBER}))
+}))
+
+# grade_manual_review_batch: one verdict per criterion, "id" being the criterion's key
+MANUAL_REVIEW_SCHEMA = _array(_object({"id": _STRING, "passed": _BOOLEAN, "feedback": _STRING}))
+
+_INCORRECT_CELLS = _array(_object({
+    "sheet": _STRING, "cell": _STRING, "expected": _STRING, "actual": _STRING, "explanation": _STRING
+}))
+
+# grade_workbook_comparison (model path)
+COMPARISON_SCHEMA = _object({
+    "passed": _BOOLEAN,
+    "score": _NUMBER,
+    "incorrect_cells": _INCORRECT_CELLS,
+    "comments": _STRING
+})
+
+_RESULTS = _array(_object({
+    "_id": _STRING,
+    "obtainedPoints": _NUMBER,
+    "explanation": _STRING,
+    "evidence": _STRING,
+    "achievedLevel": _STRING
+}, optional=("achievedLevel",)))
+
+# grade_student_work (the Edvisor report)
+GRADING_SCHEMA = _object({
+    "summary": _STRING,
+    "score": _object({"earned": _NUMBER, "max": _NUMBER, "letter": _STRING}),
+    "result": _RESULTS,
+    "incorrect_cells": _INCORRECT_CELLS
+})
+
+# grade_student_work's follow-up for criteria the first answer left out
+RESULTS_SCHEMA = _object({"result": _RESULTS})
+
+
+def json_config(schema, **config):
+    """A generation config asking for JSON in the given schema."""
+    return dict(config, response_mime_type='application/json', response_schema=schema)
@@ -1,34 +1,40 @@
-from utils.xml_helper import get_sheet_map, get_shared_strings, parse_sheet_full
+from utils.xml_helper import PARSER_VERSION, SHEET_REF_RE, get_sheet_map, get_shared_strings, parse_sheet_full, workbook_from
 import re
+from utils.cell_store import row_major_items
+from utils.coords import column_letters, parse_coord
+from utils.parse_cache import get_parse_cache
+
+# "Task 3", "T 3", "T3" -> 3 (assignment sheets are named like "T 3 - Text to Columns")
+TASK_NUMBER_RE = re.compile(r"\b(?:T|Task)\s*#?\s*(\d+)\b", re.IGNORECASE)
 
 def extract_rubric_from_sheet(unzip_dir):
     """
     Attempts to find a 'Scoring Guide' or 'Rubric' sheet and parse it.
+    unzip_dir can be an extracted directory, a path to the workbook file, a package or a Workbook.
     Returns a dict with 'source': 'embedded', 'tasks': [...] or None.
+    Results are cached on disk by file content (see utils.parse_cache).
     """
-    sheet_map = get_sheet_map(unzip_dir)
-    shared_strings = get_shared_strings(unzip_dir)
-    
-    target_sheet_key = None
-    for k in sheet_map.keys():
-        if "scoring" in k.lower() or "rubric" in k.lower():
-            target_sheet_key = k
-            break
-            
-    if not target_sheet_key:
-        return None
-        
-    xml_path = sheet_map[target_sheet_key]
-    data, _ = parse_sheet_full(xml_path, shared_strings)
+    return get_parse_cache().fetch('rubric', unzip_dir, PARSER_VERSION, lambda: _extract_rubric(unzip_dir))
+
+def _extract_rubric(unzip_dir):
+    with workbook_from(unzip_dir) as workbook:
+        sheet_map = get_sheet_map(workbook)
+
+        target_sheet_key = None
+        for k in sheet_map.keys():
+            if "scoring" in k.lower() or "rubric" in k.lower():
+                target_sheet_key = k
+                break
+
+        if not target_sheet_key:
+            return None
+
+        shared_strings = get_shared_strings(workbook)
+        xml_path = sheet_map[target_sheet_key]
+        data, _ = parse_sheet_full(xml_path, shared_strings, workbook)
     
-    # Sort items by row then col
-    def parse_coord(coord):
-        match = re.match(r"([A-Z]+)(\d+)", coord)
-        if match:
-            return match.group(1), int(match.group(2))
-        return "A", 0
-        
-    sorted_cells = sorted(data.items(), key=lambda x: parse_coord(x[0])[1])
+    # Parsed sheets are already row-major
+    sorted_cells = row_major_items(data)
     
     tasks = []
     current_task = None
@@ -40,7 +46,8 @@ def extract_rubric_from_sheet(unzip_dir):
     # We group by rows.
     rows = {}
     for coord, val in sorted_cells:
-        col, row = parse_coord(coord)
+        row, col = parse_coord(coord) or (0, 1)
+        col = column_letters(col)
         if row not in rows:
             rows[row] = {}
         rows[row][col] = val['value']
@@ -131,3 +138,95 @@ def extract_rubric_from_sheet(unzip_dir):
         return None
         
     return {"tasks": final_tasks, "source": "embedded_scanned"}
+
+def _rubric_texts(item):
+    """
+    Flattens every string inside a rubric item (name, description, sub_criteria levels...).
+    """
+    if isinstance(item, str):
+        return [item]
+    if isinstance(item, dict):
+        return [t for v in item.values() for t in _rubric_texts(v)]
+    if isinstance(item, list):
+        return [t for v in item for t in _rubric_texts(v)]
+    return []
+
+def sheets_in_text(text, sheet_names):
+    """
+    Sheet names a piece of rubric text refers to: by task number ("Task 1" -> "T 1 - ..."),
+    by name, or through an explicit Sheet!A1 reference.
+    """
+    found = set()
+    clean_text = re.sub(r'[^a-zA-Z0-9]', '', text).lower()
+    numbers = set(TASK_NUMBER_RE.findall(text))
+    explicit = {(q.replace("''", "'") if q else b).strip().lower() for q, b in SHEET_REF_RE.findall(text)}
+
+    for sname in sheet_names:
+        clean_sname = re.sub(r'[^a-zA-Z0-9]', '', sname).lower()
+        match = TASK_NUMBER_RE.match(sname.strip())
+        if match and match.group(1) in numbers:
+            found.add(sname)
+        elif len(clean_sname) >= 4 and clean_sname in clean_text:
+            found.add(sname)
+        elif sname.strip().lower() in explicit:
+            found.add(sname)
+    return found
+
+def resolve_sheet(task, sheet_names, criterion=None):
+    """
+    The sheet a task (or one of its criteria) is about: the criterion's own "sheet", then
+    the one sheet the task/criterion text points at ("Task 6 ..." -> "T 6 - XY Chart"),
+    then the task's "sheet", which the embedded extractor fills with a fallback.
+    Returns None if it can't be told.
+    """
+    folded = {name.strip().casefold(): name for name in sheet_names}
+    if criterion and criterion.get('sheet'):
+        return folded.get(str(criterion['sheet']).strip().casefold())
+    texts = [task.get('name') or ""] if task else []
+    if criterion:
+        texts.append(criterion.get('description') or criterion.get('name') or "")
+    found = sheets_in_text(" ".join(texts), sheet_names)
+    if len(found) == 1:
+        return found.pop()
+    if task and task.get('sheet'):
+        return folded.get(str(task['sheet']).strip().casefold())
+    if len(sheet_names) == 1:
+        return sheet_names[0]
+    return None
+
+def find_referenced_sheets(rubric, sheet_names):
+    """
+    Returns the set of sheet names a rubric touches, used to parse only those sheets.
+    Works on task-based rubrics ({"tasks": [...]}) and flat criteria lists.
+    A task's "sheet" is only used when its text doesn't already point at a sheet,
+    since the embedded extractor fills it with a fallback.
+    Returns None (every sheet should then be parsed) when a task or criterion can't be
+    matched to a sheet, since the sheet it needs isn't known, and for text rubrics.
+    """
+    if not rubric or not sheet_names:
+        return None
+
+    referenced = set()
+    if isinstance(rubric, dict) and "tasks" in rubric:
+        for task in rubric["tasks"]:
+            texts = _rubric_texts({k: v for k, v in task.items() if k != 'sheet'})
+            found = sheets_in_text(" ".join(texts), sheet_names)
+            if not found and task.get('sheet') in sheet_names:
+                found.add(task['sheet'])
+            if not found:
+                return None
+            referenced |= found
+    elif isinstance(rubric, list):
+        for crit in rubric:
+            found = sheets_in_text(" ".join(_rubric_texts(crit)), sheet_names)
+            if isinstance(crit, dict) and crit.get('sheet') in sheet_names:
+                found.add(crit['sheet'])
+            if not found:
+                return None
+            referenced |= found
+    else:
+        # A text rubric (paragraphs don't map reliably to sheets) or a raw workbook dump
+        # used as a rubric: no structure to go on
+        return None
+
+    return referenced or None
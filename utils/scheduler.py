@@ -0,0 +1,255 @@
+import copy
+import re
+from utils.coords import parse_coord
+from utils.diff_engine import chart_details
+from utils.evaluator import LOCAL_CRITERIA_TYPES, METADATA_CHECKS, evaluate_criteria
+from utils.llm_helper import flatten_rubric, letter_grade, map_results_to_ui
+from utils.rubric_extractor import resolve_sheet
+
+# Hybrid grading: rubric criteria the evaluator can check from the parsed workbook
+# (cell values, formula patterns, chart type/axes/legend, sparklines, data validations)
+# are graded locally; only the rest is sent to the model.
+#
+# Criteria come in three kinds:
+#   "local"    typed criteria (value_match, chart_axis, ...): the local result is final
+#   "inferred" free-text criteria whose whole wording maps onto local checks
+#              ("Y axis Major Unit is $20 and maximum value is $60."): a local pass is
+#              final, a local failure is handed to the model, which reads more context.
+#              Every check must hold on the same chart, so on a sheet with several
+#              charts (which one is meant isn't known) the model grades them
+#   "llm"      everything else
+
+AXIS_NAMES = {"x": "x", "horizontal": "x", "category": "x", "y": "y", "vertical": "y", "value": "y",
+              "primary": "y", "secondary": "y2"}
+AXIS_FIELDS = {"major unit": "major_unit", "maximum": "max", "max": "max", "minimum": "min", "min": "min"}
+
+_CLAUSE_SPLIT_RE = re.compile(r"\s*(?:;|,\s*and\b|,(?=\s)|\band\b)\s*")
+_AXIS_CLAUSE_RE = re.compile(
+    r"^(?:(?:the )?(?P<axis>x|y|horizontal|vertical|value|category|primary|secondary)[- ]axis(?:'s)? )?"
+    r"(?P<field>major unit|maximum|minimum|max|min)(?: value| bound)? (?:is|=|of|set to|changed to|to) "
+    r"\$?(?P<value>-?[\d,]*\.?\d+)(?P<pct>%)?$")
+_LEGEND_CLAUSE_RE = re.compile(
+    r"^(?:the )?legend (?:is )?(?:(?:moved|positioned|placed|shown|set) )?(?:(?:to|at|on) )?(?:the )?"
+    r"(?P<pos>top|bottom|left|right)$")
+_CHART_TYPE_CLAUSE_RE = re.compile(
+    r"^(?:the )?chart (?:type )?(?:is )?(?:(?:changed|converted) )?(?:correctly )?(?:to )?(?:the |an? )?"
+    r"(?P<type>xy|x-y|scatter|line|pie|column|bar|area)(?: \(scatter\))?(?: type| chart)*$")
+
+
+def infer_checks(text):
+    """
+    Typed checks equivalent to a free-text criterion, or None unless every clause of
+    the text is understood. Only chart settings are recognised; the sheet is not known here.
+    """
+    text = re.sub(r"\s+", " ", (text or "").strip().lower()).strip(" .-")
+    if not text:
+        return None
+    checks = []
+    axis = None
+    for clause in _CLAUSE_SPLIT_RE.split(text):
+        clause = clause.strip(" .")
+        m = _AXIS_CLAUSE_RE.match(clause)
+        if m:
+            # "Y axis major unit is 20 and maximum value is 60": the axis carries over
+            axis = AXIS_NAMES[m.group("axis")] if m.group("axis") else axis
+            if axis is None:
+                return None
+            value = float(m.group("value").replace(",", ""))
+            if m.group("pct"):
+                value /= 100
+            checks.append({"type": "chart_axis", "axis": axis, "field": AXIS_FIELDS[m.group("field")],
+                           "expected": value, "tolerance": 1e-9})
+            continue
+        m = _LEGEND_CLAUSE_RE.match(clause)
+        if m:
+            checks.append({"type": "legend_position", "expected": m.group("pos")})
+            continue
+        m = _CHART_TYPE_CLAUSE_RE.match(clause)
+        if m:
+            checks.append({"type": "chart_type", "expected": m.group("type")})
+            continue
+        return None
+    return checks or None
+
+def classify_criterion(criterion):
+    """'local', 'inferred' or 'llm' (see the module notes)."""
+    if not isinstance(criterion, dict):
+        return "llm"
+    ctype = criterion.get("type")
+    if ctype in LOCAL_CRITERIA_TYPES:
+        return "local"
+    if ctype in (None, "manual_review") and infer_checks(criterion.get("description") or criterion.get("name")):
+        return "inferred"
+    return "llm"
+
+
+def _evidence(criterion, cells, metadata):
+    """What the local check looked at, phrased for the report."""
+    ctype = criterion.get("type")
+    if ctype in METADATA_CHECKS and ctype not in ("sparkline", "data_validation"):
+        charts = chart_details(metadata)
+        if not charts:
+            return "No chart found on the sheet."
+        parts = []
+        for i, details in enumerate(charts, 1):
+            axes = "; ".join(f"{a.get('tag', 'axis').split(':')[-1]} min {a.get('min')}, max {a.get('max')}, "
+                             f"major unit {a.get('major_unit')}" for a in (details.get("axes") or {}).values())
+            parts.append(f"Chart {i}: {', '.join(details.get('types') or []) or 'unknown type'}, "
+                         f"legend '{details.get('legend_pos') or 'none'}'" + (f", axes: {axes}" if axes else ""))
+        return " | ".join(parts)
+    if ctype == "sparkline":
+        found = [f"{g.get('type', 'line')} at {s.get('location')}"
+                 for g in metadata.get("sparklines", []) for s in g.get("sparklines", [])]
+        return f"Sparklines: {', '.join(found)}" if found else "No sparklines found on the sheet."
+    if ctype == "data_validation":
+        found = [f"{dv.get('type')} on {dv.get('sqref')} ({dv.get('formula1')})" for dv in metadata.get("validations", [])]
+        return f"Data validations: {', '.join(found)}" if found else "No data validation found on the sheet."
+    cell_ref = criterion.get("cell")
+    cell = cells.get(cell_ref) if cell_ref and parse_coord(cell_ref) else None
+    if not cell:
+        return f"Cell {cell_ref} is empty."
+    evidence = f"{cell_ref} = {cell.get('value')!r}"
+    if cell.get("formula"):
+        evidence += f" (formula ={cell['formula']})"
+    return evidence
+
+def _level(criterion, passed):
+    """The rubric level matching an all-or-nothing local result."""
+    points = criterion.get("points", 0) if passed else 0
+    for level in criterion.get("sub_criteria") or []:
+        if isinstance(level, dict) and level.get("pts") == points:
+            return level.get("level")
+    return "Correct" if passed else "Incorrect"
+
+def _run_local(checks, sheet, workbook_data):
+    """Runs the checks of one criterion. Returns (passed, feedback, evidence)."""
+    entry = workbook_data["sheets"][sheet]
+    cells, metadata = entry.get("cells", {}), entry.get("metadata", {})
+    feedback, evidence = [], []
+    passed = True
+    for check in checks:
+        earned, fb = evaluate_criteria(cells, dict(check, points=1), metadata)
+        passed = passed and earned == 1
+        feedback.extend(fb)
+        text = _evidence(check, cells, metadata)
+        if text not in evidence:
+            evidence.append(text)
+    return passed, feedback, f"[{sheet}] " + " | ".join(evidence)
+
+
+def schedule_rubric(rubric, workbook_data):
+    """
+    Grades the locally checkable criteria of a structured rubric against a parsed
+    workbook (parse_workbook_to_json output) and returns what's left for the model:
+    {
+        "results":   [ Edvisor result entries ({_id, obtainedPoints, explanation, evidence,
+                       achievedLevel}, plus "graded_by": "local") ],
+        "rubric":    the rubric reduced to the remaining criteria (same shape), or None,
+        "order":     every criterion _id in rubric order,
+        "flat_rubric": all criteria (with _ids),
+        "stats":     {"local": n, "llm": n, "deferred": n}
+    }
+    Criteria without an _id get one ("T1_crit_2"), in the rubric handed back too.
+    Text rubrics and non-workbook submissions come back untouched (everything for the model).
+    """
+    plan = {"results": [], "rubric": rubric, "order": [], "flat_rubric": flatten_rubric(rubric),
+            "stats": {"local": 0, "llm": 0, "deferred": 0}}
+    if not plan["flat_rubric"] or not isinstance(workbook_data, dict) or "sheets" not in workbook_data:
+        plan["stats"]["llm"] = len(plan["flat_rubric"])
+        return plan
+
+    rubric = copy.deepcopy(rubric)
+    if isinstance(rubric, dict):
+        tasks = rubric["tasks"]
+    else:
+        tasks = [{"criteria": rubric}]
+    sheets = workbook_data["sheets"]
+
+    remaining_tasks = []
+    for i, task in enumerate(tasks):
+        remaining = []
+        for j, crit in enumerate(task.get("criteria", [])):
+            if not isinstance(crit, dict):
+                remaining.append(crit)
+                continue
+            crit.setdefault("_id", f"T{i + 1}_crit_{j + 1}")
+            plan["order"].append(str(crit["_id"]))
+
+            kind = classify_criterion(crit)
+            sheet = resolve_sheet(task if isinstance(rubric, dict) else None, list(sheets), crit) if kind != "llm" else None
+            if sheet is None:
+                plan["stats"]["llm"] += 1
+                remaining.append(crit)
+                continue
+
+            if kind == "local":
+                crit.setdefault("name", crit.get("description") or f"Check {crit.get('type')} at {crit.get('cell') or sheet}")
+                checks = [crit]
+            else:
+                charts = chart_details(sheets[sheet].get("metadata", {}))
+                if len(charts) > 1:
+                    plan["stats"]["llm"] += 1
+                    remaining.append(crit)
+                    continue
+                # Pinned to the one chart, so all the clauses are checked on it
+                checks = [dict(check, chart=1) for check in infer_checks(crit.get("description") or crit.get("name"))]
+            passed, feedback, evidence = _run_local(checks, sheet, workbook_data)
+            if not passed and kind == "inferred":
+                plan["stats"]["deferred"] += 1
+                remaining.append(crit)
+                continue
+
+            plan["stats"]["local"] += 1
+            plan["results"].append({
+                "_id": crit["_id"],
+                "obtainedPoints": crit.get("points", 0) if passed else 0,
+                "explanation": "Your workbook meets this requirement." if passed else
+                               "; ".join(feedback) or "Your workbook does not meet this requirement.",
+                "evidence": evidence,
+                "achievedLevel": _level(crit, passed),
+                "graded_by": "local"
+            })
+        if remaining:
+            remaining_tasks.append(dict(task, criteria=remaining))
+
+    plan["flat_rubric"] = flatten_rubric(rubric)
+    if not remaining_tasks:
+        plan["rubric"] = None
+    elif isinstance(rubric, dict):
+        plan["rubric"] = dict(rubric, tasks=remaining_tasks)
+    else:
+        plan["rubric"] = remaining_tasks[0]["criteria"]
+    return plan
+
+def merge_local_results(report, plan):
+    """
+    Folds the local results of a plan into a grading report (the "report" of
+    grade_student_work, or {} when no model call was needed): results and UI criteria
+    in rubric order, score recomputed over the whole rubric.
+    """
+    by_id = {str(r["_id"]): r for r in plan["results"]}
+    known = set(plan["order"])
+    extra = []
+    for res in report.get("result", []):
+        _id = str(res.get("_id"))
+        if _id not in known:
+            extra.append(res)  # an id the model made up: keep it visible
+        else:
+            # Local results are final; the model only graded what it was sent
+            by_id.setdefault(_id, res)
+    ordered = [by_id[_id] for _id in plan["order"] if _id in by_id] + extra
+
+    report["result"] = ordered
+    report["criteria"] = map_results_to_ui(ordered, plan["flat_rubric"])
+
+    earned = sum(float(r.get("obtainedPoints") or 0) for r in ordered)
+    maximum = sum(float(c.get("points") or 0) for c in plan["flat_rubric"] if isinstance(c, dict))
+    percent = 100.0 * earned / maximum if maximum else 0.0
+    report["score"] = {"earned": round(earned, 2), "max": round(maximum, 2), "letter": letter_grade(percent)}
+
+    stats = plan["stats"]
+    note = f"{stats['local']} of {len(plan['order'])} criteria were verified automatically from the workbook."
+    report["summary"] = f"{report['summary']}\n\n{note}" if report.get("summary") else note
+    report["schedule"] = stats
+    report.setdefault("incorrect_cells", [])
+    return report
@@ -0,0 +1,178 @@
+import asyncio
+from utils.llm_helper import flatten_rubric, grade_student_work_async, letter_grade, map_results_to_ui
+from utils.prompt_encoding import compact_json, encode_for_prompt
+from utils.request_governor import estimate_tokens
+from utils.rubric_extractor import find_referenced_sheets
+from utils.xml_helper import referenced_sheet_names
+
+# Map-reduce grading: one prompt per rubric task, holding only that task's criteria and
+# the sheets it is about (plus the sheets their formulas and charts read from), run
+# concurrently while the estimated prompt tokens in flight stay under a budget. The
+# per-task answers are combined locally into the usual grade_student_work report.
+
+MAX_TOKENS_IN_FLIGHT = 400000
+
+
+class TokenBudget:
+    """Async counting semaphore weighted by tokens; a prompt above the limit runs alone."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self, tokens):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.in_use == 0 or self.in_use + tokens <= self.limit)
+            self.in_use += tokens
+
+    async def release(self, tokens):
+        async with self._changed:
+            self.in_use -= tokens
+            self._changed.notify_all()
+
+
+def _sheet_names(data):
+    return list(data.get("sheets", {})) + list(data.get("added_sheets", {}))
+
+def linked_sheets(entry, sheet_names):
+    """Other sheets a sheet's formulas, charts, sparklines and validation lists read from."""
+    folded = {name.strip().casefold(): name for name in sheet_names}
+    return {folded[name] for name in referenced_sheet_names(entry) if name in folded}
+
+def task_sheets(task, data):
+    """The sheets of data a task needs, or None for all of them."""
+    names = _sheet_names(data) if isinstance(data, dict) else []
+    sheets = find_referenced_sheets({"tasks": [task]}, names) if names else None
+    if not sheets:
+        return None
+    entries = dict(data.get("sheets", {}), **data.get("added_sheets", {}))
+    for name in list(sheets):
+        entry = entries.get(name)
+        if isinstance(entry, dict) and "cells" in entry:
+            sheets |= linked_sheets(entry, names)
+    return sheets
+
+def restrict_to_sheets(data, sheets):
+    """A parsed workbook (or template delta) reduced to the given sheets; the rest is listed as skipped."""
+    if sheets is None or not isinstance(data, dict) or "sheets" not in data:
+        return data
+    restricted = dict(data, sheets={n: e for n, e in data["sheets"].items() if n in sheets})
+    if "added_sheets" in data:
+        restricted["added_sheets"] = {n: e for n, e in data["added_sheets"].items() if n in sheets}
+    for key in ("removed_sheets", "unchanged_sheets"):
+        if key in data:
+            restricted[key] = [n for n in data[key] if n in sheets]
+    meta = dict(data.get("workbook_metadata") or {})
+    skipped = dict(meta.get("skipped_sheets") or {})
+    for name in _sheet_names(data):
+        if name not in sheets:
+            skipped[name] = "Graded with another rubric task; omitted here."
+    if skipped:
+        meta["skipped_sheets"] = skipped
+    restricted["workbook_metadata"] = meta
+    return restricted
+
+def restrict_diff(key_diff, sheets):
+    """A diff_workbooks result reduced to the issues on the given sheets."""
+    if key_diff is None or sheets is None:
+        return key_diff
+    restricted = dict(key_diff)
+    for key in ("incorrect_cells", "review", "equivalent"):
+        restricted[key] = [i for i in key_diff.get(key, []) if not i.get("sheet") or i["sheet"] in sheets]
+    return restricted
+
+def split_by_task(student_data, rubric_data, answer_key_data=None, key_diff=None):
+    """
+    One grade_student_work request per rubric task:
+    [{"task": name, "tokens": estimated prompt tokens, "request": {student_data, rubric_data,
+      answer_key_data, key_diff}}]. Rubrics without several tasks give a single request.
+    """
+    tasks = rubric_data.get("tasks") if isinstance(rubric_data, dict) else None
+    if not tasks or len(tasks) < 2:
+        tasks = None
+    jobs = []
+    for task in tasks or [None]:
+        if task is None:
+            rubric, sheets = rubric_data, None
+        else:
+            rubric, sheets = dict(rubric_data, tasks=[task]), task_sheets(task, student_data)
+        request = {
+            "student_data": restrict_to_sheets(student_data, sheets),
+            "rubric_data": rubric,
+            "answer_key_data": restrict_to_sheets(answer_key_data, sheets),
+            "key_diff": restrict_diff(key_diff, sheets)
+        }
+        tokens = sum(estimate_tokens(encode_for_prompt(request[k]))
+                     for k in ("student_data", "rubric_data", "answer_key_data") if request[k])
+        if request["key_diff"] is not None:
+            tokens += estimate_tokens(compact_json(request["key_diff"]))
+        jobs.append({"task": task.get("name") if task else None, "tokens": tokens, "request": request})
+    return jobs
+
+def combine_reports(jobs, responses, rubric_data, key_diff=None):
+    """Reduces the per-task grade_student_work answers to one report (same shape)."""
+    flat_rubric = flatten_rubric(rubric_data)
+    results, summaries, incorrect, errors, prompts = [], [], [], [], []
+    for job, response in zip(jobs, responses):
+        report = response.get("report", {})
+        prompts.append(response.get("prompt", ""))
+        label = job["task"] or "Rubric"
+        if "error" in report:
+            errors.append(f"{label}: {report['error']}")
+            continue
+        results.extend(report.get("result", []))
+        incorrect.extend(report.get("incorrect_cells", []))
+        if report.get("summary"):
+            summaries.append(f"{label}: {report['summary']}" if job["task"] else report["summary"])
+
+    if errors and not results:
+        return {"report": {"error": "Grading failed: " + "; ".join(errors)}, "prompt": "\n\n".join(prompts)}
+
+    # Rubric order, whatever order the tasks came back in
+    order = {str(c.get("_id")): i for i, c in enumerate(flat_rubric) if isinstance(c, dict)}
+    results.sort(key=lambda r: order.get(str(r.get("_id")), len(order)))
+    earned = sum(float(r.get("obtainedPoints") or 0) for r in results)
+    maximum = sum(float(c.get("points") or 0) for c in flat_rubric if isinstance(c, dict))
+    percent = 100.0 * earned / maximum if maximum else 0.0
+    report = {
+        "summary": "\n\n".join(summaries),
+        "score": {"earned": round(earned, 2), "max": round(maximum, 2), "letter": letter_grade(percent)},
+        "result": results,
+        "incorrect_cells": key_diff["incorrect_cells"] if key_diff is not None else incorrect,
+        "criteria": map_results_to_ui(results, flat_rubric),
+        "mode": "edvisor_map_reduce",
+        "tasks_graded": len(jobs) - len(errors)
+    }
+    if errors:
+        report["errors"] = errors
+    return {"report": report, "prompt": "\n\n=====\n\n".join(prompts)}
+
+async def grade_by_task_async(student_data, rubric_data=None, answer_key_data=None, key_diff=None,
+                              max_tokens_in_flight=MAX_TOKENS_IN_FLIGHT):
+    """
+    grade_student_work, one task at a time: every task is graded in its own prompt, the
+    prompts run concurrently with at most max_tokens_in_flight estimated prompt tokens
+    outstanding, and the answers are combined into one report.
+    """
+    jobs = split_by_task(student_data, rubric_data, answer_key_data, key_diff)
+    if len(jobs) == 1:
+        return await grade_student_work_async(**jobs[0]["request"])
+
+    budget = TokenBudget(max_tokens_in_flight)
+
+    async def grade(job):
+        await budget.acquire(job["tokens"])
+        try:
+            return await grade_student_work_async(**job["request"])
+        finally:
+            await budget.release(job["tokens"])
+
+    responses = await asyncio.gather(*(grade(job) for job in jobs))
+    return combine_reports(jobs, responses, rubric_data, key_diff)
+
+def grade_by_task(student_data, rubric_data=None, answer_key_data=None, key_diff=None,
+                  max_tokens_in_flight=MAX_TOKENS_IN_FLIGHT):
+    """Synchronous grade_by_task_async."""
+    return asyncio.run(grade_by_task_async(student_data, rubric_data, answer_key_data, key_diff,
+                                           max_tokens_in_flight))
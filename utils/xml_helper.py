@@ -1,5 +1,13 @@
 import xml.etree.ElementTree as ET
 import os
+import posixpath
+import re
+from collections import Counter
+from contextlib import contextmanager
+from utils.cell_store import NO_FORMULA, SheetCells
+from utils.package import BasePackage, MemoryPackage, open_package
+from utils.part_cache import get_part_cache
+from utils.parse_cache import get_parse_cache
 
 # Excel XML Namespaces
 NS = {
@@ -12,17 +20,198 @@ NS = {
     'xm': 'http://schemas.microsoft.com/office/excel/2006/main'
 }
 
+# Bump whenever the output of parse_workbook_to_json or extract_rubric_from_sheet changes,
+# so results cached on disk (see utils.parse_cache) are not served for the old format.
+PARSER_VERSION = 2
 
-def parse_chart_xml(chart_path):
+# Sheet prefix of a cross-sheet reference: 'My Sheet'!A1 or Data!A1
+SHEET_REF_RE = re.compile(r"(?:'((?:[^']|'')+)'|([A-Za-z_][\w.]*))!")
+
+
+def _part_exists(path, package=None):
+    if package is not None:
+        return package.exists(package.part_name(path))
+    return os.path.exists(path)
+
+def _parse_xml(path, package=None):
+    """
+    Parses a plain XML file path, or a part of a package when one is given.
+    """
+    if package is not None:
+        with package.open(package.part_name(path)) as f:
+            return ET.parse(f).getroot()
+    return ET.parse(path).getroot()
+
+
+class Workbook(BasePackage):
+    """
+    Parse-once model of a workbook package.
+    Every OOXML part (rels, workbook.xml, styles, shared strings, drawings, charts,
+    pivot tables) is parsed at most once and memoized; the module-level helpers
+    below are views over it. A Workbook can be passed anywhere a package or
+    unzip_dir is accepted.
+    parse_counts maps part name -> number of times it was read, so tests can assert
+    that nothing is parsed twice.
+    Styles, charts, pivot tables and shared strings are also looked up by content in
+    part_cache (see utils.part_cache), shared by every Workbook in the process, so
+    parts copied from a common template are parsed once per batch.
+    """
+
+    def __init__(self, source, part_cache=None):
+        self._owns_package = not isinstance(source, BasePackage)
+        self.package = open_package(source)
+        self.part_cache = part_cache if part_cache is not None else get_part_cache()
+        self.parse_counts = Counter()
+        self._memo = {}
+
+    @property
+    def parse_count(self):
+        """Total number of part reads so far."""
+        return sum(self.parse_counts.values())
+
+    # Package interface: reads go through open() so they are counted
+    def exists(self, part):
+        return self.package.exists(part)
+
+    def open(self, part):
+        self.parse_counts[part] += 1
+        return self.package.open(part)
+
+    def locate(self, part):
+        return self.package.locate(part)
+
+    def part_name(self, location):
+        return self.package.part_name(location)
+
+    def close(self):
+        if self._owns_package:
+            self.package.close()
+
+    def _memoized(self, kind, part, loader):
+        key = (kind, part)
+        if key not in self._memo:
+            self._memo[key] = loader()
+        return self._memo[key]
+
+    def read_rels(self, part):
+        return self._memoized('rels', part, lambda: BasePackage.read_rels(self, part))
+
+    def workbook_root(self):
+        """Root element of xl/workbook.xml (None if missing)."""
+        def load():
+            if not self.exists('xl/workbook.xml'):
+                return None
+            return _parse_xml('xl/workbook.xml', self)
+        return self._memoized('xml', 'xl/workbook.xml', load)
+
+    def sheet_map(self):
+        """Sheet Name -> sheet part name, e.g. { "Data": "xl/worksheets/sheet1.xml" }"""
+        def load():
+            root = self.workbook_root()
+            if root is None:
+                raise FileNotFoundError("workbook.xml not found")
+            rels = self.read_rels('xl/workbook.xml')
+
+            sheets = {}
+            # <sheets> <sheet name="Data" sheetId="1" r:id="rId1"/> ...
+            for sheet in root.findall('.//main:sheet', NS):
+                rId = sheet.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
+                if rId in rels:
+                    sheets[sheet.get('name')] = rels[rId]["target"]
+            return sheets
+        return self._memoized('sheet_map', 'xl/workbook.xml', load)
+
+    def defined_names(self):
+        """Defined Names (Named Ranges, Solver Settings): name -> formula text."""
+        def load():
+            names = {}
+            root = self.workbook_root()
+            dns = root.find('main:definedNames', NS) if root is not None else None
+            if dns is not None:
+                 for dn in dns.findall('main:definedNames/main:definedName', NS) or dns.findall('main:definedName', NS):
+                     names[dn.get('name')] = dn.text
+            return names
+        return self._memoized('defined_names', 'xl/workbook.xml', load)
+
+    def _shared_part(self, kind, part, reader):
+        """
+        Reads a part's bytes and parses them through the content-keyed part cache.
+        reader(part, package) is the raw parser.
+        """
+        if not self.exists(part):
+            return reader(part, self)
+        data = self.read(part)
+        return self.part_cache.get(kind, data, lambda: reader(part, MemoryPackage({part: data})))
+
+    def shared_strings(self):
+        def load():
+            if not self.exists('xl/sharedStrings.xml'):
+                return []
+            return _read_shared_strings_chunked(self.read('xl/sharedStrings.xml'), self.part_cache)
+        return self._memoized('shared_strings', 'xl/sharedStrings.xml', load)
+
+    def styles(self):
+        return self._memoized('styles', 'xl/styles.xml',
+                              lambda: self._shared_part('styles', 'xl/styles.xml', lambda part, pkg: _read_styles_xml(pkg)))
+
+    def compact_styles(self):
+        """style_idx -> shared compact style dict, for non-default styles only."""
+        return self._memoized('compact_styles', 'xl/styles.xml', lambda: _compact_style_table(self.styles()))
+
+    def drawing(self, part):
+        return self._memoized('drawing', part, lambda: _read_drawing_xml(part, self))
+
+    def chart(self, part):
+        return self._memoized('chart', part, lambda: self._shared_part('chart', part, _read_chart_xml))
+
+    def pivot_table(self, part):
+        return self._memoized('pivot_table', part, lambda: self._shared_part('pivot_table', part, _read_pivot_table_xml))
+
+    def sheet_dimension(self, part):
+        """
+        Returns the used range of a sheet (e.g. "A1:K40") from its <dimension> element,
+        reading only the head of the sheet XML.
+        """
+        if not self.exists(part):
+            return ""
+        with self.open(part) as f:
+            for _, elem in ET.iterparse(f, events=('start',)):
+                if elem.tag == f"{{{NS['main']}}}dimension":
+                    return elem.get('ref') or ""
+                if elem.tag == f"{{{NS['main']}}}sheetData":
+                    break
+        return ""
+
+@contextmanager
+def workbook_from(source):
+    """
+    Yields a Workbook for source (reusing it if it already is one) and closes
+    it afterwards if it was created here.
+    """
+    if isinstance(source, Workbook):
+        yield source
+        return
+    workbook = Workbook(source)
+    try:
+        yield workbook
+    finally:
+        workbook.close()
+
+def parse_chart_xml(chart_path, package=None):
     """
     Parses a chart XML and returns a dict of formatting details.
+    chart_path is a file path, or a part name when a package is given.
     """
-    if not os.path.exists(chart_path):
+    if isinstance(package, Workbook):
+        return package.chart(package.part_name(chart_path))
+    return _read_chart_xml(chart_path, package)
+
+def _read_chart_xml(chart_path, package=None):
+    if not _part_exists(chart_path, package):
         return {}
         
     try:
-        tree = ET.parse(chart_path)
-        root = tree.getroot()
+        root = _parse_xml(chart_path, package)
         
         chart_info = {
             "types": [],
@@ -123,16 +312,21 @@ def parse_chart_xml(chart_path):
     except Exception as e:
         return {"error": f"Failed to parse chart XML: {str(e)}"}
 
-def parse_pivot_table_xml(pivot_path):
+def parse_pivot_table_xml(pivot_path, package=None):
     """
     Parses a Pivot Table XML to extract its structure (rows, columns, data fields).
+    pivot_path is a file path, or a part name when a package is given.
     """
-    if not os.path.exists(pivot_path):
+    if isinstance(package, Workbook):
+        return package.pivot_table(package.part_name(pivot_path))
+    return _read_pivot_table_xml(pivot_path, package)
+
+def _read_pivot_table_xml(pivot_path, package=None):
+    if not _part_exists(pivot_path, package):
         return {}
         
     try:
-        tree = ET.parse(pivot_path)
-        root = tree.getroot()
+        root = _parse_xml(pivot_path, package)
         
         info = {
             "name": root.get('name'),
@@ -183,15 +377,19 @@ def parse_pivot_table_xml(pivot_path):
 def parse_drawing_xml(drawing_path, unzip_dir):
     """
     Parses a drawing XML to find shapes, connectors, and charts.
+    unzip_dir can be an extracted directory, a package or a Workbook.
     """
-    if not os.path.exists(drawing_path):
+    with workbook_from(unzip_dir) as workbook:
+        return workbook.drawing(workbook.part_name(drawing_path))
+
+def _read_drawing_xml(drawing_part, package):
+    if not package.exists(drawing_part):
         return {"objects": []}
-        
+
     try:
-        tree = ET.parse(drawing_path)
-        root = tree.getroot()
+        root = _parse_xml(drawing_part, package)
         results = {"objects": []}
-        
+
         # 1. Look for Shapes (sp)
         for sp in root.findall('.//xdr:sp', NS):
              nvsp = sp.find('xdr:nvSpPr', NS)
@@ -205,23 +403,21 @@ def parse_drawing_xml(drawing_path, unzip_dir):
              results["objects"].append({"type": "connector", "name": name})
 
         # 3. Look for Charts
-        drawing_filename = os.path.basename(drawing_path)
-        chart_rels = parse_drawing_rels(unzip_dir, drawing_filename)
-        
+        chart_rels = package.read_rels(drawing_part)
+
         for graphic in root.findall('.//a:graphic', NS):
              chart_ref = graphic.find('.//c:chart', NS)
              if chart_ref is not None:
                  rid = chart_ref.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
-                 chart_target = chart_rels.get(rid)
-                 if chart_target:
-                     chart_full_path = os.path.join(unzip_dir, 'xl', chart_target)
-                     chart_details = parse_chart_xml(chart_full_path)
+                 chart_rel = chart_rels.get(rid)
+                 if chart_rel and not chart_rel["external"]:
+                     chart_details = parse_chart_xml(chart_rel["target"], package)
                      results["objects"].append({
                          "type": "chart",
                          "rId": rid,
                          "details": chart_details
                      })
-                     
+
         return results
     except Exception as e:
         return {"error": f"Failed to parse drawing XML: {str(e)}", "objects": []}
@@ -229,37 +425,69 @@ def parse_drawing_xml(drawing_path, unzip_dir):
 def parse_drawing_rels(unzip_dir, drawing_filename):
     """
     Parses xl/drawings/_rels/drawing[N].xml.rels to find chart targets.
+    Targets are returned relative to xl/, e.g. { "rId1": "charts/chart1.xml" }.
     """
-    rels_path = os.path.join(unzip_dir, 'xl', 'drawings', '_rels', f'{drawing_filename}.rels')
-    if not os.path.exists(rels_path):
-        return {}
-        
     try:
-        tree = ET.parse(rels_path)
-        root = tree.getroot()
-        
-        rels = {}
-        for rel in root.findall('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'):
-            rId = rel.get('Id')
-            target = rel.get('Target')
-            if target.startswith('../charts/'):
-                target = target.replace('../charts/', 'charts/')
-            rels[rId] = target
-        return rels
+        with workbook_from(unzip_dir) as workbook:
+            rels = workbook.read_rels(f'xl/drawings/{drawing_filename}')
+        return {rId: posixpath.relpath(info["target"], 'xl') if not info["external"] else info["target"]
+                for rId, info in rels.items()}
     except:
         return {}
 
-def parse_styles_xml(unzip_dir):
+def parse_styles_xml(unzip_dir, compact=False):
     """
     Parses styles.xml and returns a dictionary mapping style index to human-readable formatting.
+    With compact=True, returns the pruned per-index table used for the JSON dump instead
+    (see compact_style): { style_idx: compact style } for the non-default styles only.
+    """
+    with workbook_from(unzip_dir) as workbook:
+        return workbook.compact_styles() if compact else workbook.styles()
+
+def compact_style(full_style):
+    """
+    Prunes a full cell style down to the non-default parts worth sending to the grader.
+    Returns an empty dict for a default-looking style.
     """
-    styles_path = os.path.join(unzip_dir, 'xl', 'styles.xml')
-    if not os.path.exists(styles_path):
+    compact = {}
+
+    # 1. Fill (Shading)
+    if full_style.get('fill', {}).get('pattern') != 'none':
+        compact['fill'] = full_style['fill']
+
+    # 2. Border (Key for "Separator Lines")
+    if full_style.get('border'):
+        compact['border'] = full_style['border']
+
+    # 3. Number Format
+    num_fmt = full_style.get('num_fmt')
+    if num_fmt and num_fmt not in ['0', 'General']:
+        compact['num_fmt'] = num_fmt
+
+    # 4. Font (Bold/Italic)
+    font = full_style.get('font', {})
+    if font.get('bold') or font.get('italic'):
+        compact['font'] = {k: v for k, v in font.items() if v}
+
+    return compact
+
+def _compact_style_table(styles):
+    # Computed once per style index (a workbook has dozens of cellXfs against
+    # thousands of cells); every cell with that index shares the same dict.
+    table = {}
+    for idx, full_style in styles.items():
+        if isinstance(full_style, dict):
+            compact = compact_style(full_style)
+            if compact:
+                table[idx] = compact
+    return table
+
+def _read_styles_xml(package):
+    if not package.exists('xl/styles.xml'):
         return {}
 
     try:
-        tree = ET.parse(styles_path)
-        root = tree.getroot()
+        root = _parse_xml('xl/styles.xml', package)
 
         # 1. Number Formats (Custom)
         # Built-in IDs below 164 are usually: 0=General, 1=Decimal, 2=Fixed, 3=Comma, 4=Percentage, etc.
@@ -331,66 +559,39 @@ def parse_workbook_rels(unzip_dir):
     """
     Parses workbook.xml.rels to map rIds to file paths (like worksheets).
     Useful if workbook.xml uses rIds to reference sheets.
+    Targets are returned relative to xl/, e.g. { "rId1": "worksheets/sheet1.xml" }.
     """
-    rels_path = os.path.join(unzip_dir, 'xl', '_rels', 'workbook.xml.rels')
-    if not os.path.exists(rels_path):
-        return {}
-    
-    tree = ET.parse(rels_path)
-    root = tree.getroot()
-    # Namespace for Relationships usually: http://schemas.openxmlformats.org/package/2006/relationships
-    # But usually parsing without specific NS for attributes is easier or using the default one
-    
-    rels = {}
-    for rel in root.findall('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'):
-        rId = rel.get('Id')
-        target = rel.get('Target')
-        rels[rId] = target
-    return rels
+    with workbook_from(unzip_dir) as workbook:
+        rels = workbook.read_rels('xl/workbook.xml')
+    return {rId: posixpath.relpath(info["target"], 'xl') if not info["external"] else info["target"]
+            for rId, info in rels.items()}
 
 def get_sheet_map(unzip_dir):
     """
-    Returns a dict mapping Sheet Name -> Absolute Path to sheet XML.
-    Example: { "Data": "/tmp/xl/worksheets/sheet1.xml" }
+    Returns a dict mapping Sheet Name -> location of the sheet XML.
+    For an extracted directory that is the absolute path, e.g. { "Data": "/tmp/xl/worksheets/sheet1.xml" };
+    for a zip-backed package it is the part name, e.g. { "Data": "xl/worksheets/sheet1.xml" }.
     """
-    workbook_path = os.path.join(unzip_dir, 'xl', 'workbook.xml')
-    if not os.path.exists(workbook_path):
-        raise FileNotFoundError("workbook.xml not found")
-        
-    tree = ET.parse(workbook_path)
-    root = tree.getroot()
-    
-    sheets = {}
-    rels = parse_workbook_rels(unzip_dir)
-    
-    # <sheets> <sheet name="Data" sheetId="1" r:id="rId1"/> ...
-    for sheet in root.findall('.//main:sheet', NS):
-        name = sheet.get('name')
-        rId = sheet.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
-        
-        # Resolve target path
-        if rId in rels:
-            # target is usually relative to xl/ like "worksheets/sheet1.xml"
-            target = rels[rId]
-            # normalized path calculation
-            full_path = os.path.normpath(os.path.join(unzip_dir, 'xl', target))
-            sheets[name] = full_path
-            
-    return sheets
+    with workbook_from(unzip_dir) as workbook:
+        return {name: workbook.locate(part) for name, part in workbook.sheet_map().items()}
 
 def get_shared_strings(unzip_dir):
     """
     Parses sharedStrings.xml and returns a list of strings.
     """
-    ss_path = os.path.join(unzip_dir, 'xl', 'sharedStrings.xml')
+    with workbook_from(unzip_dir) as workbook:
+        return workbook.shared_strings()
+
+def _read_shared_strings(package):
     strings = []
-    
-    if not os.path.exists(ss_path):
+
+    if not package.exists('xl/sharedStrings.xml'):
         return strings # Return empty if no shared strings
-        
-    tree = ET.parse(ss_path)
-    root = tree.getroot()
-    
+    root = _parse_xml('xl/sharedStrings.xml', package)
+    return _shared_strings_from(root)
+
+def _shared_strings_from(root):
+    strings = []
     # <si> <t>Value</t> </si>
     for si in root.findall('main:si', NS):
         # Text can be in <t> directly or inside <r><t> (rich text)
@@ -400,6 +601,36 @@ def get_shared_strings(unzip_dir):
         
     return strings
 
+# sharedStrings.xml is cached in runs of SST_CHUNK <si> items: a student's own strings
+# only invalidate the chunks they land in, the template's strings stay shared.
+SST_CHUNK = 256
+SST_START_RE = re.compile(rb"<sst\b[^>]*>")
+SI_START_RE = re.compile(rb"<si[\s>/]")
+XMLNS_ATTR_RE = re.compile(rb"""\sxmlns(?::[\w.-]+)?=("[^"]*"|'[^']*')""")
+
+def _read_shared_strings_chunked(data, part_cache):
+    start = SST_START_RE.search(data)
+    end = data.rfind(b"</sst>")
+    if start is None or end < start.end():
+        # Prefixed or otherwise unusual markup: parse it whole
+        return part_cache.get('shared_strings', data,
+                              lambda: _read_shared_strings(MemoryPackage({'xl/sharedStrings.xml': data})))
+
+    # count/uniqueCount change with every edit; keep only the namespace declarations
+    sst_open = b"<sst" + b"".join(m.group(0) for m in XMLNS_ATTR_RE.finditer(start.group(0))) + b">"
+    body_start = start.end()
+    bounds = [m.start() for m in SI_START_RE.finditer(data, body_start, end)][::SST_CHUNK]
+    if not bounds:
+        return []
+    bounds.append(end)
+
+    strings = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        # Each chunk is wrapped in <sst> with the original namespaces so its prefixes still resolve
+        chunk = sst_open + data[lo:hi] + b"</sst>"
+        strings.extend(part_cache.get('shared_strings', chunk, lambda: _shared_strings_from(ET.fromstring(chunk))))
+    return strings
+
 def parse_sheet_data(sheet_xml_path, shared_strings):
     """
     Parses a sheet XML and returns a dict of cell data.
@@ -446,93 +677,95 @@ def parse_sheet_rels(unzip_dir, sheet_filename):
     """
     Parses the .rels file for a specific sheet to find related objects like PivotTables.
     sheet_filename e.g. "sheet1.xml"
+    Targets are returned as written in the .rels (e.g. "../pivotTables/pivotTable1.xml").
     """
-    rels_path = os.path.join(unzip_dir, 'xl', 'worksheets', '_rels', f'{sheet_filename}.rels')
-    if not os.path.exists(rels_path):
-        return {}
-        
-    tree = ET.parse(rels_path)
-    root = tree.getroot()
-    
-    rels = {}
-    for rel in root.findall('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'):
-        rId = rel.get('Id')
-        target = rel.get('Target')
-        type_uri = rel.get('Type')
-        rels[rId] = {"target": target, "type": type_uri}
-    return rels
+    with workbook_from(unzip_dir) as workbook:
+        rels = workbook.read_rels(f'xl/worksheets/{sheet_filename}')
+    return {rId: {"target": posixpath.relpath(info["target"], 'xl/worksheets') if not info["external"] else info["target"],
+                  "type": info["type"]}
+            for rId, info in rels.items()}
 
-def parse_sheet_full(sheet_xml_path, shared_strings, unzip_dir=None, sheet_filename=None):
+SPARKLINE_GROUPS_TAG = f"{{{NS['x14']}}}sparklineGroups"
+
+def _cell_from_elem(c, shared_strings):
     """
-    Parses a sheet XML and returns (cells, metadata).
-    metadata includes validations, conditional formatting, and drawing refs.
-    If unzip_dir and sheet_filename are provided, checks .rels for Pivot tables.
+    Converts a single <c> element into (coord, cell_dict).
     """
-    if not os.path.exists(sheet_xml_path):
-        return {}, {}
-        
-    tree = ET.parse(sheet_xml_path)
-    root = tree.getroot()
-    
-    cells = {}
-    metadata = {
-        "validations": [],
-        "conditional_formatting": [],
-        "drawings": [],
-        "sparklines": [],
-        "merge_cells": [],
-        "view_settings": {}
+    coord = c.get('r') # e.g., "A1"
+    sBox = c.get('s')
+    t = c.get('t')
+
+    formula_elem = c.find('main:f', NS)
+    val_elem = c.find('main:v', NS)
+
+    formula = formula_elem.text if formula_elem is not None else None
+    formula_type = formula_elem.get('t') if formula_elem is not None else "normal"
+    formula_ref = formula_elem.get('ref') if formula_elem is not None else ""
+
+    raw_val = val_elem.text if val_elem is not None else ""
+    final_val = raw_val
+
+    if t == 's': # Shared String lookup
+        try:
+            idx = int(raw_val)
+            final_val = shared_strings[idx]
+        except (ValueError, IndexError):
+            final_val = "ERROR_STRING_LOOKUP"
+
+    return coord, {
+        "value": final_val,
+        "formula": formula,
+        "formula_type": formula_type,
+        "formula_ref": formula_ref,
+        "style_idx": sBox,
     }
-    
-    # 1. Parse Cells
-    for c in root.findall('.//main:c', NS):
-        coord = c.get('r') # e.g., "A1"
-        sBox = c.get('s') 
-        t = c.get('t') 
-        
-        formula_elem = c.find('main:f', NS)
-        val_elem = c.find('main:v', NS)
-        
-        formula = formula_elem.text if formula_elem is not None else None
-        formula_type = formula_elem.get('t') if formula_elem is not None else "normal"
-        formula_ref = formula_elem.get('ref') if formula_elem is not None else ""
-        
-        raw_val = val_elem.text if val_elem is not None else ""
-        final_val = raw_val
-        
-        if t == 's': # Shared String lookup
-            try:
-                idx = int(raw_val)
-                final_val = shared_strings[idx]
-            except (ValueError, IndexError):
-                final_val = "ERROR_STRING_LOOKUP"
-        
-        cells[coord] = {
-            "value": final_val,
-            "formula": formula,
-            "formula_type": formula_type,
-            "formula_ref": formula_ref,
-            "style_idx": sBox,
-        }
-    
-    # 2. Extract Data Validations
-    # <dataValidations> <dataValidation type="list" ...> ...
-    dvs = root.find('main:dataValidations', NS)
-    if dvs is not None:
-        for dv in dvs.findall('main:dataValidation', NS):
-             dv_info = {
+
+def _store_cell_elem(cells, c, shared_strings, prev):
+    """
+    Adds a single <c> element to a SheetCells without building the intermediate dict.
+    prev is the (row, col) of the previous cell; it locates cells that omit r="...".
+    Returns the (row, col) of this cell.
+    """
+    coord = c.get('r') or (prev[0], prev[1] + 1)
+    s_attr = c.get('s')
+
+    formula = NO_FORMULA
+    formula_elem = c.find('main:f', NS)
+    if formula_elem is not None:
+        formula = (formula_elem.text, formula_elem.get('t'), formula_elem.get('ref'))
+
+    raw_val = c.findtext('main:v', default="", namespaces=NS) or ""
+    value, sst_idx = raw_val, -1
+    if c.get('t') == 's': # Shared String lookup (kept as an index)
+        try:
+            sst_idx = int(raw_val)
+            shared_strings[sst_idx]
+        except (ValueError, IndexError):
+            value, sst_idx = "ERROR_STRING_LOOKUP", -1
+
+    return cells.add(coord, value, sst_idx, int(s_attr) if s_attr and s_attr.isdigit() else -1, formula)
+
+def _collect_sheet_section(elem, metadata, refs):
+    """
+    Copies a top-level worksheet section (anything outside <sheetData>) into metadata.
+    Drawing rIds are stored in refs so the caller can resolve them against the sheet rels.
+    """
+    tag = elem.tag.split('}')[-1]
+
+    if tag == 'dataValidations':
+        # <dataValidations> <dataValidation type="list" ...> ...
+        for dv in elem.findall('main:dataValidation', NS):
+             metadata['validations'].append({
                  "type": dv.get('type'),
                  "sqref": dv.get('sqref'),
                  "formula1": dv.findtext('main:formula1', default="", namespaces=NS),
                  "formula2": dv.findtext('main:formula2', default="", namespaces=NS),
-             }
-             metadata['validations'].append(dv_info)
+             })
 
-    # 3. Extract Conditional Formatting
-    # <conditionalFormatting sqref="E3:E14"> <cfRule type="colorScale" ...>
-    for cf in root.findall('main:conditionalFormatting', NS):
-        sqref = cf.get('sqref')
-        for rule in cf.findall('main:cfRule', NS):
+    elif tag == 'conditionalFormatting':
+        # <conditionalFormatting sqref="E3:E14"> <cfRule type="colorScale" ...>
+        sqref = elem.get('sqref')
+        for rule in elem.findall('main:cfRule', NS):
             metadata['conditional_formatting'].append({
                 "sqref": sqref,
                 "type": rule.get('type'),
@@ -541,54 +774,29 @@ def parse_sheet_full(sheet_xml_path, shared_strings, unzip_dir=None, sheet_filen
                 "formula": rule.findtext('main:formula', default="", namespaces=NS)
             })
 
-    # 4. Extract Drawings (Charts, Shapes, Connectors)
-    drawing = root.find('main:drawing', NS)
-    if drawing is not None:
-        dr_rid = drawing.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
-        if unzip_dir and sheet_filename:
-            sheet_rels = parse_sheet_rels(unzip_dir, sheet_filename)
-            dr_info = sheet_rels.get(dr_rid)
-            if dr_info:
-                 dr_path_rel = dr_info.get("target")
-                 # Correct path resolution
-                 if dr_path_rel.startswith('../'):
-                     dr_full_path = os.path.normpath(os.path.join(unzip_dir, 'xl', 'worksheets', dr_path_rel))
-                 else:
-                     dr_full_path = os.path.join(unzip_dir, 'xl', 'drawings', os.path.basename(dr_path_rel))
-                     
-                 drawing_data = parse_drawing_xml(dr_full_path, unzip_dir)
-                 for obj in drawing_data.get("objects", []):
-                     metadata['drawings'].append(obj)
-        else:
-            metadata['drawings'].append(f"Drawing Reference rId={dr_rid}")
-        
-    legacy = root.find('main:legacyDrawing', NS)
-    if legacy is not None:
-        rid = legacy.get('{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id')
-        metadata['drawings'].append(f"Legacy Drawing Reference rId={rid}")
-
-    # 5. Check Rels for Pivot Tables (if context provided)
-    if unzip_dir and sheet_filename:
-        rels = parse_sheet_rels(unzip_dir, sheet_filename)
-        for rid, info in rels.items():
-            if "pivotTable" in info.get("type", ""):
-                 target = info.get("target") # e.g. ../pivotTables/pivotTable1.xml
-                 pivot_path = os.path.normpath(os.path.join(unzip_dir, 'xl', 'worksheets', target))
-                 pivot_details = parse_pivot_table_xml(pivot_path)
-                 metadata['drawings'].append({
-                     "type": "pivotTable",
-                     "rId": rid,
-                     "details": pivot_details
-                 })
+    elif tag == 'drawing':
+        refs.setdefault('drawing', elem.get(f"{{{NS['r']}}}id"))
 
-    # 6. Extract Sparklines
-    # Sparklines are in an extension list or sparklineGroups element
-    sgs = root.find('main:extLst/main:ext/{http://schemas.microsoft.com/office/spreadsheetml/2009/9/main}sparklineGroups', NS)
-    if sgs is None:
-        # Some versions might have it elsewhere or without extension list
-        sgs = root.find('.//x14:sparklineGroups', NS)
-        
-    if sgs is not None:
+    elif tag == 'legacyDrawing':
+        refs.setdefault('legacyDrawing', elem.get(f"{{{NS['r']}}}id"))
+
+    elif tag == 'mergeCells':
+        for mc in elem.findall('main:mergeCell', NS):
+            metadata['merge_cells'].append(mc.get('ref'))
+
+    elif tag == 'sheetViews':
+        view = elem.find('main:sheetView', NS)
+        if view is not None and not metadata['view_settings']:
+            metadata['view_settings'] = {
+                "tabSelected": view.get('tabSelected') == "1",
+                "showGridLines": view.get('showGridLines') != "0",
+                "zoomScale": view.get('zoomScale')
+            }
+
+    # Sparklines live in an extension list (<extLst><ext><x14:sparklineGroups>)
+    sgs = elem if elem.tag == SPARKLINE_GROUPS_TAG else elem.find('.//x14:sparklineGroups', NS)
+    if sgs is not None and 'sparklines' not in refs:
+        refs['sparklines'] = True
         for group in sgs.findall('x14:sparklineGroup', NS):
             g_info = {
                 "type": group.get('type', 'line'),
@@ -601,28 +809,153 @@ def parse_sheet_full(sheet_xml_path, shared_strings, unzip_dir=None, sheet_filen
                 })
             metadata['sparklines'].append(g_info)
 
-    # 7. Extract Merged Cells
-    mcs = root.find('main:mergeCells', NS)
-    if mcs is not None:
-        for mc in mcs.findall('main:mergeCell', NS):
-            metadata['merge_cells'].append(mc.get('ref'))
+def _new_sheet_metadata():
+    return {
+        "validations": [],
+        "conditional_formatting": [],
+        "drawings": [],
+        "sparklines": [],
+        "merge_cells": [],
+        "view_settings": {}
+    }
 
-    # 8. Extract Sheet Views (Active Tab)
-    svs = root.find('main:sheetViews', NS)
-    if svs is not None:
-        view = svs.find('main:sheetView', NS)
-        if view is not None:
-            metadata['view_settings'] = {
-                "tabSelected": view.get('tabSelected') == "1",
-                "showGridLines": view.get('showGridLines') != "0",
-                "zoomScale": view.get('zoomScale')
-            }
+def iter_sheet_rows(sheet_xml_path, shared_strings, metadata=None, refs=None):
+    """
+    Streams a sheet XML with iterparse and yields (row_number, [(coord, cell_dict), ...])
+    one <row> at a time. Elements are cleared as soon as they are consumed, so memory
+    stays flat no matter how many cells the sheet holds.
+    If a metadata dict is passed, the sections outside <sheetData> (validations,
+    conditional formatting, merged cells, sparklines, view settings) are collected into it.
+    Drawing rIds are collected into refs when provided.
+    """
+    for row_num, elems in _iter_row_elems(sheet_xml_path, metadata, refs):
+        yield row_num, [_cell_from_elem(c, shared_strings) for c in elems]
+
+def _iter_row_elems(sheet_xml_path, metadata=None, refs=None):
+    """
+    The streaming core of iter_sheet_rows: yields (row_number, [<c> elements]).
+    The elements are only valid until the generator is resumed.
+    """
+    if metadata is None:
+        metadata = _new_sheet_metadata()
+    if refs is None:
+        refs = {}
+
+    c_tag = f"{{{NS['main']}}}c"
+    row_tag = f"{{{NS['main']}}}row"
+    sheet_data_tag = f"{{{NS['main']}}}sheetData"
+
+    depth = 0
+    root = None
+    sheet_data = None
+    row_cells = []
+
+    for event, elem in ET.iterparse(sheet_xml_path, events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                root = elem
+            elif depth == 2 and elem.tag == sheet_data_tag:
+                sheet_data = elem
+            continue
+
+        depth -= 1
+        if elem.tag == c_tag:
+            row_cells.append(elem)
+        elif elem.tag == row_tag:
+            r = elem.get('r')
+            yield (int(r) if r else 0), row_cells
+            row_cells = []
+            # The row is the last child of <sheetData>; drop it (and anything before it)
+            sheet_data.clear()
+        elif depth == 1:
+            if elem is not sheet_data:
+                _collect_sheet_section(elem, metadata, refs)
+            root.clear()
+
+    # Cells outside of a <row> wrapper are not valid OOXML, but don't lose them
+    if row_cells:
+        yield 0, row_cells
+
+def parse_sheet_full(sheet_xml_path, shared_strings, unzip_dir=None, sheet_filename=None):
+    """
+    Parses a sheet XML and returns (cells, metadata).
+    metadata includes validations, conditional formatting, and drawing refs.
+    If unzip_dir and sheet_filename are provided, checks .rels for Pivot tables.
+    unzip_dir can be an extracted directory, a package (see utils.package) or a Workbook;
+    sheet_xml_path is then whatever get_sheet_map returned for it.
+    Cells are streamed row by row (see iter_sheet_rows) instead of building the whole DOM,
+    and returned as a SheetCells (utils.cell_store): a read-only mapping from "A1" to the
+    usual cell dict, stored as compact arrays.
+    """
+    if unzip_dir is None:
+        if not os.path.exists(sheet_xml_path):
+            return SheetCells(), {}
+        return _parse_sheet(sheet_xml_path, shared_strings)
+
+    with workbook_from(unzip_dir) as workbook:
+        sheet_part = workbook.part_name(sheet_xml_path)
+        if not workbook.exists(sheet_part):
+            return SheetCells(), {}
+        return _parse_sheet(sheet_part, shared_strings, workbook, resolve_rels=bool(sheet_filename))
+
+def _parse_sheet(sheet_path, shared_strings, package=None, resolve_rels=False):
+    cells = SheetCells(shared_strings)
+    metadata = _new_sheet_metadata()
+    refs = {}
+
+    # 1. Stream Cells (+ Data Validations, Conditional Formatting, Sparklines, Merged Cells, Sheet Views)
+    with (package.open(sheet_path) if package is not None else open(sheet_path, 'rb')) as f:
+        for row_num, elems in _iter_row_elems(f, metadata, refs):
+            prev = (row_num, 0)
+            for c in elems:
+                prev = _store_cell_elem(cells, c, shared_strings, prev)
+
+    sheet_rels = package.read_rels(sheet_path) if resolve_rels else None
+
+    # 2. Resolve Drawings (Charts, Shapes, Connectors)
+    dr_rid = refs.get('drawing')
+    if 'drawing' in refs:
+        if sheet_rels is not None:
+            dr_info = sheet_rels.get(dr_rid)
+            if dr_info and not dr_info["external"]:
+                 # Target is resolved against xl/worksheets/, e.g. xl/drawings/drawing1.xml
+                 drawing_data = parse_drawing_xml(dr_info["target"], package)
+                 for obj in drawing_data.get("objects", []):
+                     metadata['drawings'].append(obj)
+        else:
+            metadata['drawings'].append(f"Drawing Reference rId={dr_rid}")
+
+    if 'legacyDrawing' in refs:
+        metadata['drawings'].append(f"Legacy Drawing Reference rId={refs['legacyDrawing']}")
+
+    # 3. Check Rels for Pivot Tables (if context provided)
+    if sheet_rels is not None:
+        for rid, info in sheet_rels.items():
+            if "pivotTable" in info.get("type", ""):
+                 pivot_details = parse_pivot_table_xml(info["target"], package) # e.g. xl/pivotTables/pivotTable1.xml
+                 metadata['drawings'].append({
+                     "type": "pivotTable",
+                     "rId": rid,
+                     "details": pivot_details
+                 })
 
     return cells, metadata
 
-def parse_workbook_to_json(unzip_dir):
+def parse_workbook_to_json(unzip_dir, workers=None, sheets=None):
     """
     Parses an entire workbook (all sheets) into a large JSON-friendly dict.
+    unzip_dir can be an extracted directory, a path to the .xlsx/.xlsm itself, a package
+    or a Workbook; nothing needs to be extracted to disk.
+    workers: when > 1, sheets are parsed in a process pool of that size. Shared strings
+    and styles are loaded once here and shipped once per worker; results are merged
+    back in sheet order, so the output is identical to the serial parse.
+    sheets: optional collection of sheet names to parse (lazy mode). Sheets referenced
+    from the parsed ones (chart series, cross-sheet formulas) are pulled in as well;
+    every other sheet is not parsed and only gets a one-line summary under
+    workbook_metadata.skipped_sheets.
+    Results are cached on disk by file content (see utils.parse_cache), so an unchanged
+    workbook is only parsed once.
     Returns:
     {
        "sheets": {
@@ -631,83 +964,138 @@ def parse_workbook_to_json(unzip_dir):
        }
     }
     """
-    sheet_map = get_sheet_map(unzip_dir)
-    shared_strings = get_shared_strings(unzip_dir)
-    styles = parse_styles_xml(unzip_dir)
+    def parse():
+        with workbook_from(unzip_dir) as workbook:
+            return _parse_workbook(workbook, workers, sheets)
+
+    params = None if sheets is None else sorted({n.strip().lower() for n in sheets})
+    return get_parse_cache().fetch('workbook', unzip_dir, PARSER_VERSION, parse, params)
+
+def _parse_workbook(workbook, workers=None, sheets=None):
+    sheet_map = workbook.sheet_map()
+    shared_strings = workbook.shared_strings()
+    styles = workbook.compact_styles()
     
     workbook_data = {
         "sheets": {},
         "workbook_metadata": {
-            "definedNames": {}
+            # Defined Names (Named Ranges, Solver Settings)
+            "definedNames": dict(workbook.defined_names())
         }
     }
 
-    # Extract Defined Names (Named Ranges, Solver Settings)
-    workbook_xml_path = os.path.join(unzip_dir, 'xl', 'workbook.xml')
-    if os.path.exists(workbook_xml_path):
-        wb_tree = ET.parse(workbook_xml_path)
-        wb_root = wb_tree.getroot()
-        dns = wb_root.find('main:definedNames', NS)
-        if dns is not None:
-             for dn in dns.findall('main:definedNames/main:definedName', NS) or dns.findall('main:definedName', NS):
-                 name = dn.get('name')
-                 workbook_data["workbook_metadata"]["definedNames"][name] = dn.text
-    
-    for name, path in sheet_map.items():
-        filename = os.path.basename(path)
-        cells, metadata = parse_sheet_full(path, shared_strings, unzip_dir, filename)
-        
-        # Optimization: Only include cells with content OR special formatting (borders/shading)
-        clean_cells = {}
-        for coord, data in cells.items():
-            # Resolve Style
-            s_idx = data.get('style_idx')
-            compact_style = {}
-            if s_idx in styles:
-                full_style = styles[s_idx]
-                # Prune default styles to save tokens
-                
-                # 1. Fill (Shading)
-                if full_style.get('fill', {}).get('pattern') != 'none':
-                    compact_style['fill'] = full_style['fill']
-                
-                # 2. Border (Key for "Separator Lines")
-                if full_style.get('border'):
-                    compact_style['border'] = full_style['border']
-                    
-                # 3. Number Format
-                num_fmt = full_style.get('num_fmt')
-                if num_fmt and num_fmt not in ['0', 'General']:
-                    compact_style['num_fmt'] = num_fmt
-                    
-                # 4. Font (Bold/Italic)
-                font = full_style.get('font', {})
-                if font.get('bold') or font.get('italic'):
-                    compact_style['font'] = {k: v for k, v in font.items() if v}
+    names = list(sheet_map)
+    if sheets is None:
+        pending = names
+    else:
+        wanted = {n.strip().lower() for n in sheets}
+        pending = [n for n in names if n.strip().lower() in wanted]
 
-            has_content = bool(data.get('value') or data.get('formula'))
-            has_formatting = bool(compact_style)
-            
-            # Keep cell if it has either content OR non-default formatting
-            if has_content or has_formatting:
-                if compact_style:
-                    data['style'] = compact_style
-                
-                # Cleanup internal fields
-                if 'style_idx' in data:
-                    del data['style_idx']
-                clean_cells[coord] = data
-                
-        # Skip empty sheets (unless they have metadata like drawings)
-        has_content = len(clean_cells) > 0
-        has_meta = len(metadata.get('validations', [])) > 0 or \
-                   len(metadata.get('conditional_formatting', [])) > 0 or \
-                   len(metadata.get('drawings', [])) > 0
-                   
-        if has_content or has_meta:
-            workbook_data["sheets"][name] = {
-                "cells": clean_cells,
-                "metadata": metadata
-            }
+    entries = {}
+    while pending:
+        parsed = _parse_sheet_entries(workbook, [(n, sheet_map[n]) for n in pending], shared_strings, styles, workers)
+        entries.update(parsed)
+        if sheets is None:
+            break
+        # Lazy mode: follow chart series / formula references into sheets not parsed yet
+        touched = set()
+        for entry in parsed.values():
+            touched |= referenced_sheet_names(entry)
+        pending = [n for n in names if n.strip().casefold() in touched and n not in entries]
+
+    for name in names:
+        if name not in entries:
+            dimension = workbook.sheet_dimension(sheet_map[name])
+            workbook_data["workbook_metadata"].setdefault("skipped_sheets", {})[name] = \
+                f"Not referenced by the rubric; not parsed (used range {dimension or 'unknown'})."
+        elif entries[name] is not None:
+            workbook_data["sheets"][name] = entries[name]
         
     return workbook_data
+
+def _parse_sheet_entries(workbook, sheets, shared_strings, styles, workers=None):
+    """
+    Parses [(name, part), ...] and returns { name: entry or None } in the same order.
+    """
+    if workers and workers > 1 and len(sheets) > 1:
+        entries = _parse_sheets_parallel(workbook, sheets, shared_strings, styles, workers)
+    else:
+        entries = (_build_sheet_entry(workbook, part, shared_strings, styles) for _, part in sheets)
+    return {name: entry for (name, _), entry in zip(sheets, entries)}
+
+def referenced_sheet_names(entry):
+    """
+    Returns the (case-folded) sheet names referenced by a parsed sheet's formulas, charts,
+    sparklines and data validation lists.
+    """
+    if not entry:
+        return set()
+
+    metadata = entry.get("metadata", {})
+    refs = [data.get('formula') or "" for data in entry.get("cells", {}).values()]
+    for obj in metadata.get("drawings", []):
+        if isinstance(obj, dict) and obj.get("type") == "chart":
+            details = obj.get("details", {})
+            refs.append(details.get("title_formula", ""))
+            for ser in details.get("series", []):
+                refs.extend([ser.get("values", ""), ser.get("categories", ""), ser.get("name", "")])
+    for sl_group in metadata.get("sparklines", []):
+        refs.extend(sl.get("data_range") or "" for sl in sl_group.get("sparklines", []))
+    for validation in metadata.get("validations", []):
+        refs.extend([validation.get("formula1") or "", validation.get("formula2") or ""])
+
+    names = set()
+    for ref in refs:
+        if ref and '!' in str(ref):
+            for quoted, bare in SHEET_REF_RE.findall(str(ref)):
+                names.add((quoted.replace("''", "'") if quoted else bare).strip().casefold())
+    return names
+
+def _build_sheet_entry(workbook, part, shared_strings, styles):
+    """
+    Parses one sheet and prunes it for the JSON dump.
+    styles is the compact style table (see parse_styles_xml(compact=True)).
+    Returns { "cells": {...}, "metadata": {...} }, or None for an empty sheet.
+    """
+    cells, metadata = parse_sheet_full(part, shared_strings, workbook, posixpath.basename(part))
+    
+    # Optimization: Only include cells with content OR special formatting (borders/shading).
+    # Styles resolve through the precomputed per-index table, shared between cells.
+    clean_cells = cells.compact(styles)
+            
+    # Skip empty sheets (unless they have metadata like drawings)
+    has_content = len(clean_cells) > 0
+    has_meta = len(metadata.get('validations', [])) > 0 or \
+               len(metadata.get('conditional_formatting', [])) > 0 or \
+               len(metadata.get('drawings', [])) > 0
+               
+    if has_content or has_meta:
+        return {
+            "cells": clean_cells,
+            "metadata": metadata
+        }
+    return None
+
+# Per-process state for parallel sheet parsing (set once by the pool initializer)
+_SHEET_WORKER = {}
+
+def _init_sheet_worker(source, shared_strings, styles):
+    _SHEET_WORKER['workbook'] = Workbook(source)
+    _SHEET_WORKER['shared_strings'] = shared_strings
+    _SHEET_WORKER['styles'] = styles
+
+def _parse_sheet_in_worker(part):
+    return _build_sheet_entry(_SHEET_WORKER['workbook'], part,
+                              _SHEET_WORKER['shared_strings'], _SHEET_WORKER['styles'])
+
+def _parse_sheets_parallel(workbook, sheets, shared_strings, styles, workers):
+    """
+    Parses sheets in a process pool and returns their entries in sheet order.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    workers = min(workers, len(sheets))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_sheet_worker,
+                             initargs=(workbook.package.portable_source(), shared_strings, styles)) as pool:
+        # map() yields in submission order, so the merge is deterministic
+        return list(pool.map(_parse_sheet_in_worker, [part for _, part in sheets]))
@@ -1,8 +1,5 @@
 import json
 import os
-import shutil
-import tempfile
-import zipfile
 from utils.xml_helper import parse_workbook_to_json
 from grader import grade_submission
 
@@ -11,34 +8,27 @@ def verify_deep_charts():
     sub_path = "Data Visualization (2) copy.xlsm"
     print(f"--- 1. Verifying JSON extraction for: {sub_path} ---")
     
-    td = tempfile.mkdtemp()
-    try:
-        with zipfile.ZipFile(sub_path, 'r') as z:
-            z.extractall(td)
-        
-        data = parse_workbook_to_json(td)
+    # Parsed straight from the archive, no extraction needed
+    data = parse_workbook_to_json(sub_path)
+    
+    # Look for drawings with details
+    found_chart = False
+    for sheet_name, sheet_data in data.get("sheets", {}).items():
+        drawings = sheet_data.get("metadata", {}).get("drawings", [])
+        for d in drawings:
+            if isinstance(d, dict) and d.get("type") == "chart":
+                details = d.get("details", {})
+                if "type" in details and "axes" in details:
+                     print(f"SUCCESS: Found chart in sheet '{sheet_name}'")
+                     print(f"Chart Type: {details['type']}")
+                     print(f"Axes: {list(details['axes'].keys())}")
+                     found_chart = True
+                     break
+        if found_chart: break
         
-        # Look for drawings with details
-        found_chart = False
-        for sheet_name, sheet_data in data.get("sheets", {}).items():
-            drawings = sheet_data.get("metadata", {}).get("drawings", [])
-            for d in drawings:
-                if isinstance(d, dict) and d.get("type") == "chart":
-                    details = d.get("details", {})
-                    if "type" in details and "axes" in details:
-                         print(f"SUCCESS: Found chart in sheet '{sheet_name}'")
-                         print(f"Chart Type: {details['type']}")
-                         print(f"Axes: {list(details['axes'].keys())}")
-                         found_chart = True
-                         break
-            if found_chart: break
-            
-        if not found_chart:
-            print("FAIL: No chart details extracted in JSON.")
-            return
-
-    finally:
-        shutil.rmtree(td)
+    if not found_chart:
+        print("FAIL: No chart details extracted in JSON.")
+        return
 
     # 2. Verify AI Grading (Full Pipeline)
     print(f"\n--- 2. Verifying AI Grading for: {sub_path} ---")